@@ -1,7 +1,9 @@
+import asyncio
+import aiohttp
+from aiohttp import web
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
-import json
 import os
 import io
 import logging
@@ -9,21 +11,26 @@ import re
 import random
 from datetime import datetime, timedelta
 from config import Config
-from flask import Flask, jsonify
-from flask_cors import CORS
-import threading
+from logging_setup import setup_logging, MESSAGE_LOGGER_NAME
+from storage import create_storage
+from journal import DeliveryJournal
+from filters import KeywordMatcher, create_content_filter, RULE_MASS_MENTION, RULE_INVITE, RULE_LINK
+from outbound import OutboundScheduler, OutboundQueueFull, PRIORITY_MODERATION, PRIORITY_RELAY, PRIORITY_NOTIFICATION, PRIORITY_NAMES
+from metrics import registry, CONTENT_TYPE
+from stats import StatsAggregate
+from throughput import ThroughputStats, WINDOW_NAMES, save_snapshot as save_throughput_snapshot, load_snapshot as load_throughput_snapshot
 import time
+from collections import deque
+from types import MappingProxyType
+from timers import TimerWheel, TTLMap
+from leaderboard import Leaderboard
+from levels import LevelStore, create_level_curve
 
-# Настройка логирования
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(Config.LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Настройка логирования: записи передаются через очередь, файл и консоль обслуживает отдельный поток
+log_listener = setup_logging()
 logger = logging.getLogger('DiscordBot')
+# Построчные отладочные записи о каждом сообщении (пишется выборка, см. LOG_MESSAGE_SAMPLE_RATE)
+message_logger = logging.getLogger(MESSAGE_LOGGER_NAME)
 
 # Настройки бота
 intents = discord.Intents.default()
@@ -31,48 +38,71 @@ intents.message_content = True
 intents.guilds = True
 intents.members = True  # Необходимо для отслеживания присоединения участников
 
-bot = commands.Bot(command_prefix=Config.COMMAND_PREFIX, intents=intents)
+class RelayBot(commands.Bot):
+    """Бот с HTTP API статистики, работающим в том же цикле событий"""
+    
+    async def setup_hook(self):
+        await start_api_server()
+    
+    async def close(self):
+        # Сначала перестаём принимать запросы API, затем отключаемся от Discord
+        await stop_api_server()
+        await super().close()
+
+# Планировщик исходящих сообщений: лимиты по webhook'ам и каналам, приоритет модерации
+outbound = OutboundScheduler()
+
+# Заголовки лимитов каждого ответа Discord (и для webhook'ов бота) настраивают корзины планировщика
+bot = RelayBot(command_prefix=Config.COMMAND_PREFIX, intents=intents, http_trace=outbound.create_trace_config())
+
+# Хранилище каналов, чёрного списка и уровней (JSON или SQLite, см. STORAGE_BACKEND)
+# Все записи выполняются в отдельном потоке хранилища, вне цикла событий
+storage = create_storage()
+
+# Журнал доставок: незавершённые пересылки повторяются после сбоев и перезапуска
+journal = DeliveryJournal() if Config.JOURNAL_ENABLED else None
+
+# Счётчики пересылки по сетям и серверам: поминутно за час, по часам за сутки, по дням за месяц
+throughput = ThroughputStats()
+
+# Сводная статистика для API: поддерживается событиями в цикле бота,
+# API отдаёт только последний опубликованный снимок
+bot_stats = StatsAggregate()
 
 # Загрузка конфигурации каналов
 def load_channels_config():
     """Загружает конфигурацию связанных каналов"""
-    if os.path.exists(Config.CHANNELS_CONFIG_FILE):
-        try:
-            with open(Config.CHANNELS_CONFIG_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                # Проверяем формат данных и конвертируем старый формат в новый
-                if data and isinstance(list(data.values())[0], str):
-                    # Старый формат: {channel_id: network_name}
-                    logger.info("Конвертируем старый формат конфигурации в новый")
-                    new_data = {}
-                    for channel_id, network_name in data.items():
-                        new_data[channel_id] = {
-                            'network': network_name,
-                            'guild_id': None,
-                            'guild_name': 'Неизвестно',
-                            'channel_name': 'Неизвестно',
-                            'linked_at': datetime.utcnow().isoformat(),
-                            'linked_by': 'Неизвестно'
-                        }
-                    save_channels_config(new_data)
-                    return new_data
-                
-                logger.info(f"Загружена конфигурация каналов: {len(data)} каналов")
-                return data
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке конфигурации каналов: {e}")
+    try:
+        data = storage.load_channels()
+        logger.info("Загружена конфигурация каналов: %s каналов", len(data))
+        return data
+    except Exception as e:
+        logger.error("Ошибка при загрузке конфигурации каналов: %s", e)
     return {}
 
 # Сохранение конфигурации каналов
-def save_channels_config(config):
-    """Сохраняет конфигурацию связанных каналов"""
-    try:
-        with open(Config.CHANNELS_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-        logger.info(f"Конфигурация каналов сохранена: {len(config)} каналов")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении конфигурации каналов: {e}")
+def save_channels_config(config, changed_ids=()):
+    """Сохраняет конфигурацию связанных каналов (запись выполняется в потоке хранилища)
+
+    changed_ids - добавленные, изменённые и удалённые каналы: хранилище с построчной записью
+    пишет только их. Без них конфигурация сохраняется целиком.
+    """
+    count = len(config)
+    changed_ids = tuple(changed_ids)
+    if storage.partial_writes and changed_ids:
+        snapshot = {channel_id: dict(config[channel_id]) for channel_id in changed_ids if channel_id in config}
+    else:
+        snapshot = dict(config)
+    
+    def log_result(future):
+        # Вызывается в потоке хранилища после фактической записи
+        error = future.exception()
+        if error is not None:
+            logger.error("Ошибка при сохранении конфигурации каналов: %s", error)
+        else:
+            logger.info("Конфигурация каналов сохранена: %s каналов", count)
+    
+    storage.submit(storage.save_channels, snapshot, changed_ids).add_done_callback(log_result)
 
 # Для совместимости со старым кодом
 def load_config():
@@ -86,67 +116,238 @@ def save_config():
 # Глобальная переменная для хранения связанных каналов
 linked_channels = load_channels_config()
 
-# Антиспам система - словарь для отслеживания времени последних сообщений пользователей
-# Структура: {user_id: [timestamp1, timestamp2, ...]} - последние сообщения за период
+# Таблица маршрутизации: {network_name: ((channel_id, guild_id), ...)}
+# Неизменяемый снимок, пересобирается целиком при каждом изменении linked_channels,
+# поэтому пересылка может читать его между await без риска изменения во время итерации
+routing_table = MappingProxyType({})
+routing_table_version = 0
+
+# Индекс связанных каналов по серверам: {str(guild_id): (channel_id, ...)}
+guild_channel_index = MappingProxyType({})
+
+def rebuild_routing_table():
+    """Пересобирает таблицу маршрутизации сетей по текущей конфигурации каналов"""
+    global routing_table, routing_table_version, guild_channel_index
+    networks = {}
+    guilds = {}
+    for channel_id, channel_info in linked_channels.items():
+        networks.setdefault(channel_info['network'], []).append((channel_id, channel_info.get('guild_id')))
+        guilds.setdefault(str(channel_info.get('guild_id')), []).append(channel_id)
+    
+    # Счётчики удалённых сетей больше не нужны (иначе они копятся бесконечно)
+    for network_name in routing_table.keys() - networks.keys():
+        throughput.forget('networks', network_name)
+    
+    routing_table = MappingProxyType({name: tuple(routes) for name, routes in networks.items()})
+    guild_channel_index = MappingProxyType({guild_id: tuple(channel_ids) for guild_id, channel_ids in guilds.items()})
+    routing_table_version += 1
+    bot_stats.set_links(len(routing_table), len(linked_channels))
+    logger.debug("Таблица маршрутизации обновлена (версия %s): %s сетей", routing_table_version, len(routing_table))
+
+rebuild_routing_table()
+
+# Антиспам система - кольцевые буферы времени последних сообщений пользователей
+# Структура: {user_id: deque([timestamp1, timestamp2, ...], maxlen=ANTISPAM_MAX_MESSAGES)}
 user_message_times = {}
 
 # Словарь для отслеживания замученных пользователей
 # Структура: {user_id: timestamp_when_mute_ends}
 muted_users = {}
 
+# Колесо таймеров антиспама: ('idle', user_id) - окно пользователя опустело,
+# ('mute', user_id) - истёк мут. Очистка затрагивает только истёкшие записи
+antispam_timers = TimerWheel()
+
+def expire_antispam_state(now=None):
+    """Удаляет истёкшие окна сообщений и муты по сработавшим таймерам"""
+    now = time.time() if now is None else now
+    expired = antispam_timers.advance(now)
+    for kind, user_id in expired:
+        if kind == 'idle':
+            user_message_times.pop(user_id, None)
+        elif muted_users.get(user_id, now) <= now:
+            muted_users.pop(user_id, None)
+    return len(expired)
+
+# Ограничители параллельной пересылки: общий на процесс и отдельный для каждой сети
+relay_semaphore = asyncio.Semaphore(Config.RELAY_MAX_CONCURRENCY)
+network_semaphores = {}
+
+def get_network_semaphore(network_name):
+    """Возвращает семафор, ограничивающий параллельную пересылку внутри сети"""
+    semaphore = network_semaphores.get(network_name)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(Config.RELAY_NETWORK_CONCURRENCY)
+        network_semaphores[network_name] = semaphore
+    return semaphore
+
+# Конвейер обработки сообщений
+# Пересылка выполняется обработчиками очередей; сообщения одного канала всегда попадают
+# в одну очередь, поэтому порядок внутри канала сохраняется
+relay_queues = []
+relay_workers = []
+relay_queue_stats = {'enqueued': 0, 'dropped': 0}
+
+# Побочная работа (XP, отчёты о нарушениях, уведомления) выполняется фоновыми задачами
+background_tasks = set()
+
+# Время стадий обработки: {stage: {'count': n, 'total': секунды, 'max': секунды}}
+pipeline_stats = {}
+
+# Метрики Prometheus (отдаются на /metrics)
+STAGE_LATENCY = registry.histogram('relay_pipeline_stage_seconds', 'Время стадий обработки сообщений', ('stage',))
+RELAY_LATENCY = registry.histogram('relay_end_to_end_seconds', 'Время от получения сообщения до доставки в последний канал сети')
+RELAYED_MESSAGES = registry.counter('relay_messages_total', 'Пересланные сообщения по сетям', ('network',))
+RELAY_DELIVERIES = registry.counter('relay_deliveries_total', 'Доставки в целевые каналы по сетям и результату', ('network', 'status'))
+DELIVERY_RETRIES = registry.counter('relay_delivery_retries_total', 'Доставки, отложенные для повтора через журнал')
+DROPPED_ATTACHMENTS = registry.counter('relay_dropped_attachments_total', 'Вложения, которые не удалось переслать', ('reason',))
+
+def record_stage(stage, started):
+    """Учитывает время стадии, начатой в момент started (по time.perf_counter())"""
+    elapsed = time.perf_counter() - started
+    stats = pipeline_stats.get(stage)
+    if stats is None:
+        stats = pipeline_stats[stage] = {'count': 0, 'total': 0.0, 'max': 0.0}
+    stats['count'] += 1
+    stats['total'] += elapsed
+    stats['max'] = max(stats['max'], elapsed)
+    STAGE_LATENCY.observe(elapsed, stage)
+    return elapsed
+
+def spawn_background(coro, stage):
+    """Запускает побочную работу фоновой задачей, не задерживая обработку сообщения"""
+    started = time.perf_counter()
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    
+    def on_done(task):
+        background_tasks.discard(task)
+        record_stage(stage, started)
+        if not task.cancelled() and task.exception():
+            logger.error("Ошибка в фоновой задаче '%s': %s", stage, task.exception())
+    
+    task.add_done_callback(on_done)
+    return task
+
+async def relay_worker(queue):
+    """Обработчик очереди пересылки: сообщения очереди пересылаются по одному в порядке поступления"""
+    while True:
+        message, scan, received_at, queued_at, xp_task = await queue.get()
+        record_stage('relay_queue_wait', queued_at)
+        started = time.perf_counter()
+        try:
+            if await relay_message(message, scan, xp_task):
+                RELAY_LATENCY.observe(time.perf_counter() - received_at)
+        except Exception as e:
+            logger.error("Ошибка обработчика пересылки: %s", e)
+        finally:
+            record_stage('relay', started)
+            queue.task_done()
+
+def start_relay_workers():
+    """Создаёт очереди и обработчики пересылки (один раз за время работы процесса)"""
+    if relay_workers:
+        return
+    for _ in range(Config.RELAY_WORKERS):
+        queue = asyncio.Queue(maxsize=Config.RELAY_QUEUE_SIZE)
+        relay_queues.append(queue)
+        relay_workers.append(asyncio.create_task(relay_worker(queue)))
+    logger.info("Запущено %s обработчиков очереди пересылки", Config.RELAY_WORKERS)
+
+def enqueue_relay(message, scan, received_at, xp_task=None):
+    """Ставит сообщение в очередь пересылки своего канала; возвращает False, если очередь переполнена
+
+    xp_task - фоновое начисление XP за это же сообщение: пересылка дождётся его,
+    чтобы показать уровень с учётом этого сообщения.
+    """
+    if not relay_queues:
+        # Обработчики ещё не запущены - пересылаем отдельной задачей
+        spawn_background(relay_message(message, scan, xp_task), 'relay')
+        return True
+    
+    queue = relay_queues[message.channel.id % len(relay_queues)]
+    try:
+        queue.put_nowait((message, scan, received_at, time.perf_counter(), xp_task))
+    except asyncio.QueueFull:
+        relay_queue_stats['dropped'] += 1
+        logger.error("Очередь пересылки переполнена (%s), сообщение %s не будет переслано", Config.RELAY_QUEUE_SIZE, message.id)
+        return False
+    relay_queue_stats['enqueued'] += 1
+    return True
+
+def get_pipeline_stats():
+    """Возвращает метрики конвейера: время стадий, глубину очередей и число фоновых задач"""
+    return {
+        'stages': {
+            stage: {
+                'count': stats['count'],
+                'avg': stats['total'] / stats['count'] if stats['count'] else 0.0,
+                'max': stats['max']
+            }
+            for stage, stats in pipeline_stats.items()
+        },
+        'relay_queue_depth': sum(queue.qsize() for queue in relay_queues),
+        'relay_enqueued': relay_queue_stats['enqueued'],
+        'relay_dropped': relay_queue_stats['dropped'],
+        'background_tasks': len(background_tasks)
+    }
+
 # Система чёрного списка
+# Список хранится в памяти, хранилище читается при запуске и при внешнем изменении
+blacklist = set()
+
 def load_blacklist():
-    """Загружает чёрный список из файла"""
-    if os.path.exists(Config.BLACKLIST_FILE):
-        try:
-            with open(Config.BLACKLIST_FILE, 'r', encoding='utf-8') as f:
-                return set(json.load(f))
-        except (json.JSONDecodeError, FileNotFoundError):
-            logger.warning(f"Не удалось загрузить чёрный список из {Config.BLACKLIST_FILE}")
-            return set()
-    return set()
-
-def save_blacklist(blacklist):
-    """Сохраняет чёрный список в файл"""
+    """Загружает чёрный список из хранилища"""
     try:
-        with open(Config.BLACKLIST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(list(blacklist), f, ensure_ascii=False, indent=2)
+        return storage.load_blacklist()
     except Exception as e:
-        logger.error(f"Ошибка при сохранении чёрного списка: {e}")
+        logger.warning("Не удалось загрузить чёрный список: %s", e)
+        return set()
+
+async def reload_blacklist_if_changed():
+    """Перечитывает чёрный список, если он был изменён извне; возвращает True при перезагрузке"""
+    global blacklist
+    if not await storage.run(storage.blacklist_changed):
+        return False
+    
+    blacklist = await storage.run(load_blacklist)
+    return True
+
+def save_blacklist(blacklist, changed_ids=()):
+    """Сохраняет чёрный список (запись выполняется в потоке хранилища)"""
+    storage.submit(storage.save_blacklist, frozenset(blacklist), tuple(changed_ids))
 
-def add_to_blacklist(user_id):
+async def add_to_blacklist(user_id):
     """Добавляет пользователя в чёрный список"""
-    blacklist = load_blacklist()
-    blacklist.add(str(user_id))
-    save_blacklist(blacklist)
-    logger.info(f"Пользователь {user_id} добавлен в чёрный список")
+    user_id_str = str(user_id)
+    # Файл перезаписывается из памяти целиком - сначала подхватываем внешние изменения
+    await reload_blacklist_if_changed()
+    blacklist.add(user_id_str)
+    save_blacklist(blacklist, [user_id_str])
+    logger.info("Пользователь %s добавлен в чёрный список", user_id)
     return True
 
-def remove_from_blacklist(user_id):
+async def remove_from_blacklist(user_id):
     """Удаляет пользователя из чёрного списка"""
-    blacklist = load_blacklist()
     user_id_str = str(user_id)
+    await reload_blacklist_if_changed()
     if user_id_str in blacklist:
         blacklist.remove(user_id_str)
-        save_blacklist(blacklist)
-        logger.info(f"Пользователь {user_id} удалён из чёрного списка")
+        save_blacklist(blacklist, [user_id_str])
+        logger.info("Пользователь %s удалён из чёрного списка", user_id)
         return True
     return False
 
 def is_blacklisted(user_id):
     """Проверяет, находится ли пользователь в чёрном списке"""
-    blacklist = load_blacklist()
     return str(user_id) in blacklist
 
-def remove_links_from_text(text):
-    """Удаляет ссылки из текста, заменяя их на '(ссылка удалена)'"""
-    # Паттерн для поиска URL (http, https, ftp, www)
-    url_pattern = r'(?:(?:https?|ftp)://|www\.)(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    
-    # Заменяем найденные ссылки на текст
-    modified_text = re.sub(url_pattern, '(ссылка удалена)', text)
-    
-    return modified_text
+# Фильтр содержимого: правила компилируются один раз, сообщение проверяется за один проход
+content_filter = create_content_filter()
+
+def scan_message(message):
+    """Проверяет текст сообщения правилами фильтра и возвращает вердикты и текст без ссылок"""
+    return content_filter.scan(message.content)
 
 async def send_violation_report(message, violation_type, original_content=None):
     """Отправляет уведомление о нарушении в канал модерации"""
@@ -155,7 +356,7 @@ async def send_violation_report(message, violation_type, original_content=None):
     try:
         moderation_channel = bot.get_channel(moderation_channel_id)
         if not moderation_channel:
-            logger.error(f"Канал модерации {moderation_channel_id} не найден")
+            logger.error("Канал модерации %s не найден", moderation_channel_id)
             return
         
         # Создаем embed с информацией о нарушении
@@ -224,96 +425,186 @@ async def send_violation_report(message, violation_type, original_content=None):
                 inline=False
             )
         except Exception as e:
-            logger.warning(f"Не удалось создать инвайт для сервера {message.guild.name}: {e}")
+            logger.warning("Не удалось создать инвайт для сервера %s: %s", message.guild.name, e)
             embed.add_field(
                 name="Инвайт на сервер",
                 value="Не удалось создать инвайт",
                 inline=False
             )
         
-        await moderation_channel.send(embed=embed)
-        logger.info(f"Отправлено уведомление о нарушении: {violation_type} от {message.author.name} на сервере {message.guild.name}")
+        await outbound.send_channel(moderation_channel, embed=embed, priority=PRIORITY_MODERATION)
+        logger.info("Отправлено уведомление о нарушении: %s от %s на сервере %s", violation_type, message.author.name, message.guild.name)
         
     except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления о нарушении: {e}")
+        logger.error("Ошибка при отправке уведомления о нарушении: %s", e)
+
+# Система уровней: записи в типизированных массивах вместо словаря на пользователя
+levels_data = LevelStore()
+# Кривая уровней (LEVELS_CURVE): таблица порогов XP считается один раз при запуске
+level_curve = create_level_curve()
+# Рейтинг по XP: обновляется в add_xp, место и страницы топа без сортировки всех пользователей
+leaderboard = Leaderboard()
+# Кулдаун XP: записи старше LEVELS_COOLDOWN_SECONDS удаляются, в памяти только активные пользователи
+last_xp_time = TTLMap(Config.LEVELS_COOLDOWN_SECONDS)
+
+# Отложенная запись уровней: изменения копятся в памяти и сбрасываются в хранилище фоновой задачей
+levels_dirty_users = set()
+levels_flush_lock = asyncio.Lock()
 
-# Система уровней
-levels_data = {}
-last_xp_time = {}  # Для отслеживания кулдауна XP
+def levels_paging_enabled():
+    """Выгрузка неактивных пользователей возможна только при построчной записи (SQLite)"""
+    return Config.LEVELS_HOT_DAYS > 0 and storage.partial_writes
+
+def get_levels_hot_cutoff():
+    """Время, после которого пользователь считается активным и держится в памяти"""
+    return time.time() - Config.LEVELS_HOT_DAYS * 86400
 
 def load_levels():
-    """Загружает данные уровней из файла"""
+    """Загружает данные уровней из хранилища (при выгрузке - только активных пользователей)"""
     global levels_data
     try:
-        if os.path.exists(Config.LEVELS_FILE):
-            with open(Config.LEVELS_FILE, 'r', encoding='utf-8') as f:
-                levels_data = json.load(f)
-                logger.info(f"Загружены данные уровней для {len(levels_data)} пользователей")
-        else:
-            levels_data = {}
-            logger.info("Файл уровней не найден, создан новый")
+        if levels_paging_enabled():
+            cutoff = get_levels_hot_cutoff()
+            levels_data = LevelStore.from_dict(storage.load_levels(active_since=cutoff))
+            leaderboard.rebuild(dict(levels_data.xp_items()))
+            # Неактивные остаются на диске, в памяти только их ID и XP для рейтинга
+            leaderboard.cold.load(*storage.load_level_ranking(cutoff))
+            logger.info("Загружены данные уровней: %s активных пользователей, %s неактивных оставлены на диске", len(levels_data), len(leaderboard.cold))
+            return
+        levels_data = LevelStore.from_dict(storage.load_levels())
+        logger.info("Загружены данные уровней для %s пользователей", len(levels_data))
     except Exception as e:
-        logger.error(f"Ошибка при загрузке уровней: {e}")
-        levels_data = {}
+        logger.error("Ошибка при загрузке уровней: %s", e)
+        levels_data = LevelStore()
+    leaderboard.rebuild(dict(levels_data.xp_items()))
+
+def restore_levels(user_id, record):
+    """Возвращает запись выгруженного пользователя в память"""
+    if record is None:
+        # Записи на диске нет - убираем пользователя и из рейтинга
+        leaderboard.remove(user_id)
+        return
+    levels_data.set(user_id, record)
+    leaderboard.update(user_id, levels_data.xp[levels_data.row(user_id)])
+
+def require_levels_loaded(user_id):
+    """Проверяет, что запись пользователя в памяти: синхронные функции уровней не читают диск в цикле событий"""
+    if user_id in levels_data or not leaderboard.is_cold(user_id):
+        return
+    logger.error("Запись уровня пользователя %s выгружена: перед обращением нужен await ensure_levels_loaded()", user_id)
+    raise LookupError(f"Запись уровня пользователя {user_id} не загружена")
+
+async def ensure_levels_loaded(user_id):
+    """Подгружает запись выгруженного пользователя в потоке хранилища, не блокируя цикл событий"""
+    if user_id in levels_data or not leaderboard.is_cold(user_id):
+        return
+    record = await storage.run(storage.load_level, str(user_id))
+    # За время чтения запись могла появиться в памяти другим путём
+    if user_id not in levels_data and leaderboard.is_cold(user_id):
+        restore_levels(user_id, record)
+
+async def page_out_levels():
+    """Выгружает из памяти пользователей, не писавших LEVELS_HOT_DAYS дней"""
+    # Сначала сохраняем изменения: выгружать можно только записи, совпадающие с диском
+    await flush_levels()
+    async with levels_flush_lock:
+        user_ids = [user_id for user_id in levels_data.inactive(get_levels_hot_cutoff()) if str(user_id) not in levels_dirty_users]
+        for user_id in user_ids:
+            levels_data.remove(user_id)
+        leaderboard.page_out(user_ids)
+    if user_ids:
+        logger.info("Выгружены неактивные пользователи: %s, в памяти осталось %s", len(user_ids), len(levels_data))
+
+def get_levels_snapshot(user_ids):
+    """Копирует записи для сохранения: только изменённые, если хранилище поддерживает построчную запись"""
+    if storage.partial_writes:
+        return {user_id: levels_data.get(user_id) for user_id in user_ids if user_id in levels_data}
+    return dict(levels_data.items())
 
 def save_levels():
-    """Сохраняет данные уровней в файл"""
+    """Синхронно сохраняет все несохранённые изменения уровней"""
     try:
-        with open(Config.LEVELS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(levels_data, f, ensure_ascii=False, indent=2)
+        # Через поток хранилища, чтобы запись встала в очередь после уже отправленных
+        storage.submit(storage.save_levels, get_levels_snapshot(levels_dirty_users)).result()
+        levels_dirty_users.clear()
     except Exception as e:
-        logger.error(f"Ошибка при сохранении уровней: {e}")
+        logger.error("Ошибка при сохранении уровней: %s", e)
+
+def mark_levels_dirty(user_id_str):
+    """Отмечает изменение данных пользователя и запускает досрочную запись при превышении порога"""
+    levels_dirty_users.add(user_id_str)
+    if len(levels_dirty_users) >= Config.LEVELS_FLUSH_THRESHOLD and not levels_flush_lock.locked():
+        spawn_background(flush_levels(), 'levels_flush')
+
+async def flush_levels():
+    """Сбрасывает накопленные изменения уровней в хранилище"""
+    async with levels_flush_lock:
+        if not levels_dirty_users:
+            return
+        
+        # Снимок делаем в цикле событий, чтобы поток хранилища не видел изменений посреди записи
+        dirty_users = set(levels_dirty_users)
+        levels_dirty_users.clear()
+        snapshot = get_levels_snapshot(dirty_users)
+        
+        saved = False
+        try:
+            await storage.run(storage.save_levels, snapshot)
+            saved = True
+            logger.debug("Данные уровней сохранены: %s записей, %s изменённых пользователей", len(snapshot), len(dirty_users))
+        except Exception as e:
+            logger.error("Ошибка при сохранении уровней: %s", e)
+        finally:
+            if not saved:
+                # Возвращаем пользователей в очередь (и при отмене задачи во время остановки),
+                # чтобы их записала следующая запись или финальный save_levels()
+                levels_dirty_users.update(dirty_users)
 
 def calculate_level(xp):
-    """Вычисляет уровень на основе XP"""
-    # Формула: level = floor(sqrt(xp / 100))
-    return int((xp / 100) ** 0.5)
+    """Вычисляет уровень на основе XP (бинарный поиск по таблице порогов)"""
+    return level_curve.level(xp)
 
 def calculate_xp_for_level(level):
     """Вычисляет необходимое XP для достижения уровня"""
-    return level * level * 100
+    return level_curve.xp_for_level(level)
 
 def add_xp(user_id, xp_amount):
     """Добавляет XP пользователю и возвращает новый уровень"""
     user_id_str = str(user_id)
+    require_levels_loaded(user_id)
+    row = levels_data.row(user_id, create=True)
     
-    if user_id_str not in levels_data:
-        levels_data[user_id_str] = {
-            'xp': 0,
-            'level': 0,
-            'messages': 0,
-            'last_message': None,
-            'daily_bonus_claimed': None
-        }
-    
-    old_level = levels_data[user_id_str]['level']
-    levels_data[user_id_str]['xp'] += xp_amount
-    levels_data[user_id_str]['messages'] += 1
-    levels_data[user_id_str]['last_message'] = time.time()
+    old_level = levels_data.level[row]
+    levels_data.xp[row] += xp_amount
+    levels_data.messages[row] += 1
+    levels_data.last_message[row] = time.time()
     
-    new_level = calculate_level(levels_data[user_id_str]['xp'])
-    levels_data[user_id_str]['level'] = new_level
+    new_level = calculate_level(levels_data.xp[row])
+    levels_data.level[row] = new_level
     
-    save_levels()
+    leaderboard.update(user_id_str, levels_data.xp[row])
+    mark_levels_dirty(user_id_str)
     
     return new_level, old_level != new_level
 
 def get_user_level_info(user_id):
     """Получает информацию об уровне пользователя"""
     user_id_str = str(user_id)
+    require_levels_loaded(user_id)
+    row = levels_data.row(user_id)
     
-    if user_id_str not in levels_data:
+    if row is None:
         return {
             'xp': 0,
             'level': 0,
             'messages': 0,
-            'xp_for_next': 100,
-            'progress': 0
+            'xp_for_next': calculate_xp_for_level(1),
+            'progress': 0,
+            'rank': None
         }
     
-    user_data = levels_data[user_id_str]
-    current_level = user_data['level']
-    current_xp = user_data['xp']
+    current_level = levels_data.level[row]
+    current_xp = levels_data.xp[row]
     
     xp_for_current = calculate_xp_for_level(current_level)
     xp_for_next = calculate_xp_for_level(current_level + 1)
@@ -323,9 +614,10 @@ def get_user_level_info(user_id):
     return {
         'xp': current_xp,
         'level': current_level,
-        'messages': user_data['messages'],
+        'messages': levels_data.messages[row],
         'xp_for_next': xp_for_next - current_xp,
-        'progress': progress
+        'progress': progress,
+        'rank': leaderboard.rank(user_id_str)
     }
 
 async def process_xp_gain(user_id, channel):
@@ -335,11 +627,14 @@ async def process_xp_gain(user_id, channel):
     
     # Проверяем кулдаун
     current_time = time.time()
-    if user_id in last_xp_time:
-        if current_time - last_xp_time[user_id] < Config.LEVELS_COOLDOWN_SECONDS:
-            return
+    # Запись есть, пока кулдаун не истёк
+    if last_xp_time.get(user_id, now=current_time) is not None:
+        return
+    
+    last_xp_time.set(user_id, current_time, now=current_time)
     
-    last_xp_time[user_id] = current_time
+    # Запись выгруженного пользователя читаем в потоке хранилища до начисления
+    await ensure_levels_loaded(user_id)
     
     # Генерируем случайное количество XP
     xp_amount = random.randint(Config.LEVELS_XP_MIN, Config.LEVELS_XP_MAX)
@@ -347,27 +642,33 @@ async def process_xp_gain(user_id, channel):
     # Добавляем XP и проверяем повышение уровня
     new_level, level_up = add_xp(user_id, xp_amount)
     
-    # Если уровень повысился, отправляем уведомление
+    # Уведомление - отдельной задачей: пересылка ждёт только начисления XP
     if level_up and new_level > 0:
-        try:
-            # Получаем пользователя для упоминания
-            user = channel.guild.get_member(user_id)
-            user_mention = user.mention if user else f"<@{user_id}>"
-            
-            embed = discord.Embed(
-                title="🎉 Повышение уровня!",
-                description=f"Поздравляем {user_mention}! Вы достигли **{new_level} уровня**!",
-                color=Config.EMBED_COLOR_DEFAULT
-            )
-            embed.add_field(name="🔥 Новый уровень", value=str(new_level), inline=True)
-            
-            user_info = get_user_level_info(user_id)
-            embed.add_field(name="⭐ Общий XP", value=str(user_info['xp']), inline=True)
-            embed.add_field(name="💬 Сообщений", value=str(user_info['messages']), inline=True)
-            
-            await channel.send(embed=embed)
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления о повышении уровня: {e}")
+        spawn_background(notify_level_up(user_id, channel, new_level), 'level_up_notification')
+
+async def notify_level_up(user_id, channel, new_level):
+    """Отправляет уведомление о повышении уровня"""
+    try:
+        # Получаем пользователя для упоминания
+        user = channel.guild.get_member(user_id)
+        user_mention = user.mention if user else f"<@{user_id}>"
+        
+        embed = discord.Embed(
+            title="🎉 Повышение уровня!",
+            description=f"Поздравляем {user_mention}! Вы достигли **{new_level} уровня**!",
+            color=Config.EMBED_COLOR_DEFAULT
+        )
+        embed.add_field(name="🔥 Новый уровень", value=str(new_level), inline=True)
+        
+        # Пока уведомление ждало очереди, запись могла быть выгружена
+        await ensure_levels_loaded(user_id)
+        user_info = get_user_level_info(user_id)
+        embed.add_field(name="⭐ Общий XP", value=str(user_info['xp']), inline=True)
+        embed.add_field(name="💬 Сообщений", value=str(user_info['messages']), inline=True)
+        
+        await outbound.send_channel(channel, embed=embed, priority=PRIORITY_NOTIFICATION)
+    except Exception as e:
+        logger.error("Ошибка при отправке уведомления о повышении уровня: %s", e)
 
 async def check_antispam(user_id, user, guild, channel):
     """Проверяет, нарушает ли пользователь лимиты антиспама"""
@@ -375,6 +676,7 @@ async def check_antispam(user_id, user, guild, channel):
         return False
     
     current_time = time.time()
+    expire_antispam_state(current_time)
     
     # Проверяем, не замучен ли пользователь
     if user_id in muted_users:
@@ -383,37 +685,40 @@ async def check_antispam(user_id, user, guild, channel):
         else:
             # Время мута истекло, удаляем из списка
             del muted_users[user_id]
+            antispam_timers.cancel(('mute', user_id))
     
-    # Инициализируем список времен сообщений для нового пользователя
-    if user_id not in user_message_times:
-        user_message_times[user_id] = []
+    # Кольцевой буфер хранит не больше ANTISPAM_MAX_MESSAGES последних отметок
+    message_times = user_message_times.get(user_id)
+    if message_times is None:
+        message_times = user_message_times[user_id] = deque(maxlen=Config.ANTISPAM_MAX_MESSAGES)
     
-    # Удаляем старые записи (старше временного окна)
+    # Удаляем старые записи (старше временного окна) - они всегда в начале буфера
     time_window_start = current_time - Config.ANTISPAM_TIME_WINDOW
-    user_message_times[user_id] = [
-        msg_time for msg_time in user_message_times[user_id] 
-        if msg_time > time_window_start
-    ]
-    
-    # Добавляем текущее время
-    user_message_times[user_id].append(current_time)
+    while message_times and message_times[0] <= time_window_start:
+        message_times.popleft()
     
-    # Проверяем, превышен ли лимит
-    if len(user_message_times[user_id]) > Config.ANTISPAM_MAX_MESSAGES:
+    # Буфер заполнен и текущее сообщение превышает лимит
+    if len(message_times) >= Config.ANTISPAM_MAX_MESSAGES:
         # Мутим пользователя
         muted_users[user_id] = current_time + Config.ANTISPAM_MUTE_DURATION
+        antispam_timers.schedule(('mute', user_id), muted_users[user_id])
         # Очищаем историю сообщений
-        user_message_times[user_id] = []
-        logger.warning(f"Пользователь {user_id} замучен за спам на {Config.ANTISPAM_MUTE_DURATION} секунд")
+        del user_message_times[user_id]
+        antispam_timers.cancel(('idle', user_id))
+        logger.warning("Пользователь %s замучен за спам на %s секунд", user_id, Config.ANTISPAM_MUTE_DURATION)
         
         # Отправляем уведомление в канал логов
-        await send_antispam_notification(user, guild, channel, "mute")
+        spawn_background(send_antispam_notification(user, guild, channel, "mute"), 'antispam_notification')
         
         return True
     
+    # Добавляем текущее время; окно пользователя истечёт вместе с последним сообщением
+    message_times.append(current_time)
+    antispam_timers.schedule(('idle', user_id), current_time + Config.ANTISPAM_TIME_WINDOW)
+    
     # Если пользователь приближается к лимиту, отправляем предупреждение
-    if len(user_message_times[user_id]) == Config.ANTISPAM_MAX_MESSAGES:
-        await send_antispam_notification(user, guild, channel, "warning")
+    if len(message_times) == Config.ANTISPAM_MAX_MESSAGES:
+        spawn_background(send_antispam_notification(user, guild, channel, "warning"), 'antispam_notification')
     
     return False
 
@@ -423,7 +728,7 @@ async def send_antispam_notification(user, guild, channel, action_type):
     try:
         log_channel = bot.get_channel(Config.ANTISPAM_LOG_CHANNEL_ID)
         if not log_channel:
-            logger.warning(f"Канал логов антиспама {Config.ANTISPAM_LOG_CHANNEL_ID} не найден")
+            logger.warning("Канал логов антиспама %s не найден", Config.ANTISPAM_LOG_CHANNEL_ID)
             return
         
         current_time = discord.utils.utcnow()
@@ -450,7 +755,7 @@ async def send_antispam_notification(user, guild, channel, action_type):
                 violation_type = f"Спам в связанном канале (замучен на {Config.ANTISPAM_MUTE_DURATION} сек)"
                 await send_violation_report(fake_message, violation_type, f"Превышен лимит: {Config.ANTISPAM_MAX_MESSAGES} сообщений за {Config.ANTISPAM_TIME_WINDOW} секунд")
             except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления о спаме в канал модерации: {e}")
+                logger.error("Ошибка при отправке уведомления о спаме в канал модерации: %s", e)
             embed.add_field(
                 name="👤 Пользователь",
                 value=f"{user.mention} (`{user.id}`)",
@@ -507,10 +812,10 @@ async def send_antispam_notification(user, guild, channel, action_type):
         embed.set_thumbnail(url=user.display_avatar.url)
         embed.set_footer(text="Антиспам система", icon_url=bot.user.display_avatar.url)
         
-        await log_channel.send(embed=embed)
+        await outbound.send_channel(log_channel, embed=embed, priority=PRIORITY_MODERATION)
         
     except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления об антиспаме: {e}")
+        logger.error("Ошибка при отправке уведомления об антиспаме: %s", e)
 
 async def send_connection_notification(member, action_type):
     """Отправляет уведомление о подключении/отключении участника"""
@@ -524,7 +829,7 @@ async def send_connection_notification(member, action_type):
     try:
         log_channel = bot.get_channel(Config.CONNECTION_NOTIFICATIONS_CHANNEL_ID)
         if not log_channel:
-            logger.warning(f"Канал уведомлений о подключениях {Config.CONNECTION_NOTIFICATIONS_CHANNEL_ID} не найден")
+            logger.warning("Канал уведомлений о подключениях %s не найден", Config.CONNECTION_NOTIFICATIONS_CHANNEL_ID)
             return
         
         current_time = discord.utils.utcnow()
@@ -616,13 +921,68 @@ async def send_connection_notification(member, action_type):
         embed.set_thumbnail(url=member.display_avatar.url)
         embed.set_footer(text="Система уведомлений", icon_url=bot.user.display_avatar.url)
         
-        await log_channel.send(embed=embed)
+        await outbound.send_channel(log_channel, embed=embed, priority=PRIORITY_NOTIFICATION)
         
     except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления о подключении/отключении: {e}")
+        logger.error("Ошибка при отправке уведомления о подключении/отключении: %s", e)
+
+# Ключевые слова в названии канала модерации сервера
+MODERATION_CHANNEL_KEYWORDS = ('модерация', 'модер', 'admin', 'управление', 'настройки')
+moderation_channel_matcher = KeywordMatcher(MODERATION_CHANNEL_KEYWORDS)
+
+# Кэш проверки прав бота: {guild_id: {channel_id: (has_permissions, missing_permissions)}}
+# Сбрасывается по событиям изменения каналов, ролей и самого бота на сервере
+permission_cache = {}
+
+# Кэш канала модерации сервера: {guild_id: channel_id или None}
+moderation_channel_cache = {}
+
+# Время последнего уведомления о недостающих правах: {channel_id: timestamp}
+permission_notice_times = {}
+
+# Состояние прав в связанных каналах, поддерживаемое по событиям: {channel_id: [недостающие права]}
+permission_issues = {}
+# Серверы и каналы, ожидающие повторной проверки прав после событий
+permission_recheck_guilds = set()
+permission_recheck_channels = set()
+# Итоги последней сверки прав
+last_permission_sweep = {}
+
+def invalidate_permission_cache(guild_id, channel_id=None):
+    """Сбрасывает кэш прав для канала или для всего сервера (вместе с каналом модерации)"""
+    if channel_id is None:
+        permission_cache.pop(guild_id, None)
+        moderation_channel_cache.pop(guild_id, None)
+        permission_recheck_guilds.add(guild_id)
+    else:
+        permission_cache.get(guild_id, {}).pop(channel_id, None)
+        permission_recheck_channels.add(str(channel_id))
+
+def find_moderation_channel(guild):
+    """Находит канал модерации сервера (или системный канал), куда бот может писать; результат кэшируется"""
+    if guild.id in moderation_channel_cache:
+        channel_id = moderation_channel_cache[guild.id]
+        return guild.get_channel(channel_id) if channel_id else None
+    
+    moderation_channel = None
+    
+    # Ищем канал модерации
+    for ch in guild.text_channels:
+        if moderation_channel_matcher.search(ch.name.lower()):
+            if ch.permissions_for(guild.me).send_messages:
+                moderation_channel = ch
+                break
+    
+    # Если не найден, используем системный канал
+    if not moderation_channel and guild.system_channel:
+        if guild.system_channel.permissions_for(guild.me).send_messages:
+            moderation_channel = guild.system_channel
+    
+    moderation_channel_cache[guild.id] = moderation_channel.id if moderation_channel else None
+    return moderation_channel
 
 # Функция проверки прав бота
-async def check_bot_permissions(channel, notify_admin=True):
+async def check_bot_permissions(channel, notify_admin=True, use_cache=False):
     """Проверяет права бота в канале и уведомляет администратора при их отсутствии"""
     required_permissions = {
         'send_messages': 'Отправка сообщений',
@@ -631,31 +991,41 @@ async def check_bot_permissions(channel, notify_admin=True):
         'attach_files': 'Прикрепление файлов'
     }
     
-    permissions = channel.permissions_for(channel.guild.me)
-    missing_permissions = []
-    
-    for perm_name, perm_description in required_permissions.items():
-        if not getattr(permissions, perm_name):
-            missing_permissions.append(perm_description)
-    
-    if missing_permissions and notify_admin:
-        # Ищем администратора для уведомления
-        admin_channel = None
-        
-        # Ищем канал модерации
-        for ch in channel.guild.text_channels:
-            if any(keyword in ch.name.lower() for keyword in ['модерация', 'модер', 'admin', 'управление', 'настройки']):
-                if ch.permissions_for(channel.guild.me).send_messages:
-                    admin_channel = ch
-                    break
+    guild_cache = permission_cache.setdefault(channel.guild.id, {})
+    cached = guild_cache.get(channel.id) if use_cache else None
+    if cached is not None:
+        has_permissions, missing_permissions = cached
+    else:
+        permissions = channel.permissions_for(channel.guild.me)
+        missing_permissions = []
+        
+        for perm_name, perm_description in required_permissions.items():
+            if not getattr(permissions, perm_name):
+                missing_permissions.append(perm_description)
         
-        # Если не найден, используем системный канал
-        if not admin_channel and channel.guild.system_channel:
-            if channel.guild.system_channel.permissions_for(channel.guild.me).send_messages:
-                admin_channel = channel.guild.system_channel
+        has_permissions = len(missing_permissions) == 0
+        guild_cache[channel.id] = (has_permissions, missing_permissions)
         
-        # Если и системного канала нет, используем текущий канал
-        if not admin_channel and permissions.send_messages:
+        # Обновляем отслеживаемое состояние прав связанного канала
+        if str(channel.id) in linked_channels:
+            if has_permissions:
+                permission_issues.pop(str(channel.id), None)
+            else:
+                permission_issues[str(channel.id)] = missing_permissions
+    
+    if missing_permissions and notify_admin:
+        # Не повторяем уведомление о том же канале чаще, чем раз в PERMISSION_NOTICE_COOLDOWN секунд
+        current_time = time.time()
+        last_notice = permission_notice_times.get(channel.id)
+        if last_notice is not None and current_time - last_notice < Config.PERMISSION_NOTICE_COOLDOWN:
+            return has_permissions, missing_permissions
+        permission_notice_times[channel.id] = current_time
+        
+        # Ищем канал модерации или системный канал
+        admin_channel = find_moderation_channel(channel.guild)
+        
+        # Если их нет, используем текущий канал
+        if not admin_channel and channel.permissions_for(channel.guild.me).send_messages:
             admin_channel = channel
         
         if admin_channel:
@@ -686,43 +1056,89 @@ async def check_bot_permissions(channel, notify_admin=True):
                 
                 embed.set_footer(text="Без этих прав бот не сможет корректно пересылать сообщения между каналами")
                 
-                await admin_channel.send(embed=embed)
-                logger.warning(f"Отправлено уведомление о недостающих правах в канале {channel.name} на сервере {channel.guild.name}")
+                await outbound.send_channel(admin_channel, embed=embed, priority=PRIORITY_NOTIFICATION)
+                logger.warning("Отправлено уведомление о недостающих правах в канале %s на сервере %s", channel.name, channel.guild.name)
                 
             except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления о правах: {e}")
+                logger.error("Ошибка при отправке уведомления о правах: %s", e)
+    
+    return has_permissions, missing_permissions
+
+# Повторная проверка прав в связанных каналах, затронутых событиями Discord
+@tasks.loop(seconds=Config.PERMISSION_RECHECK_DELAY)
+async def recheck_changed_permissions():
+    """Перепроверяет права только в связанных каналах, для которых пришли события изменения"""
+    if not permission_recheck_guilds and not permission_recheck_channels:
+        return
     
-    return len(missing_permissions) == 0, missing_permissions
+    channel_ids = set(permission_recheck_channels)
+    for guild_id in permission_recheck_guilds:
+        channel_ids.update(guild_channel_index.get(str(guild_id), ()))
+    permission_recheck_guilds.clear()
+    permission_recheck_channels.clear()
+    
+    for channel_id in channel_ids:
+        channel = bot.get_channel(int(channel_id)) if channel_id in linked_channels else None
+        if not channel:
+            permission_issues.pop(channel_id, None)
+            continue
+        try:
+            await check_bot_permissions(channel, notify_admin=True, use_cache=True)
+        except Exception as e:
+            logger.error("Ошибка при проверке прав в канале %s: %s", channel_id, e)
+
+@recheck_changed_permissions.before_loop
+async def before_recheck_changed_permissions():
+    """Ждем готовности бота перед проверкой изменений прав"""
+    await bot.wait_until_ready()
 
-# Периодическая проверка прав бота
-@tasks.loop(minutes=30)
+# Периодическая сверка прав бота: страховка на случай пропущенных событий
+@tasks.loop(hours=Config.PERMISSION_SWEEP_INTERVAL_HOURS)
 async def periodic_permissions_check():
-    """Периодически проверяет права бота во всех связанных каналах"""
+    """Периодически сверяет права бота во всех связанных каналах небольшими пачками"""
     if not bot.is_ready():
         return
         
-    logger.info("Начинаем периодическую проверку прав бота...")
+    logger.info("Начинаем сверку прав бота...")
     
-    channels_with_issues = 0
-    total_channels = len(linked_channels)
+    tracked_issues = dict(permission_issues)
+    channel_ids = list(linked_channels)
+    total_channels = len(channel_ids)
+    unavailable_channels = 0
+    changed_channels = 0
     
-    for channel_id, channel_info in linked_channels.items():
-        try:
-            channel = bot.get_channel(int(channel_id))
-            if channel:
+    for start in range(0, total_channels, Config.PERMISSION_SWEEP_BATCH_SIZE):
+        for channel_id in channel_ids[start:start + Config.PERMISSION_SWEEP_BATCH_SIZE]:
+            try:
+                channel = bot.get_channel(int(channel_id))
+                if not channel:
+                    unavailable_channels += 1
+                    logger.warning("Канал %s недоступен (возможно, удален)", channel_id)
+                    continue
+                
                 has_permissions, missing_perms = await check_bot_permissions(channel, notify_admin=True)
-                if not has_permissions:
-                    channels_with_issues += 1
-                    logger.warning(f"Проблемы с правами в канале {channel.name} ({channel.guild.name}): {', '.join(missing_perms)}")
-            else:
-                logger.warning(f"Канал {channel_id} недоступен (возможно, удален)")
-        except Exception as e:
-            logger.error(f"Ошибка при проверке прав в канале {channel_id}: {e}")
+                if (channel_id in tracked_issues) == has_permissions:
+                    # Состояние разошлось с отслеживаемым по событиям
+                    changed_channels += 1
+            except Exception as e:
+                logger.error("Ошибка при проверке прав в канале %s: %s", channel_id, e)
+        
+        # Пауза между пачками, чтобы сверка не создавала всплесков нагрузки
+        await asyncio.sleep(Config.PERMISSION_SWEEP_BATCH_DELAY)
+    
+    channels_with_issues = len(permission_issues)
+    last_permission_sweep.update({
+        'finished_at': datetime.utcnow().isoformat(),
+        'checked': total_channels,
+        'with_issues': channels_with_issues,
+        'unavailable': unavailable_channels,
+        'drifted': changed_channels
+    })
     
     if channels_with_issues > 0:
-        logger.warning(f"Обнаружены проблемы с правами в {channels_with_issues} из {total_channels} каналов")
+        logger.warning("Сверка прав завершена: проблемы в %s из %s каналов, недоступно %s, расхождений с отслеживаемым состоянием %s", channels_with_issues, total_channels, unavailable_channels, changed_channels)
     else:
-        logger.info(f"Проверка завершена. Все {total_channels} каналов имеют необходимые права")
+        logger.info("Сверка прав завершена. Все %s каналов имеют необходимые права, расхождений с отслеживаемым состоянием %s", total_channels, changed_channels)
 
 @periodic_permissions_check.before_loop
 async def before_permissions_check():
@@ -730,58 +1146,150 @@ async def before_permissions_check():
     await bot.wait_until_ready()
 
 # Периодическая очистка данных антиспама
-@tasks.loop(minutes=10)
+@tasks.loop(seconds=5)
 async def cleanup_antispam_data():
-    """Периодическая очистка устаревших данных антиспама"""
+    """Продвигает колесо таймеров антиспама, даже если новых сообщений нет"""
     if not bot.is_ready() or not Config.ANTISPAM_ENABLED:
         return
     
-    current_time = time.time()
-    
-    # Очищаем истекшие муты
-    expired_mutes = [user_id for user_id, mute_end in muted_users.items() if mute_end <= current_time]
-    for user_id in expired_mutes:
-        del muted_users[user_id]
-    
-    # Очищаем старые записи времен сообщений
-    time_window_start = current_time - Config.ANTISPAM_TIME_WINDOW
-    users_to_clean = []
-    
-    for user_id, message_times in user_message_times.items():
-        # Удаляем старые записи
-        user_message_times[user_id] = [
-            msg_time for msg_time in message_times 
-            if msg_time > time_window_start
-        ]
-        
-        # Если у пользователя не осталось записей, помечаем для удаления
-        if not user_message_times[user_id]:
-            users_to_clean.append(user_id)
-    
-    # Удаляем пустые записи
-    for user_id in users_to_clean:
-        del user_message_times[user_id]
-    
-    if expired_mutes or users_to_clean:
-        logger.debug(f"Очистка антиспам данных: {len(expired_mutes)} истекших мутов, {len(users_to_clean)} пустых записей")
+    expired = expire_antispam_state()
+    if expired:
+        logger.debug("Очистка антиспам данных: %s истекших таймеров, %s активных окон, %s мутов", expired, len(user_message_times), len(muted_users))
 
 @cleanup_antispam_data.before_loop
 async def before_cleanup_antispam():
     """Ждем готовности бота перед началом очистки антиспам данных"""
     await bot.wait_until_ready()
 
+# Отслеживание внешних изменений чёрного списка
+@tasks.loop(seconds=Config.BLACKLIST_RELOAD_INTERVAL)
+async def watch_blacklist_file():
+    """Перечитывает чёрный список, если он был отредактирован вручную"""
+    try:
+        if await reload_blacklist_if_changed():
+            logger.info("Чёрный список перезагружен из хранилища: %s пользователей", len(blacklist))
+    except Exception as e:
+        logger.error("Ошибка при проверке изменений чёрного списка: %s", e)
+
+# Повтор незавершённых доставок из журнала
+@tasks.loop(seconds=Config.JOURNAL_RETRY_INTERVAL)
+async def retry_pending_deliveries():
+    """Повторяет доставки, время повтора которых наступило"""
+    try:
+        due = await journal.run(journal.lease_due, Config.JOURNAL_RETRY_BATCH)
+        if not due:
+            return
+        
+        # Вложения скачиваются только для частей, которые ещё не доставлены хотя бы в один канал
+        first_pending = {}
+        for message_id, _, sent_batches, _ in due:
+            first_pending[message_id] = min(sent_batches, first_pending.get(message_id, sent_batches))
+        
+        envelopes = {}
+        deliveries = []
+        for message_id, channel_id, sent_batches, record in due:
+            channel_info = linked_channels.get(channel_id)
+            if not channel_info:
+                # Канал отключен от сети - доставлять больше некуда
+                await journal.run(journal.complete, message_id, channel_id)
+                continue
+            
+            # Вложения каждого сообщения скачиваются один раз на все повторяемые доставки
+            if message_id not in envelopes:
+                envelopes[message_id] = await restore_relay_envelope(record, first_pending[message_id])
+            
+            network_semaphore = get_network_semaphore(channel_info['network'])
+            deliveries.append(deliver_to_channel(message_id, envelopes[message_id], channel_id, network_semaphore, sent_batches))
+        
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+        sent_count = sum(1 for result in results if result == DELIVERY_SENT)
+        logger.info("Повтор доставок: %s из %s доставлено", sent_count, len(due))
+    except Exception as e:
+        logger.error("Ошибка при повторе доставок: %s", e)
+
+@retry_pending_deliveries.before_loop
+async def before_retry_pending_deliveries():
+    """Ждем готовности бота перед повтором доставок"""
+    await bot.wait_until_ready()
+
+# Периодическая запись данных уровней
+@tasks.loop(seconds=Config.LEVELS_FLUSH_INTERVAL)
+async def flush_levels_task():
+    """Периодически сбрасывает изменения уровней на диск"""
+    # Заодно удаляем истёкшие кулдауны XP, если сообщений давно не было
+    last_xp_time.sweep()
+    await flush_levels()
+
+# Периодическая выгрузка неактивных пользователей из памяти
+@tasks.loop(seconds=Config.LEVELS_PAGE_OUT_INTERVAL)
+async def page_out_levels_task():
+    """Переносит неактивных пользователей из памяти на диск"""
+    await page_out_levels()
+
+# Периодическое сохранение счётчиков пересылки
+@tasks.loop(seconds=Config.THROUGHPUT_SAVE_INTERVAL)
+async def save_throughput_task():
+    """Сохраняет снимок счётчиков пересылки в потоке хранилища"""
+    save_throughput()
+
+def save_throughput():
+    """Снимает копию счётчиков в цикле событий и отправляет её на запись"""
+    return storage.submit(save_throughput_snapshot, Config.THROUGHPUT_FILE, throughput.to_dict())
+
+# Публикация статистики для API
+def publish_stats():
+    """Собирает снимок статистики и публикует его для API"""
+    return bot_stats.publish({
+        # Сообщения, пересланные с момента запуска
+        'messages': RELAYED_MESSAGES.total(),
+        'outbound': outbound.get_stats(),
+        'pipeline': get_pipeline_stats(),
+        'throughput': throughput.summary(),
+        'permissions': {
+            'channels_with_issues': len(permission_issues),
+            'last_sweep': dict(last_permission_sweep)
+        },
+        'levels': {
+            'users': len(leaderboard),
+            'resident_users': len(levels_data),
+            'paged_out_users': len(leaderboard.cold),
+            'cooldown_entries': len(last_xp_time),
+            'dirty_users': len(levels_dirty_users)
+        },
+        'webhook_cache': {
+            'size': len(webhook_cache),
+            'hits': webhook_cache_stats['hits'],
+            'misses': webhook_cache_stats['misses']
+        }
+    })
+
+@tasks.loop(seconds=Config.STATS_PUBLISH_INTERVAL)
+async def publish_stats_task():
+    """Периодически обновляет опубликованный снимок статистики"""
+    try:
+        publish_stats()
+    except Exception as e:
+        logger.error("Ошибка при публикации статистики: %s", e)
+
 @bot.event
 async def on_ready():
     """Событие готовности бота"""
-    logger.info(f'{bot.user} подключился к Discord!')
-    logger.info(f'Бот активен на {len(bot.guilds)} серверах')
+    logger.info("%s подключился к Discord!", bot.user)
+    logger.info("Бот активен на %s серверах", len(bot.guilds))
+    
+    # Полная синхронизация статистики серверов; дальше она обновляется событиями
+    bot_stats.reset_guilds(bot.guilds)
+    publish_stats()
+    
+    # Запускаем обработчики очереди пересылки до остальных долгих операций
+    start_relay_workers()
     
     # Синхронизируем slash команды
     try:
         synced = await bot.tree.sync()
-        logger.info(f'Синхронизировано {len(synced)} slash команд')
+        logger.info("Синхронизировано %s slash команд", len(synced))
     except Exception as e:
-        logger.error(f'Ошибка при синхронизации slash команд: {e}')
+        logger.error("Ошибка при синхронизации slash команд: %s", e)
     
     # Проверяем доступность каналов при запуске
     if Config.AUTO_CLEANUP_CHANNELS:
@@ -791,15 +1299,42 @@ async def on_ready():
     activity = discord.Activity(type=discord.ActivityType.watching, name=f"{len(linked_channels)} связанных каналов")
     await bot.change_presence(activity=activity)
     
-    # Запускаем периодическую проверку прав
+    # Запускаем отслеживание прав по событиям и редкую сверку
+    if not recheck_changed_permissions.is_running():
+        recheck_changed_permissions.start()
     if not periodic_permissions_check.is_running():
         periodic_permissions_check.start()
-        logger.info("Запущена периодическая проверка прав бота (каждые 30 минут)")
+        logger.info("Запущена сверка прав бота (каждые %s ч.)", Config.PERMISSION_SWEEP_INTERVAL_HOURS)
     
     # Запускаем периодическую очистку антиспам данных
     if Config.ANTISPAM_ENABLED and not cleanup_antispam_data.is_running():
         cleanup_antispam_data.start()
-        logger.info("Запущена периодическая очистка антиспам данных (каждые 10 минут)")
+        logger.info("Запущена периодическая очистка антиспам данных (каждые 5 секунд)")
+    
+    # Запускаем повтор незавершённых доставок
+    if journal and not retry_pending_deliveries.is_running():
+        retry_pending_deliveries.start()
+    
+    # Запускаем периодическую запись данных уровней
+    if Config.LEVELS_ENABLED and not flush_levels_task.is_running():
+        flush_levels_task.start()
+        logger.info("Запущена отложенная запись уровней (каждые %s секунд)", Config.LEVELS_FLUSH_INTERVAL)
+    
+    # Запускаем выгрузку неактивных пользователей
+    if Config.LEVELS_ENABLED and levels_paging_enabled() and not page_out_levels_task.is_running():
+        page_out_levels_task.start()
+    
+    # Запускаем сохранение счётчиков пересылки
+    if not save_throughput_task.is_running():
+        save_throughput_task.start()
+    
+    # Запускаем публикацию статистики для API
+    if not publish_stats_task.is_running():
+        publish_stats_task.start()
+    
+    # Запускаем отслеживание внешних изменений чёрного списка
+    if Config.BLACKLIST_ENABLED and not watch_blacklist_file.is_running():
+        watch_blacklist_file.start()
     
     # Отправляем информацию о боте в указанный канал (только один раз)
     await send_bot_info_once()
@@ -817,7 +1352,7 @@ async def send_bot_info_once():
     try:
         channel = bot.get_channel(target_channel_id)
         if not channel:
-            logger.error(f"Канал {target_channel_id} не найден")
+            logger.error("Канал %s не найден", target_channel_id)
             return
         
         # Создаем красивое embed сообщение с информацией о боте
@@ -835,7 +1370,7 @@ async def send_bot_info_once():
         
         embed.add_field(
             name="📋 Основные команды",
-            value="`/создать-сеть` - создать новую сеть\n`/связать` - подключить канал к существующей сети\n`/отключить` - отключить канал\n`/поиск-сети` - показать доступные сети\n`/проверить_права` - проверить права бота\n`/бот-инфо` - информация о боте\n\n💡 **Важно:** Название сети может быть любым и не обязательно должно совпадать с названием канала!",
+            value="`/создать-сеть` - создать новую сеть\n`/связать` - подключить канал к существующей сети\n`/отключить` - отключить канал\n`/поиск-сети` - показать доступные сети\n`/активность-сетей` - нагрузка по сетям\n`/топ` - рейтинг по XP\n`/проверить_права` - проверить права бота\n`/бот-инфо` - информация о боте\n\n💡 **Важно:** Название сети может быть любым и не обязательно должно совпадать с названием канала!",
             inline=False
         )
         
@@ -860,10 +1395,10 @@ async def send_bot_info_once():
         with open(bot_info_sent_file, 'w', encoding='utf-8') as f:
             f.write(f"Bot info sent at {datetime.now()}")
         
-        logger.info(f"Информация о боте успешно отправлена в канал {target_channel_id}")
+        logger.info("Информация о боте успешно отправлена в канал %s", target_channel_id)
         
     except Exception as e:
-        logger.error(f"Ошибка при отправке информации о боте: {e}")
+        logger.error("Ошибка при отправке информации о боте: %s", e)
 
 async def cleanup_invalid_channels():
     """Удаляет недоступные каналы из конфигурации"""
@@ -877,78 +1412,80 @@ async def cleanup_invalid_channels():
             valid_channels[channel_id] = channel_info
         else:
             guild_name = channel_info.get("guild_name", "Unknown") if isinstance(channel_info, dict) else "Unknown"
-            logger.warning(f'Канал {channel_id} ({guild_name}) недоступен и будет удален')
+            logger.warning("Канал %s (%s) недоступен и будет удален", channel_id, guild_name)
             removed_count += 1
     
     if removed_count > 0:
+        removed_ids = linked_channels.keys() - valid_channels.keys()
         linked_channels = valid_channels
-        save_channels_config(linked_channels)
-        logger.info(f"Удалено {removed_count} недоступных каналов")
+        rebuild_routing_table()
+        save_channels_config(linked_channels, removed_ids)
+        logger.info("Удалено %s недоступных каналов", removed_count)
 
-async def check_raid_protection(message):
+async def check_raid_protection(message, scan=None):
     """Проверяет сообщение на наличие рейд-контента (массовые упоминания и Discord инвайты)"""
     if not Config.RAID_PROTECTION_ENABLED:
         return False
     
-    content = message.content.lower()
+    if scan is None:
+        scan = scan_message(message)
     
     # Проверяем массовые упоминания @everyone и @here
-    if Config.RAID_PROTECTION_BLOCK_MASS_MENTIONS and ('@everyone' in content or '@here' in content):
+    if Config.RAID_PROTECTION_BLOCK_MASS_MENTIONS and RULE_MASS_MENTION in scan:
         try:
             await message.delete()
-            logger.warning(f"Удалено сообщение с массовым упоминанием от {message.author} ({message.author.id}) в {message.guild.name}#{message.channel.name}")
-            
-            # Отправляем уведомление о нарушении
-            violation_type = "Массовое упоминание (@everyone/@here)"
-            await send_violation_report(message, violation_type, message.content)
-            
-            # Отправляем предупреждение пользователю в ЛС
-            try:
-                embed = discord.Embed(
-                    title="⚠️ Нарушение правил",
-                    description="Ваше сообщение было удалено за использование массовых упоминаний (@everyone/@here).",
-                    color=Config.EMBED_COLOR_WARNING
-                )
-                embed.set_footer(text=f"Сервер: {message.guild.name} • Канал: #{message.channel.name}")
-                await message.author.send(embed=embed)
-            except discord.Forbidden:
-                pass  # Не можем отправить в ЛС
+            logger.warning("Удалено сообщение с массовым упоминанием от %s (%s) в %s#%s", message.author, message.author.id, message.guild.name, message.channel.name)
             
+            # Отчёт модераторам и предупреждение нарушителю отправляются в фоне
+            spawn_background(notify_raid_violation(
+                message,
+                "Массовое упоминание (@everyone/@here)",
+                "Ваше сообщение было удалено за использование массовых упоминаний (@everyone/@here)."
+            ), 'violation_report')
             return True
         except discord.Forbidden:
-            logger.warning(f"Нет прав на удаление сообщения с массовым упоминанием от {message.author}")
+            logger.warning("Нет прав на удаление сообщения с массовым упоминанием от %s", message.author)
     
     # Проверяем Discord инвайты
-    if Config.RAID_PROTECTION_BLOCK_DISCORD_INVITES and ('discord.gg/' in content or 'discordapp.com/invite/' in content or 'discord.com/invite/' in content):
+    if Config.RAID_PROTECTION_BLOCK_DISCORD_INVITES and RULE_INVITE in scan:
         try:
             await message.delete()
-            logger.warning(f"Удалено сообщение с Discord инвайтом от {message.author} ({message.author.id}) в {message.guild.name}#{message.channel.name}")
-            
-            # Отправляем уведомление о нарушении
-            violation_type = "Размещение Discord инвайта"
-            await send_violation_report(message, violation_type, message.content)
-            
-            # Отправляем предупреждение пользователю в ЛС
-            try:
-                embed = discord.Embed(
-                    title="⚠️ Нарушение правил",
-                    description="Ваше сообщение было удалено за размещение Discord инвайта.",
-                    color=Config.EMBED_COLOR_WARNING
-                )
-                embed.set_footer(text=f"Сервер: {message.guild.name} • Канал: #{message.channel.name}")
-                await message.author.send(embed=embed)
-            except discord.Forbidden:
-                pass  # Не можем отправить в ЛС
+            logger.warning("Удалено сообщение с Discord инвайтом от %s (%s) в %s#%s", message.author, message.author.id, message.guild.name, message.channel.name)
             
+            spawn_background(notify_raid_violation(
+                message,
+                "Размещение Discord инвайта",
+                "Ваше сообщение было удалено за размещение Discord инвайта."
+            ), 'violation_report')
             return True
         except discord.Forbidden:
-            logger.warning(f"Нет прав на удаление сообщения с Discord инвайтом от {message.author}")
+            logger.warning("Нет прав на удаление сообщения с Discord инвайтом от %s", message.author)
     
     return False
 
+async def send_warning_dm(message, title, description):
+    """Отправляет нарушителю предупреждение в личные сообщения"""
+    try:
+        embed = discord.Embed(
+            title=title,
+            description=description,
+            color=Config.EMBED_COLOR_WARNING
+        )
+        embed.set_footer(text=f"Сервер: {message.guild.name} • Канал: #{message.channel.name}")
+        await outbound.send_channel(message.author, embed=embed, priority=PRIORITY_MODERATION)
+    except (discord.Forbidden, OutboundQueueFull):
+        pass  # Не можем отправить в ЛС
+
+async def notify_raid_violation(message, violation_type, description):
+    """Отправляет уведомление о нарушении модераторам и предупреждение пользователю в ЛС"""
+    await send_violation_report(message, violation_type, message.content)
+    await send_warning_dm(message, "⚠️ Нарушение правил", description)
+
 @bot.event
 async def on_message(message):
     """Обработка входящих сообщений"""
+    received_at = time.perf_counter()
+    
     # Игнорируем сообщения от ботов
     if message.author.bot:
         return
@@ -962,7 +1499,7 @@ async def on_message(message):
                 # Пытаемся извлечь ID пользователя из сообщения
                 try:
                     user_id = int(message.content.strip())
-                    if add_to_blacklist(user_id):
+                    if await add_to_blacklist(user_id):
                         embed = discord.Embed(
                             title="🚫 Пользователь заблокирован",
                             description=f"Пользователь с ID `{user_id}` добавлен в чёрный список.",
@@ -984,7 +1521,7 @@ async def on_message(message):
                 # Пытаемся извлечь ID пользователя из сообщения
                 try:
                     user_id = int(message.content.strip())
-                    if remove_from_blacklist(user_id):
+                    if await remove_from_blacklist(user_id):
                         embed = discord.Embed(
                             title="✅ Пользователь разблокирован",
                             description=f"Пользователь с ID `{user_id}` удалён из чёрного списка.",
@@ -999,66 +1536,74 @@ async def on_message(message):
                     await message.channel.send("❌ Неверный формат ID пользователя. Отправьте только числовой ID.")
             return
         
-        # Проверяем, находится ли автор сообщения в чёрном списке
+        # Стадия 1: чёрный список (проверка по множеству в памяти)
+        started = time.perf_counter()
         if is_blacklisted(message.author.id):
             # Отправляем уведомление о нарушении
             violation_type = "Попытка отправки сообщения заблокированным пользователем"
-            await send_violation_report(message, violation_type, message.content)
+            spawn_background(send_violation_report(message, violation_type, message.content), 'violation_report')
             
             # Удаляем сообщение от заблокированного пользователя
             try:
                 await message.delete()
-                logger.info(f"Сообщение от заблокированного пользователя {message.author} ({message.author.id}) удалено")
+                logger.info("Сообщение от заблокированного пользователя %s (%s) удалено", message.author, message.author.id)
             except discord.Forbidden:
-                logger.warning(f"Нет прав на удаление сообщения от заблокированного пользователя {message.author}")
+                logger.warning("Нет прав на удаление сообщения от заблокированного пользователя %s", message.author)
+            record_stage('blacklist', started)
             return
-    
-    # Анти-рейд защита: проверяем массовые упоминания и Discord инвайты
-    if await check_raid_protection(message):
+        record_stage('blacklist', started)
+    
+    # Стадия 2: фильтр содержимого - все правила проверяются одним проходом,
+    # результат используется и анти-рейдом, и пересылкой
+    started = time.perf_counter()
+    scan = scan_message(message)
+    record_stage('filter', started)
+    
+    # Стадия 3: анти-рейд защита (массовые упоминания и Discord инвайты)
+    started = time.perf_counter()
+    rejected = await check_raid_protection(message, scan)
+    record_stage('raid_protection', started)
+    if rejected:
         return
     
-    # Проверяем антиспам для связанных каналов
+    # Стадия 4: антиспам для связанных каналов
     channel_id = str(message.channel.id)
     if channel_id in linked_channels:
-        # Проверяем антиспам
-        if await check_antispam(message.author.id, message.author, message.guild, message.channel):
-            # Пользователь нарушил лимиты, удаляем сообщение и отправляем предупреждение
+        started = time.perf_counter()
+        rejected = await check_antispam(message.author.id, message.author, message.guild, message.channel)
+        if rejected:
+            # Пользователь нарушил лимиты, удаляем сообщение и отправляем предупреждение в фоне
             try:
                 await message.delete()
-                
-                # Отправляем предупреждение в личные сообщения
-                try:
-                    embed = discord.Embed(
-                        title="⚠️ Антиспам система",
-                        description=f"Вы отправляете сообщения слишком часто!\n\nВы временно заблокированы на **{Config.ANTISPAM_MUTE_DURATION} секунд**.\n\nЛимит: **{Config.ANTISPAM_MAX_MESSAGES} сообщений** за **{Config.ANTISPAM_TIME_WINDOW} секунд**.",
-                        color=Config.EMBED_COLOR_WARNING
-                    )
-                    embed.set_footer(text=f"Сервер: {message.guild.name} • Канал: #{message.channel.name}")
-                    await message.author.send(embed=embed)
-                except discord.Forbidden:
-                    # Если не можем отправить в ЛС, отправляем в канал (эфемерно)
-                    pass
-                
-                logger.info(f"Сообщение от {message.author} удалено за спам в {message.guild.name}#{message.channel.name}")
-                return
+                spawn_background(send_warning_dm(
+                    message,
+                    "⚠️ Антиспам система",
+                    f"Вы отправляете сообщения слишком часто!\n\nВы временно заблокированы на **{Config.ANTISPAM_MUTE_DURATION} секунд**.\n\nЛимит: **{Config.ANTISPAM_MAX_MESSAGES} сообщений** за **{Config.ANTISPAM_TIME_WINDOW} секунд**."
+                ), 'antispam_notification')
+                logger.info("Сообщение от %s удалено за спам в %s#%s", message.author, message.guild.name, message.channel.name)
             except discord.Forbidden:
-                logger.warning(f"Нет прав на удаление сообщения от {message.author} в {message.guild.name}#{message.channel.name}")
-                return
+                logger.warning("Нет прав на удаление сообщения от %s в %s#%s", message.author, message.guild.name, message.channel.name)
             except Exception as e:
-                logger.error(f"Ошибка при обработке антиспама: {e}")
-                return
+                logger.error("Ошибка при обработке антиспама: %s", e)
+        record_stage('antispam', started)
+        if rejected:
+            return
     
     # Логируем сообщения если включено
     if Config.LOG_MESSAGES:
-        logger.debug(f"Сообщение от {message.author} в {message.guild.name}#{message.channel.name}: {message.content[:100]}")
+        logger.debug("Сообщение от %s в %s#%s: %s", message.author, message.guild.name, message.channel.name, message.content[:100])
     
-    # Начисляем XP за сообщение
+    # Начисляем XP за сообщение в фоне; пересылка дождётся начисления, чтобы показать актуальный уровень
+    xp_task = None
     if Config.LEVELS_ENABLED:
-        await process_xp_gain(message.author.id, message.channel)
+        xp_task = spawn_background(process_xp_gain(message.author.id, message.channel), 'xp')
     
-    # Проверяем, является ли канал связанным (повторная проверка после антиспама)
+    # Стадия 5: пересылка - в очередь обработчиков, on_message её не ждёт
+    # (повторная проверка после антиспама: канал могли отвязать)
     if channel_id in linked_channels:
-        await relay_message(message)
+        started = time.perf_counter()
+        enqueue_relay(message, scan, received_at, xp_task)
+        record_stage('relay_enqueue', started)
     
     # Обрабатываем команды
     await bot.process_commands(message)
@@ -1066,6 +1611,8 @@ async def on_message(message):
 @bot.event
 async def on_member_join(member):
     """Событие присоединения нового участника к серверу"""
+    bot_stats.add_members(member.guild.id, 1)
+    
     # Отправляем уведомление о подключении
     await send_connection_notification(member, "join")
     
@@ -1081,40 +1628,43 @@ async def on_member_join(member):
         # Получаем роль для выдачи
         role = member.guild.get_role(int(Config.AUTO_ROLE_ID))
         if not role:
-            logger.error(f"Роль с ID {Config.AUTO_ROLE_ID} не найдена на сервере {member.guild.name}")
+            logger.error("Роль с ID %s не найдена на сервере %s", Config.AUTO_ROLE_ID, member.guild.name)
             return
         
         # Проверяем права бота на выдачу ролей
         if not member.guild.me.guild_permissions.manage_roles:
-            logger.error(f"У бота нет прав на управление ролями на сервере {member.guild.name}")
+            logger.error("У бота нет прав на управление ролями на сервере %s", member.guild.name)
             return
         
         # Проверяем, что роль бота выше выдаваемой роли
         if member.guild.me.top_role <= role:
-            logger.error(f"Роль бота ниже или равна выдаваемой роли {role.name} на сервере {member.guild.name}")
+            logger.error("Роль бота ниже или равна выдаваемой роли %s на сервере %s", role.name, member.guild.name)
             return
         
         # Выдаем роль новому участнику
         await member.add_roles(role, reason="Автоматическая выдача роли новому участнику")
-        logger.info(f"Выдана роль '{role.name}' пользователю {member.display_name} ({member.id}) на сервере {member.guild.name}")
+        logger.info("Выдана роль '%s' пользователю %s (%s) на сервере %s", role.name, member.display_name, member.id, member.guild.name)
         
     except discord.Forbidden:
-        logger.error(f"Недостаточно прав для выдачи роли пользователю {member.display_name} на сервере {member.guild.name}")
+        logger.error("Недостаточно прав для выдачи роли пользователю %s на сервере %s", member.display_name, member.guild.name)
     except discord.HTTPException as e:
-        logger.error(f"Ошибка HTTP при выдаче роли пользователю {member.display_name}: {e}")
+        logger.error("Ошибка HTTP при выдаче роли пользователю %s: %s", member.display_name, e)
     except Exception as e:
-        logger.error(f"Неожиданная ошибка при выдаче роли пользователю {member.display_name}: {e}")
+        logger.error("Неожиданная ошибка при выдаче роли пользователю %s: %s", member.display_name, e)
 
 @bot.event
 async def on_member_remove(member):
     """Событие покидания участником сервера"""
+    bot_stats.add_members(member.guild.id, -1)
+    
     # Отправляем уведомление об отключении
     await send_connection_notification(member, "leave")
 
 @bot.event
 async def on_guild_join(guild):
     """Событие добавления бота на новый сервер"""
-    logger.info(f'Бот добавлен на сервер: {guild.name} (ID: {guild.id})')
+    logger.info("Бот добавлен на сервер: %s (ID: %s)", guild.name, guild.id)
+    bot_stats.set_guild(guild)
     
     # Ищем канал модерации или системный канал
     moderation_channel = None
@@ -1124,17 +1674,8 @@ async def on_guild_join(guild):
     # 2. Системный канал сервера
     # 3. Первый текстовый канал, где бот может писать
     
-    # Поиск канала модерации по названию
-    for channel in guild.text_channels:
-        if any(keyword in channel.name.lower() for keyword in ['модерация', 'модер', 'admin', 'управление', 'настройки']):
-            if channel.permissions_for(guild.me).send_messages:
-                moderation_channel = channel
-                break
-    
-    # Если не найден, используем системный канал
-    if not moderation_channel and guild.system_channel:
-        if guild.system_channel.permissions_for(guild.me).send_messages:
-            moderation_channel = guild.system_channel
+    # Поиск канала модерации по названию, затем системного канала
+    moderation_channel = find_moderation_channel(guild)
     
     # Если и системного канала нет, ищем первый доступный текстовый канал
     if not moderation_channel:
@@ -1185,12 +1726,12 @@ async def on_guild_join(guild):
             embed.set_footer(text=f"Бот активен на {len(bot.guilds)} серверах")
             
             await moderation_channel.send(embed=embed)
-            logger.info(f'Отправлены инструкции в канал {moderation_channel.name} на сервере {guild.name}')
+            logger.info("Отправлены инструкции в канал %s на сервере %s", moderation_channel.name, guild.name)
             
         except Exception as e:
-            logger.error(f'Ошибка при отправке приветственного сообщения на сервере {guild.name}: {e}')
+            logger.error("Ошибка при отправке приветственного сообщения на сервере %s: %s", guild.name, e)
     else:
-        logger.warning(f'Не удалось найти подходящий канал для отправки инструкций на сервере {guild.name}')
+        logger.warning("Не удалось найти подходящий канал для отправки инструкций на сервере %s", guild.name)
     
     # Отправка уведомления о добавлении бота в специальный канал
     try:
@@ -1217,7 +1758,7 @@ async def on_guild_join(guild):
                 
                 notification_embed.add_field(
                     name="📈 Статистика бота",
-                    value=f"**Всего серверов:** {len(bot.guilds)}\n**Всего пользователей:** {sum(g.member_count for g in bot.guilds if g.member_count)}",
+                    value=f"**Всего серверов:** {len(bot.guilds)}\n**Всего пользователей:** {bot_stats.members}",
                     inline=True
                 )
                 
@@ -1231,25 +1772,63 @@ async def on_guild_join(guild):
                 )
                 
                 await notification_channel.send(embed=notification_embed)
-                logger.info(f'Отправлено уведомление о добавлении на сервер {guild.name}')
+                logger.info("Отправлено уведомление о добавлении на сервер %s", guild.name)
             else:
-                logger.warning(f'Канал уведомлений {notification_channel_id} не найден')
+                logger.warning("Канал уведомлений %s не найден", notification_channel_id)
         else:
-            logger.warning(f'Сервер уведомлений {notification_guild_id} не найден')
+            logger.warning("Сервер уведомлений %s не найден", notification_guild_id)
     except Exception as e:
-        logger.error(f'Ошибка при отправке уведомления о добавлении бота: {e}')
+        logger.error("Ошибка при отправке уведомления о добавлении бота: %s", e)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    """Событие изменения канала - права могли измениться"""
+    if isinstance(after, discord.CategoryChannel):
+        # Права категории наследуются каналами внутри неё
+        invalidate_permission_cache(after.guild.id)
+    else:
+        invalidate_permission_cache(after.guild.id, after.id)
+        # Переименование или новые права могут сделать канал каналом модерации (или наоборот)
+        moderation_channel_cache.pop(after.guild.id, None)
+
+@bot.event
+async def on_guild_channel_create(channel):
+    """Событие создания канала - он может оказаться каналом модерации"""
+    moderation_channel_cache.pop(channel.guild.id, None)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    """Событие удаления канала"""
+    invalidate_permission_cache(channel.guild.id, channel.id)
+    permission_notice_times.pop(channel.id, None)
+    if moderation_channel_cache.get(channel.guild.id) == channel.id:
+        moderation_channel_cache.pop(channel.guild.id, None)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """Событие изменения роли - права бота на сервере могли измениться"""
+    invalidate_permission_cache(after.guild.id)
+
+@bot.event
+async def on_member_update(before, after):
+    """Событие изменения участника - нас интересуют только роли самого бота"""
+    if after.id == bot.user.id and before.roles != after.roles:
+        invalidate_permission_cache(after.guild.id)
 
 @bot.event
 async def on_guild_remove(guild):
     """Событие удаления бота с сервера"""
-    logger.info(f'Бот удален с сервера: {guild.name} (ID: {guild.id})')
+    logger.info("Бот удален с сервера: %s (ID: %s)", guild.name, guild.id)
+    invalidate_permission_cache(guild.id)
+    throughput.forget('guilds', str(guild.id))
+    bot_stats.remove_guild(guild.id)
     
     # Удаляем все связанные каналы этого сервера
     global linked_channels
     channels_to_remove = []
     
     for channel_id, channel_info in linked_channels.items():
-        if isinstance(channel_info, dict) and channel_info.get('guild_id') == str(guild.id):
+        if isinstance(channel_info, dict) and str(channel_info.get('guild_id')) == str(guild.id):
             channels_to_remove.append(channel_id)
     
     if channels_to_remove:
@@ -1257,47 +1836,86 @@ async def on_guild_remove(guild):
             network_name = linked_channels[channel_id]['network']
             channel_name = linked_channels[channel_id].get('channel_name', 'Неизвестно')
             del linked_channels[channel_id]
-            logger.info(f'Удален канал {channel_name} (ID: {channel_id}) из сети "{network_name}"')
+            invalidate_webhook_cache(channel_id)
+            logger.info('Удален канал %s (ID: %s) из сети "%s"', channel_name, channel_id, network_name)
         
-        save_channels_config(linked_channels)
-        logger.info(f'Удалено {len(channels_to_remove)} каналов с сервера {guild.name}')
+        rebuild_routing_table()
+        save_channels_config(linked_channels, channels_to_remove)
+        logger.info("Удалено %s каналов с сервера %s", len(channels_to_remove), guild.name)
+
+# Кэш webhook'ов бота: {channel_id: discord.Webhook}
+# Заполняется лениво при первой пересылке в канал, сбрасывается по событиям
+webhook_cache = {}
+webhook_cache_stats = {'hits': 0, 'misses': 0}
+
+async def get_relay_webhook(channel):
+    """Возвращает webhook бота для канала, создавая его при отсутствии (discord.Forbidden, если нет прав)"""
+    webhook = webhook_cache.get(channel.id)
+    if webhook is not None:
+        webhook_cache_stats['hits'] += 1
+        return webhook
+    
+    webhook_cache_stats['misses'] += 1
+    
+    # Ищем существующий webhook бота
+    webhooks = await channel.webhooks()
+    for wh in webhooks:
+        if wh.user == bot.user:
+            webhook = wh
+            break
+    
+    # Создаем новый webhook если не найден
+    if webhook is None:
+        webhook = await channel.create_webhook(name="Channel Bridge")
+    
+    webhook_cache[channel.id] = webhook
+    return webhook
+
+def invalidate_webhook_cache(channel_id):
+    """Удаляет webhook канала из кэша"""
+    webhook_cache.pop(int(channel_id), None)
+
+@bot.event
+async def on_webhooks_update(channel):
+    """Событие изменения webhook'ов канала - сбрасываем кэш для этого канала"""
+    invalidate_webhook_cache(channel.id)
 
-async def relay_message(message):
-    """Пересылает сообщение во все связанные каналы как webhook с именем пользователя"""
+async def relay_message(message, scan=None, xp_task=None):
+    """Пересылает сообщение во все связанные каналы как webhook с именем пользователя; возвращает число доставок"""
     try:
         channel_id = str(message.channel.id)
         current_channel_info = linked_channels[channel_id]
         network_name = current_channel_info['network']
         
         # Проверяем права бота в исходном канале
-        has_permissions, missing_perms = await check_bot_permissions(message.channel, notify_admin=True)
+        has_permissions, missing_perms = await check_bot_permissions(message.channel, notify_admin=True, use_cache=True)
         if not has_permissions:
-            logger.warning(f"Недостаточно прав в канале {message.channel.name} на сервере {message.guild.name}. Отсутствуют: {', '.join(missing_perms)}")
-            return
+            logger.warning("Недостаточно прав в канале %s на сервере %s. Отсутствуют: %s", message.channel.name, message.guild.name, ', '.join(missing_perms))
+            return 0
         
         # Проверяем длину сообщения и удаляем ссылки
         content = message.content if message.content else "*Сообщение без текста*"
         
         # Отладочная информация
-        logger.info(f"Обработка сообщения: content='{message.content}', attachments={len(message.attachments)}, embeds={len(message.embeds)}")
+        message_logger.debug("Обработка сообщения %s: content='%s', attachments=%s, embeds=%s", message.id, message.content, len(message.attachments), len(message.embeds))
         
         # Удаляем ссылки из контента, если есть текст, но НЕ удаляем если есть вложения (гифки, файлы) или embeds
         if message.content and not message.attachments and not message.embeds:
-            # Проверяем, есть ли ссылки в сообщении
-            url_pattern = r'(?:(?:https?|ftp)://|www\.)(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-            found_links = re.findall(url_pattern, message.content)
+            # Проверяем, есть ли ссылки в сообщении (фильтр уже нашёл и заменил их)
+            if scan is None:
+                scan = scan_message(message)
+            found_links = scan.matches(RULE_LINK)
             
             if found_links:
                 # Отправляем уведомление о нарушении
                 violation_type = f"Отправка ссылок в связанном канале ({len(found_links)} ссылок)"
-                await send_violation_report(message, violation_type, message.content)
-                logger.info(f"Обнаружены ссылки от {message.author.name}: {found_links}")
+                spawn_background(send_violation_report(message, violation_type, message.content), 'violation_report')
+                logger.info("Обнаружены ссылки от %s: %s", message.author.name, found_links)
             
-            logger.info(f"Применяем remove_links_from_text к: '{content}'")
-            content = remove_links_from_text(content)
-            logger.info(f"Результат после remove_links_from_text: '{content}'")
+            content = scan.content
+            message_logger.debug("Текст после удаления ссылок: '%s'", content)
         else:
-            logger.info(f"НЕ применяем remove_links_from_text (attachments: {len(message.attachments)}, embeds: {len(message.embeds)})")
+            message_logger.debug("НЕ удаляем ссылки (attachments: %s, embeds: %s)", len(message.attachments), len(message.embeds))
         
         if len(content) > 2000:
             content = content[:1997] + "..."
@@ -1307,119 +1925,340 @@ async def relay_message(message):
         #     content = f"{content}\n\n*Из {message.guild.name} • #{message.channel.name}*"
         
         # Отправляем сообщение во все связанные каналы той же сети
-        sent_count = 0
-        total_network_channels = 0
+        # Берём один снимок маршрутов: изменения конфигурации во время рассылки его не затронут
+        network_routes = routing_table.get(network_name, ())
+        total_network_channels = len(network_routes)
+        target_channel_ids = [other_channel_id for other_channel_id, _ in network_routes if other_channel_id != channel_id]
         
-        # Подсчитываем общее количество каналов в сети для диагностики
-        for other_channel_id, other_channel_info in linked_channels.items():
-            if other_channel_info['network'] == network_name:
-                total_network_channels += 1
+        message_logger.debug("Всего каналов в сети '%s': %s", network_name, total_network_channels)
         
-        logger.debug(f"Всего каналов в сети '{network_name}': {total_network_channels}")
+        if not target_channel_ids:
+            return 0
         
-        for other_channel_id, other_channel_info in linked_channels.items():
-            if other_channel_id != channel_id and other_channel_info['network'] == network_name:
-                try:
-                    target_channel = bot.get_channel(int(other_channel_id))
-                    if target_channel:
-                        # Проверяем права бота в целевом канале
-                        has_permissions, missing_perms = await check_bot_permissions(target_channel, notify_admin=True)
-                        if not has_permissions:
-                            logger.warning(f"Недостаточно прав в целевом канале {target_channel.name} на сервере {target_channel.guild.name}. Пропускаем.")
-                            continue
-                        # Создаем или получаем webhook для канала
-                        webhooks = await target_channel.webhooks()
-                        webhook = None
-                        
-                        # Ищем существующий webhook бота
-                        for wh in webhooks:
-                            if wh.user == bot.user:
-                                webhook = wh
-                                break
-                        
-                        # Создаем новый webhook если не найден
-                        if webhook is None:
-                            try:
-                                webhook = await target_channel.create_webhook(name="Channel Bridge")
-                            except discord.Forbidden:
-                                # Если нет прав на создание webhook, отправляем обычным сообщением
-                                user_level_info = get_user_level_info(message.author.id)
-                                level = user_level_info['level']
-                                
-                                if Config.LEVELS_ENABLED and level > 0:
-                                    display_name = f"{message.author.display_name} 🔥{level}"
-                                else:
-                                    display_name = message.author.display_name
-                                
-                                await target_channel.send(f"**{display_name}**: {content}")
-                                webhook = None
-                        
-                        if webhook:
-                            # Получаем уровень пользователя для отображения
-                            user_level_info = get_user_level_info(message.author.id)
-                            level = user_level_info['level']
-                            
-                            # Формируем имя с уровнем
-                            if Config.LEVELS_ENABLED and level > 0:
-                                display_name = f"{message.author.display_name} 🔥{level}"
-                            else:
-                                display_name = message.author.display_name
-                            
-                            # Отправляем сообщение через webhook с именем и аватаром пользователя
-                            await webhook.send(
-                                content=content,
-                                username=display_name,
-                                avatar_url=message.author.display_avatar.url
-                            )
-                        
-                        # Пересылаем вложения
-                        for attachment in message.attachments:
-                            if attachment.size <= Config.MAX_FILE_SIZE:
-                                try:
-                                    file_data = await attachment.read()
-                                    file = discord.File(io.BytesIO(file_data), filename=attachment.filename)
-                                    
-                                    if webhook:
-                                        await webhook.send(
-                                            file=file,
-                                            username=message.author.display_name,
-                                            avatar_url=message.author.display_avatar.url
-                                        )
-                                    else:
-                                        await target_channel.send(f"📎 **{message.author.display_name}** отправил файл:", file=file)
-                                except Exception as e:
-                                    logger.error(f"Ошибка при пересылке вложения: {e}")
-                                    error_msg = f"❌ Не удалось переслать файл: {attachment.filename}"
-                                    if webhook:
-                                        await webhook.send(
-                                            content=error_msg,
-                                            username=message.author.display_name,
-                                            avatar_url=message.author.display_avatar.url
-                                        )
-                                    else:
-                                        await target_channel.send(error_msg)
-                            else:
-                                size_msg = f"📎 Файл слишком большой: {attachment.filename} ({attachment.size} байт)"
-                                if webhook:
-                                    await webhook.send(
-                                        content=size_msg,
-                                        username=message.author.display_name,
-                                        avatar_url=message.author.display_avatar.url
-                                    )
-                                else:
-                                    await target_channel.send(size_msg)
-                        
-                        sent_count += 1
-                        logger.debug(f"Сообщение отправлено в канал {target_channel.guild.name}#{target_channel.name}")
-                    else:
-                        logger.warning(f"Канал {other_channel_id} недоступен")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке сообщения в канал {other_channel_id}: {e}")
+        # Данные для пересылки собираем один раз, все каналы используют их совместно
+        envelope = await build_relay_envelope(message, content, xp_task)
+        if envelope['oversized']:
+            DROPPED_ATTACHMENTS.inc('oversized', amount=len(envelope['oversized']))
+        if envelope['failed']:
+            DROPPED_ATTACHMENTS.inc('download_failed', amount=len(envelope['failed']))
         
-        logger.info(f"Сообщение от {message.author} переслано в {sent_count} из {total_network_channels-1} возможных каналов сети '{network_name}'")
+        # Записываем доставки в журнал до отправки, чтобы пережить перезапуск и временные сбои
+        if journal:
+            try:
+                await journal.run(journal.record, message.id, get_envelope_record(envelope), target_channel_ids)
+            except Exception as e:
+                logger.error("Не удалось записать доставки сообщения %s в журнал: %s", message.id, e)
+        
+        # Рассылаем параллельно; ошибки одного канала не влияют на остальные
+        network_semaphore = get_network_semaphore(network_name)
+        results = await asyncio.gather(
+            *(deliver_to_channel(message.id, envelope, other_channel_id, network_semaphore)
+              for other_channel_id in target_channel_ids),
+            return_exceptions=True
+        )
+        
+        sent_count = 0
+        for other_channel_id, result in zip(target_channel_ids, results):
+            if isinstance(result, BaseException):
+                logger.error("Ошибка при отправке сообщения в канал %s: %s", other_channel_id, result)
+                RELAY_DELIVERIES.inc(network_name, 'error')
+                continue
+            RELAY_DELIVERIES.inc(network_name, result)
+            if result == DELIVERY_SENT:
+                sent_count += 1
+        
+        if sent_count:
+            RELAYED_MESSAGES.inc(network_name)
+        # Учитываем только реально отправленные вложения: слишком большие и не скачанные не пересылались
+        relay_size = len(content.encode('utf-8')) + sum(len(file_data) for _, _, file_data in envelope['files'])
+        throughput.record(network_name, message.guild.id, len(envelope['files']), relay_size, sent_count)
+        message_logger.debug("Сообщение от %s переслано в %s из %s возможных каналов сети '%s'", message.author, sent_count, total_network_channels-1, network_name)
+        return sent_count
         
     except Exception as e:
-        logger.error(f"Ошибка при пересылке сообщения: {e}")
+        logger.error("Ошибка при пересылке сообщения: %s", e)
+        return 0
+
+# Поля данных пересылки, которые сохраняются в журнале (вложения - ссылками, без содержимого).
+# plan - разбиение на части: при повторе части собираются заново ровно по нему
+ENVELOPE_RECORD_FIELDS = ('content', 'display_name', 'author_name', 'avatar_url', 'attachments', 'plan')
+
+def get_envelope_record(envelope):
+    """Возвращает сериализуемую часть данных пересылки"""
+    return {field: envelope[field] for field in ENVELOPE_RECORD_FIELDS}
+
+async def build_relay_envelope(message, content, xp_task=None):
+    """Собирает данные для пересылки один раз на сообщение: текст, имя, аватар и содержимое вложений"""
+    # Уровень читаем после начисления XP за это сообщение, иначе повышение было бы видно только в следующем
+    # (ошибки начисления логирует сама фоновая задача)
+    if xp_task is not None:
+        await asyncio.wait([xp_task])
+    
+    # Получаем уровень пользователя для отображения
+    await ensure_levels_loaded(message.author.id)
+    user_level_info = get_user_level_info(message.author.id)
+    level = user_level_info['level']
+    
+    # Формируем имя с уровнем
+    if Config.LEVELS_ENABLED and level > 0:
+        display_name = f"{message.author.display_name} 🔥{level}"
+    else:
+        display_name = message.author.display_name
+    
+    record = {
+        'content': content,
+        'display_name': display_name,
+        'author_name': message.author.display_name,
+        'avatar_url': message.author.display_avatar.url,
+        'attachments': [(attachment.filename, attachment.url, attachment.size) for attachment in message.attachments]
+    }
+    return await prepare_relay_envelope(record)
+
+async def prepare_relay_envelope(record):
+    """Скачивает вложения и разбивает данные пересылки на запросы"""
+    envelope = dict(record)
+    envelope['files'] = []      # [(filename, url, bytes)] - скачаны один раз для всех каналов
+    envelope['oversized'] = []  # [(filename, size)] - превышают MAX_FILE_SIZE
+    envelope['failed'] = []     # [filename] - не удалось скачать
+    
+    # Скачиваем вложения параллельно, каждое ровно один раз
+    attachments = []
+    for filename, url, size in record['attachments']:
+        if size > Config.MAX_FILE_SIZE:
+            envelope['oversized'].append((filename, size))
+        else:
+            attachments.append((filename, url))
+    
+    results = await asyncio.gather(*(bot.http.get_from_cdn(url) for _, url in attachments), return_exceptions=True)
+    for (filename, _), result in zip(attachments, results):
+        if isinstance(result, BaseException):
+            logger.error("Ошибка при скачивании вложения %s: %s", filename, result)
+            envelope['failed'].append(filename)
+        else:
+            envelope['files'].append((filename, url, result))
+    
+    batches = split_relay_batches(envelope)
+    # [(content, [(filename, url)])] - план частей для журнала
+    envelope['plan'] = [(content, [(filename, url) for filename, url, _ in files]) for content, files in batches]
+    # [(content, [(filename, bytes)])] - готовые запросы для каждого канала
+    envelope['batches'] = [(content, [(filename, data) for filename, _, data in files]) for content, files in batches]
+    return envelope
+
+async def restore_relay_envelope(record, start_batch=0):
+    """Восстанавливает данные пересылки из журнала по сохранённому плану частей
+
+    Границы частей не зависят от результата повторного скачивания, поэтому номер
+    отправленной части из журнала всегда указывает на то же самое содержимое.
+    Файл, который не удалось скачать снова, заменяется уведомлением в той же части.
+    """
+    if 'plan' not in record:
+        # Запись сделана до появления плана - разбиваем заново
+        return await prepare_relay_envelope(record)
+    
+    envelope = dict(record)
+    envelope['files'] = []
+    envelope['oversized'] = []
+    envelope['failed'] = []
+    
+    pending = record['plan'][start_batch:]
+    urls = list({url for _, files in pending for _, url in files})
+    results = await asyncio.gather(*(bot.http.get_from_cdn(url) for url in urls), return_exceptions=True)
+    downloaded = dict(zip(urls, results))
+    
+    # Уже доставленные части не отправляются, их содержимое не нужно
+    batches = [(content, []) for content, _ in record['plan'][:start_batch]]
+    for content, files in pending:
+        batch_files = []
+        failed = []
+        for filename, url in files:
+            result = downloaded[url]
+            if isinstance(result, BaseException):
+                logger.error("Ошибка при повторном скачивании вложения %s: %s", filename, result)
+                failed.append(filename)
+            else:
+                batch_files.append((filename, result))
+        if failed:
+            notice = "\n".join(f"❌ Не удалось переслать файл: {filename}" for filename in failed)
+            content = f"{content}\n{notice}" if content else notice
+            content = content[:Config.MAX_MESSAGE_LENGTH]
+            envelope['failed'].extend(failed)
+        batches.append((content, batch_files))
+    
+    envelope['batches'] = batches
+    return envelope
+
+def split_relay_batches(envelope):
+    """Разбивает текст и вложения на минимальное число сообщений с учётом лимитов Discord на файлы: [(content, [(filename, url, bytes)])]"""
+    content = envelope['content']
+    notices = [f"❌ Не удалось переслать файл: {filename}" for filename in envelope['failed']]
+    notices += [f"📎 Файл слишком большой: {filename} ({size} байт)" for filename, size in envelope['oversized']]
+    notice_text = "\n".join(notices)
+    extra_batches = []
+    if notice_text:
+        if len(content) + 1 + len(notice_text) <= Config.MAX_MESSAGE_LENGTH:
+            content = f"{content}\n{notice_text}"
+        else:
+            extra_batches.append((notice_text[:Config.MAX_MESSAGE_LENGTH], []))
+    
+    # Жадно набираем файлы в сообщение, пока не упрёмся в лимит количества или суммарного размера
+    batches = [(content, [])]
+    batch_size = 0
+    for filename, url, file_data in envelope['files']:
+        files = batches[-1][1]
+        if files and (len(files) >= Config.RELAY_MAX_FILES_PER_MESSAGE or batch_size + len(file_data) > Config.MAX_UPLOAD_SIZE):
+            batches.append((None, []))
+            files = batches[-1][1]
+            batch_size = 0
+        files.append((filename, url, file_data))
+        batch_size += len(file_data)
+    
+    return batches + extra_batches
+
+# Результаты доставки в один канал
+DELIVERY_SENT = 'sent'        # Доставлено
+DELIVERY_SKIPPED = 'skipped'  # Не доставлено и повторять бессмысленно (нет канала или прав)
+DELIVERY_RETRY = 'retry'      # Временный сбой, доставка будет повторена
+DELIVERY_FAILED = 'failed'    # Временный сбой, но журнал отключён - повторять некому, доставка потеряна
+
+def is_transient_delivery_error(error):
+    """Проверяет, имеет ли смысл повторить доставку после ошибки"""
+    if isinstance(error, (OutboundQueueFull, discord.RateLimited, discord.NotFound, aiohttp.ClientError, asyncio.TimeoutError, OSError)):
+        return True
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return False
+
+async def relay_to_channel(envelope, target_channel_id, network_semaphore, start_batch=0, on_batch_sent=None):
+    """Пересылает сообщение в один целевой канал сети, возвращает (результат, отправлено частей, ошибка)
+
+    on_batch_sent(sent_batches) вызывается после каждой доставленной части.
+    """
+    sent_batches = start_batch
+    # Сначала слот сети, затем общий: загруженная сеть не занимает слоты процесса в ожидании
+    async with network_semaphore, relay_semaphore:
+        try:
+            target_channel = bot.get_channel(int(target_channel_id))
+            if not target_channel:
+                logger.warning("Канал %s недоступен", target_channel_id)
+                return DELIVERY_SKIPPED, sent_batches, None
+            
+            # Проверяем права бота в целевом канале
+            has_permissions, missing_perms = await check_bot_permissions(target_channel, notify_admin=True, use_cache=True)
+            if not has_permissions:
+                logger.warning("Недостаточно прав в целевом канале %s на сервере %s. Пропускаем.", target_channel.name, target_channel.guild.name)
+                return DELIVERY_SKIPPED, sent_batches, None
+            for attempt in range(2):
+                # Создаем или получаем webhook для канала (из кэша, если есть)
+                try:
+                    webhook = await get_relay_webhook(target_channel)
+                except discord.Forbidden:
+                    # Если нет прав на создание webhook, отправляем обычными сообщениями
+                    webhook = None
+                
+                # Текст и вложения уходят одним запросом (или несколькими, если не помещаются в лимиты)
+                # При повторе пропускаем части, которые уже были доставлены
+                try:
+                    for batch_content, batch_files in envelope['batches'][sent_batches:]:
+                        await send_relay_batch(target_channel, webhook, envelope, batch_content, batch_files)
+                        sent_batches += 1
+                        if on_batch_sent:
+                            await on_batch_sent(sent_batches)
+                    break
+                except discord.NotFound as e:
+                    # Без журнала повторить позже некому - сразу пробуем ещё раз с новым webhook'ом
+                    if journal or attempt:
+                        raise
+                    invalidate_webhook_cache(target_channel_id)
+                    logger.warning("Webhook в канале %s не найден, повторяем отправку с новым: %s", target_channel_id, e)
+            
+            message_logger.debug("Сообщение отправлено в канал %s#%s", target_channel.guild.name, target_channel.name)
+            return DELIVERY_SENT, sent_batches, None
+        except discord.NotFound as e:
+            # Webhook удалён вручную (Unknown Webhook) - сбрасываем кэш, при повторе он будет создан заново
+            invalidate_webhook_cache(target_channel_id)
+            logger.error("Webhook в канале %s не найден, кэш сброшен: %s", target_channel_id, e)
+            return DELIVERY_RETRY, sent_batches, e
+        except Exception as e:
+            logger.error("Ошибка при отправке сообщения в канал %s: %s", target_channel_id, e)
+            status = DELIVERY_RETRY if is_transient_delivery_error(e) else DELIVERY_SKIPPED
+            return status, sent_batches, e
+
+async def hold_delivery_lease(message_id, target_channel_id):
+    """Продлевает аренду доставки, пока она выполняется, чтобы повтор из журнала её не перехватил"""
+    while True:
+        await asyncio.sleep(Config.JOURNAL_LEASE_SECONDS / 3)
+        try:
+            await journal.run(journal.renew_lease, message_id, target_channel_id)
+        except Exception as e:
+            logger.error("Не удалось продлить аренду доставки сообщения %s в канал %s: %s", message_id, target_channel_id, e)
+
+async def deliver_to_channel(message_id, envelope, target_channel_id, network_semaphore, start_batch=0):
+    """Доставляет сообщение в канал и отмечает результат в журнале доставок
+
+    Каждая пара (сообщение, канал) записана в журнале один раз, и пока доставка выполняется,
+    её аренда продлевается - повтор из журнала не отправит её параллельно. Номер доставленной
+    части сохраняется сразу после отправки, поэтому после падения процесса повтор продолжит
+    со следующей части; повторно может уйти только часть, отправленная в момент падения
+    (Discord не принимает ключ идемпотентности для webhook'ов).
+    """
+    if not journal:
+        status, _, error = await relay_to_channel(envelope, target_channel_id, network_semaphore, start_batch)
+        if status == DELIVERY_RETRY:
+            logger.error("Доставка сообщения %s в канал %s потеряна: журнал доставок отключён (%s)", message_id, target_channel_id, error)
+            return DELIVERY_FAILED
+        return status
+    
+    async def save_progress(sent_batches):
+        try:
+            await journal.run(journal.mark_sent, message_id, target_channel_id, sent_batches)
+        except Exception as e:
+            logger.error("Не удалось сохранить ход доставки сообщения %s в канал %s: %s", message_id, target_channel_id, e)
+    
+    lease_task = asyncio.create_task(hold_delivery_lease(message_id, target_channel_id))
+    try:
+        status, sent_batches, error = await relay_to_channel(envelope, target_channel_id, network_semaphore, start_batch, save_progress)
+    finally:
+        lease_task.cancel()
+    
+    try:
+        if status == DELIVERY_RETRY:
+            if await journal.run(journal.schedule_retry, message_id, target_channel_id, sent_batches, error):
+                DELIVERY_RETRIES.inc()
+            else:
+                logger.error("Доставка сообщения %s в канал %s потеряна: попытки исчерпаны (%s) или её нет в журнале", message_id, target_channel_id, Config.JOURNAL_MAX_ATTEMPTS)
+        else:
+            await journal.run(journal.complete, message_id, target_channel_id)
+    except Exception as e:
+        logger.error("Ошибка журнала доставок для сообщения %s в канал %s: %s", message_id, target_channel_id, e)
+    return status
+
+async def send_relay_batch(target_channel, webhook, envelope, batch_content, batch_files):
+    """Отправляет одну часть пересылаемого сообщения через планировщик исходящих запросов"""
+    def make_files():
+        # discord.File закрывается после отправки, поэтому создаём файлы заново на каждую попытку
+        return [discord.File(io.BytesIO(file_data), filename=filename) for filename, file_data in batch_files]
+    
+    if webhook:
+        return await outbound.submit(
+            f"webhook:{webhook.id}",
+            lambda: webhook.send(
+                content=batch_content,
+                username=envelope['display_name'],
+                avatar_url=envelope['avatar_url'],
+                files=make_files()
+            ),
+            PRIORITY_RELAY
+        )
+    
+    if batch_content:
+        text = f"**{envelope['display_name']}**: {batch_content}"
+    else:
+        text = f"📎 **{envelope['author_name']}** отправил файлы:"
+    return await outbound.submit(
+        f"channel:{target_channel.id}",
+        lambda: target_channel.send(text, files=make_files()),
+        PRIORITY_RELAY
+    )
 
 # Slash команда для создания новой сети
 @bot.tree.command(name="создать-сеть", description="Создать новую сеть и подключить к ней канал (название сети может отличаться от названия канала)")
@@ -1480,7 +2319,7 @@ async def slash_create_network(interaction: discord.Interaction, network_name: s
         return
     
     # Проверяем, существует ли уже сеть с таким именем
-    network_exists = any(ch_info['network'] == network_name for ch_info in linked_channels.values())
+    network_exists = network_name in routing_table
     if network_exists:
         embed = discord.Embed(
             title="⚠️ Сеть уже существует",
@@ -1517,7 +2356,8 @@ async def slash_create_network(interaction: discord.Interaction, network_name: s
         'linked_by': str(interaction.user.id)
     }
     
-    save_channels_config(linked_channels)
+    rebuild_routing_table()
+    save_channels_config(linked_channels, [channel_id])
     
     embed = discord.Embed(
         title="✅ Сеть создана",
@@ -1530,7 +2370,7 @@ async def slash_create_network(interaction: discord.Interaction, network_name: s
     
     await interaction.followup.send(embed=embed)
     
-    logger.info(f"Создана новая сеть '{network_name}' пользователем {interaction.user} в канале {interaction.guild.name}#{interaction.channel.name}")
+    logger.info("Создана новая сеть '%s' пользователем %s в канале %s#%s", network_name, interaction.user, interaction.guild.name, interaction.channel.name)
     
     # Обновляем статус бота
     activity = discord.Activity(type=discord.ActivityType.watching, name=f"{len(linked_channels)} связанных каналов")
@@ -1603,7 +2443,7 @@ async def slash_link_channel(interaction: discord.Interaction, network_name: str
         return
     
     # Проверяем, существует ли сеть с таким именем
-    network_exists = any(ch_info['network'] == network_name for ch_info in linked_channels.values())
+    network_exists = network_name in routing_table
     if not network_exists:
         embed = discord.Embed(
             title="❌ Сеть не найдена",
@@ -1619,9 +2459,8 @@ async def slash_link_channel(interaction: discord.Interaction, network_name: str
     current_guild_id = interaction.guild.id
     
     if current_guild_id != privileged_guild_id:
-        for existing_channel_id, existing_channel_info in linked_channels.items():
-            if (existing_channel_info['network'] == network_name and 
-                existing_channel_info.get('guild_id') == current_guild_id):
+        for existing_channel_id, existing_guild_id in routing_table.get(network_name, ()):
+            if existing_guild_id == current_guild_id:
                 embed = discord.Embed(
                     title="⚠️ Сеть уже используется",
                     description=f"На этом сервере уже есть канал, подключенный к сети `{network_name}`. \n\nОдин сервер может быть подключен только к одной сети через один канал.",
@@ -1640,10 +2479,11 @@ async def slash_link_channel(interaction: discord.Interaction, network_name: str
         'linked_by': str(interaction.user.id)
     }
     
-    save_channels_config(linked_channels)
+    rebuild_routing_table()
+    save_channels_config(linked_channels, [channel_id])
     
     # Подсчитываем количество каналов в сети
-    network_channels = [ch for ch in linked_channels.values() if ch['network'] == network_name]
+    network_channels = routing_table.get(network_name, ())
     
     embed = discord.Embed(
         title="✅ Канал подключен",
@@ -1656,7 +2496,7 @@ async def slash_link_channel(interaction: discord.Interaction, network_name: str
     
     await interaction.response.send_message(embed=embed)
     
-    logger.info(f"Канал {interaction.guild.name}#{interaction.channel.name} связан с сетью '{network_name}' пользователем {interaction.user}")
+    logger.info("Канал %s#%s связан с сетью '%s' пользователем %s", interaction.guild.name, interaction.channel.name, network_name, interaction.user)
     
     # Обновляем статус бота
     activity = discord.Activity(type=discord.ActivityType.watching, name=f"{len(linked_channels)} связанных каналов")
@@ -1692,7 +2532,10 @@ async def slash_unlink_channel(interaction: discord.Interaction):
     
     network_name = linked_channels[channel_id]['network']
     del linked_channels[channel_id]
-    save_channels_config(linked_channels)
+    invalidate_webhook_cache(channel_id)
+    permission_issues.pop(channel_id, None)
+    rebuild_routing_table()
+    save_channels_config(linked_channels, [channel_id])
     
     embed = discord.Embed(
         title="✅ Канал отключен",
@@ -1703,7 +2546,7 @@ async def slash_unlink_channel(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
     
-    logger.info(f"Канал {interaction.guild.name}#{interaction.channel.name} отключен от сети '{network_name}' пользователем {interaction.user}")
+    logger.info("Канал %s#%s отключен от сети '%s' пользователем %s", interaction.guild.name, interaction.channel.name, network_name, interaction.user)
     
     # Обновляем статус бота
     activity = discord.Activity(type=discord.ActivityType.watching, name=f"{len(linked_channels)} связанных каналов")
@@ -1830,7 +2673,7 @@ async def slash_search_networks(interaction: discord.Interaction):
         await interaction.response.send_message(embed=embed, ephemeral=True)
         
     except Exception as e:
-        logger.error(f"Ошибка в команде поиск-сети: {e}")
+        logger.error("Ошибка в команде поиск-сети: %s", e)
         embed = discord.Embed(
             title="❌ Ошибка",
             description="Произошла ошибка при поиске сетей.",
@@ -1838,6 +2681,95 @@ async def slash_search_networks(interaction: discord.Interaction):
         )
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
+THROUGHPUT_WINDOW_TITLES = {'minute': 'последний час', 'hour': 'последние сутки', 'day': 'последние 30 дней'}
+
+def format_bytes(size):
+    """Форматирует размер в байтах для отображения"""
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if size < 1024 or unit == 'ГБ':
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+
+@bot.tree.command(name="активность-сетей", description="Показать самые активные сети и серверы")
+@app_commands.describe(period="Период статистики")
+@app_commands.choices(period=[
+    app_commands.Choice(name="Последний час", value="minute"),
+    app_commands.Choice(name="Последние сутки", value="hour"),
+    app_commands.Choice(name="Последние 30 дней", value="day")
+])
+async def slash_network_activity(interaction: discord.Interaction, period: str = "hour"):
+    """Slash команда для отображения нагрузки по сетям и серверам"""
+    if period not in WINDOW_NAMES:
+        period = "hour"
+    
+    embed = discord.Embed(
+        title="📈 Активность сетей",
+        description=f"Пересланные сообщения за {THROUGHPUT_WINDOW_TITLES[period]}",
+        color=Config.EMBED_COLOR_INFO
+    )
+    
+    top_networks = throughput.top('networks', period, limit=10)
+    if not top_networks:
+        embed.description += "\n\nЗа этот период сообщений не было."
+    
+    for network_name, totals in top_networks:
+        embed.add_field(
+            name=f"🌐 {network_name}",
+            value=(f"💬 Сообщений: **{totals['messages']}**\n"
+                   f"📎 Вложений: **{totals['attachments']}**\n"
+                   f"📦 Объём: **{format_bytes(totals['bytes'])}**\n"
+                   f"📤 Доставок: **{totals['deliveries']}**"),
+            inline=True
+        )
+    
+    top_guilds = throughput.top('guilds', period, limit=5)
+    if top_guilds:
+        lines = []
+        for guild_id, totals in top_guilds:
+            guild = bot.get_guild(int(guild_id))
+            guild_name = guild.name if guild else guild_id
+            lines.append(f"**{guild_name}** - {totals['messages']} сообщ., {format_bytes(totals['bytes'])}")
+        embed.add_field(name="🏠 Самые активные серверы", value="\n".join(lines), inline=False)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="топ", description="Показать рейтинг пользователей по XP")
+@app_commands.describe(page="Номер страницы")
+async def slash_leaderboard(interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+    """Slash команда для отображения рейтинга по XP"""
+    if not Config.LEVELS_ENABLED:
+        embed = discord.Embed(
+            title="❌ Система уровней отключена",
+            description="Рейтинг недоступен, пока система уровней выключена.",
+            color=Config.EMBED_COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    
+    page_size = Config.LEADERBOARD_PAGE_SIZE
+    total_pages = max(1, -(-len(leaderboard) // page_size))
+    page = min(page, total_pages)
+    
+    embed = discord.Embed(
+        title="🏆 Рейтинг по XP",
+        color=Config.EMBED_COLOR_INFO
+    )
+    
+    # Страница берётся из индекса рейтинга - время не зависит от числа пользователей
+    lines = []
+    for rank, user_id, xp in leaderboard.page((page - 1) * page_size, page_size):
+        place = {1: "🥇", 2: "🥈", 3: "🥉"}.get(rank, f"**{rank}.**")
+        lines.append(f"{place} <@{user_id}> - уровень {calculate_level(xp)}, {xp} XP")
+    embed.description = "\n".join(lines) if lines else "Пока никто не набрал XP."
+    
+    own_rank = leaderboard.rank(str(interaction.user.id))
+    footer = f"Страница {page} из {total_pages}"
+    if own_rank is not None:
+        footer += f" • Ваше место: {own_rank} из {len(leaderboard)}"
+    embed.set_footer(text=footer)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="бот-инфо", description="Показать информацию о боте")
 async def slash_bot_info(interaction: discord.Interaction):
     """Slash команда для отображения информации о боте"""
@@ -1870,7 +2802,7 @@ async def slash_bot_info(interaction: discord.Interaction):
     
     embed.add_field(
         name="📋 Основные команды",
-        value="`/создать-сеть` - создать новую сеть\n`/связать` - подключить канал к существующей сети\n`/отключить` - отключить канал\n`/поиск-сети` - показать доступные сети\n`/проверить_права` - проверить права бота\n\n💡 **Важно:** Название сети может быть любым и не обязательно должно совпадать с названием канала!",
+        value="`/создать-сеть` - создать новую сеть\n`/связать` - подключить канал к существующей сети\n`/отключить` - отключить канал\n`/поиск-сети` - показать доступные сети\n`/активность-сетей` - нагрузка по сетям\n`/топ` - рейтинг по XP\n`/проверить_права` - проверить права бота\n\n💡 **Важно:** Название сети может быть любым и не обязательно должно совпадать с названием канала!",
         inline=False
     )
     
@@ -1879,58 +2811,157 @@ async def slash_bot_info(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 
-# Flask API для статистики
-app = Flask(__name__)
-CORS(app)  # Разрешаем CORS для веб-сайта
+def get_cache_sizes():
+    """Возвращает размеры кэшей и структур в памяти"""
+    return {
+        'webhooks': len(webhook_cache),
+        'permissions': sum(len(channels) for channels in list(permission_cache.values())),
+        'moderation_channels': len(moderation_channel_cache),
+        'routing_networks': len(routing_table),
+        'blacklist': len(blacklist),
+        'xp_cooldowns': len(last_xp_time),
+        'leaderboard': len(leaderboard),
+        'levels_resident': len(levels_data),
+        'levels_dirty': len(levels_dirty_users),
+        'antispam_windows': len(user_message_times),
+        'antispam_mutes': len(muted_users),
+        'antispam_timers': len(antispam_timers),
+        'outbound_buckets': len(outbound.buckets)
+    }
+
+# Датчики считываются в момент запроса метрик
+registry.gauge('relay_queue_depth', 'Сообщения в очередях пересылки', function=lambda: sum(queue.qsize() for queue in relay_queues))
+registry.gauge(
+    'outbound_queue_depth', 'Запросы в очереди планировщика по классам приоритета', ('priority',),
+    function=lambda: {PRIORITY_NAMES[priority]: count for priority, count in outbound.pending.items()}
+)
+registry.gauge('background_tasks', 'Выполняющиеся фоновые задачи', function=lambda: len(background_tasks))
+registry.gauge('cache_entries', 'Размер кэшей и структур в памяти', ('cache',), function=get_cache_sizes)
+
+# HTTP API статистики: aiohttp в цикле событий бота
+HTTP_REQUEST_LATENCY = registry.histogram('http_request_seconds', 'Время обработки запросов к API', ('path', 'status'))
+
+# CORS для веб-сайта: разрешены любые источники
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'ETag'
+}
+
+api_runner = None
 
-@app.route('/api/stats')
-def get_bot_stats():
-    """Возвращает статистику бота в JSON формате"""
+@web.middleware
+async def api_middleware(request, handler):
+    """Учитывает время запросов и добавляет заголовки CORS"""
+    started = time.perf_counter()
+    status = 500
     try:
-        # Подсчитываем статистику
-        guild_count = len(bot.guilds)
-        user_count = sum(guild.member_count for guild in bot.guilds)
-        
-        # Подсчитываем количество связанных каналов
-        channels_config = load_channels_config()
-        linked_channels = len(channels_config)
-        
-        # Подсчитываем количество уникальных сетей
-        networks = set()
-        for channel_data in channels_config.values():
-            if isinstance(channel_data, dict) and 'network' in channel_data:
-                networks.add(channel_data['network'])
-            elif isinstance(channel_data, str):
-                networks.add(channel_data)
-        active_networks = len(networks)
-        
-        # Примерное количество сообщений (можно добавить счетчик в будущем)
-        message_count = linked_channels * 1000  # Примерная оценка
-        
-        stats = {
-            'servers': guild_count,
-            'users': user_count,
-            'messages': message_count,
-            'networks': active_networks,
-            'linked_channels': linked_channels,
-            'uptime': 'Online',
-            'last_updated': datetime.utcnow().isoformat()
-        }
-        
-        return jsonify(stats)
-    except Exception as e:
-        logger.error(f"Ошибка при получении статистики: {e}")
-        return jsonify({
+        if request.method == 'OPTIONS':
+            # Предварительный запрос CORS
+            response = web.Response(headers={
+                'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
+                'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', '*'),
+                'Access-Control-Max-Age': '86400'
+            })
+        else:
+            response = await handler(request)
+        status = response.status
+        response.headers.update(CORS_HEADERS)
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        e.headers.update(CORS_HEADERS)
+        raise
+    finally:
+        route = request.match_info.route.resource
+        path = route.canonical if route is not None else 'unmatched'
+        HTTP_REQUEST_LATENCY.observe(time.perf_counter() - started, path, status)
+
+async def get_bot_stats(request):
+    """Возвращает статистику бота в JSON формате (последний опубликованный снимок)"""
+    published = bot_stats.published
+    if published is None:
+        return web.json_response({
             'servers': 0,
             'users': 0,
             'messages': 0,
             'networks': 0,
-            'error': 'Не удалось получить статистику'
-        }), 500
+            'error': 'Статистика ещё не готова'
+        }, status=503)
+    
+    headers = {'Cache-Control': f"public, max-age={Config.STATS_PUBLISH_INTERVAL}"}
+    
+    # Клиент с актуальной копией получает 304 без тела
+    if any(tag.value in (published.etag, '*') for tag in request.if_none_match or ()):
+        response = web.Response(status=304, headers=headers)
+    else:
+        response = web.Response(body=published.body, content_type='application/json', headers=headers)
+    response.etag = published.etag
+    return response
 
-def run_flask():
-    """Запускает Flask сервер в отдельном потоке"""
-    app.run(host='0.0.0.0', port=25758, debug=False)
+async def get_metrics(request):
+    """Возвращает метрики в текстовом формате Prometheus"""
+    return web.Response(body=registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+async def get_leaderboard(request):
+    """Возвращает страницу рейтинга по XP и, по запросу, место пользователя"""
+    try:
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', Config.LEADERBOARD_PAGE_SIZE))
+    except ValueError:
+        return web.json_response({'error': 'offset и limit должны быть целыми числами'}, status=400)
+    if offset < 0 or limit <= 0:
+        return web.json_response({'error': 'offset должен быть неотрицательным, limit - положительным'}, status=400)
+    limit = min(limit, Config.LEADERBOARD_API_MAX_LIMIT)
+    
+    payload = {
+        'total': len(leaderboard),
+        'offset': offset,
+        'limit': limit,
+        'entries': [
+            {'rank': rank, 'user_id': str(user_id), 'xp': xp, 'level': calculate_level(xp)}
+            for rank, user_id, xp in leaderboard.page(offset, limit)
+        ]
+    }
+    user_id = request.query.get('user')
+    if user_id:
+        if not user_id.isdigit():
+            return web.json_response({'error': 'user должен быть ID пользователя'}, status=400)
+        payload['user'] = {'user_id': user_id, 'rank': leaderboard.rank(user_id), 'xp': leaderboard.xp(user_id)}
+    return web.json_response(payload)
+
+def create_api_app():
+    """Создаёт приложение API статистики"""
+    app = web.Application(middlewares=[api_middleware])
+    app.router.add_get('/api/stats', get_bot_stats)
+    app.router.add_get('/api/leaderboard', get_leaderboard)
+    app.router.add_get('/metrics', get_metrics)
+    return app
+
+async def start_api_server():
+    """Запускает HTTP API в цикле событий бота"""
+    global api_runner
+    if api_runner is not None:
+        return
+    runner = web.AppRunner(create_api_app(), access_log=None, keepalive_timeout=Config.API_KEEPALIVE_TIMEOUT)
+    await runner.setup()
+    site = web.TCPSite(runner, Config.API_HOST, Config.API_PORT)
+    try:
+        await site.start()
+    except OSError as e:
+        logger.error("Не удалось запустить API на %s:%s: %s", Config.API_HOST, Config.API_PORT, e)
+        await runner.cleanup()
+        return
+    api_runner = runner
+    logger.info("API статистики запущен на %s:%s", Config.API_HOST, Config.API_PORT)
+
+async def stop_api_server():
+    """Останавливает HTTP API: новые соединения не принимаются, начатые запросы завершаются"""
+    global api_runner
+    if api_runner is None:
+        return
+    runner, api_runner = api_runner, None
+    await runner.cleanup()
+    logger.info("API статистики остановлен")
 
 # Запуск бота
 if __name__ == "__main__":
@@ -1944,20 +2975,43 @@ if __name__ == "__main__":
         # Инициализируем чёрный список
         if Config.BLACKLIST_ENABLED:
             blacklist = load_blacklist()
-            logger.info(f"Загружен чёрный список: {len(blacklist)} пользователей")
+            logger.info("Загружен чёрный список: %s пользователей", len(blacklist))
         
         # Инициализируем систему уровней
         if Config.LEVELS_ENABLED:
             load_levels()
-            logger.info(f"Система уровней инициализирована")
-        
-        # Запускаем Flask API в отдельном потоке
-        logger.info("Запуск Flask API сервера...")
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        
+            logger.info("Система уровней инициализирована")
+        
+        # Восстанавливаем счётчики пересылки
+        throughput.load(load_throughput_snapshot(Config.THROUGHPUT_FILE))
+        # Сети, удалённые пока бот был остановлен
+        for network_name in list(throughput.counters['networks']):
+            if network_name not in routing_table:
+                throughput.forget('networks', network_name)
+        
+        # Незавершённые до перезапуска доставки становятся доступны для повтора сразу
+        if journal:
+            released = journal.release_all()
+            if released:
+                logger.info("В журнале найдено %s незавершённых доставок, они будут повторены", released)
+        
+        # API статистики запускается в цикле бота (setup_hook) и останавливается вместе с ним
         logger.info("Запуск Discord бота...")
-        bot.run(Config.DISCORD_TOKEN)
+        # Логирование уже настроено (очередь и обработчики), discord.py не добавляет своих обработчиков
+        bot.run(Config.DISCORD_TOKEN, log_handler=None)
     except Exception as e:
-        logger.error(f"Ошибка при запуске бота: {e}")
-        exit(1)
\ No newline at end of file
+        logger.error("Ошибка при запуске бота: %s", e)
+        exit(1)
+    finally:
+        # Финальная запись несохранённых данных уровней при остановке
+        if Config.LEVELS_ENABLED and levels_dirty_users:
+            save_levels()
+            logger.info("Данные уровней сохранены перед завершением работы")
+        
+        # Последний снимок счётчиков пересылки
+        save_throughput()
+        
+        # Дожидаемся завершения отложенных записей в хранилище
+        storage.close()
+        if journal:
+            journal.close()
\ No newline at end of file
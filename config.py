@@ -13,12 +13,53 @@ class Config:
     # Префикс команд
     COMMAND_PREFIX = os.getenv('COMMAND_PREFIX', '!')
     
+    # Хранилище данных: 'json' (файлы ниже) или 'sqlite' (одна база в режиме WAL)
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+    STORAGE_SQLITE_FILE = os.getenv('STORAGE_SQLITE_FILE', 'relay.db')
+    
     # Файл конфигурации каналов
     CHANNELS_CONFIG_FILE = os.getenv('CHANNELS_CONFIG_FILE', 'channels_config.json')
     
     # Максимальный размер файла для пересылки (в байтах)
     MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', '8388608'))  # 8MB по умолчанию
     
+    # Лимиты Discord на одно сообщение с вложениями
+    RELAY_MAX_FILES_PER_MESSAGE = int(os.getenv('RELAY_MAX_FILES_PER_MESSAGE', '10'))
+    MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', '10485760'))  # Суммарный размер файлов, 10MB по умолчанию
+    
+    # Параллельная пересылка сообщений
+    RELAY_MAX_CONCURRENCY = int(os.getenv('RELAY_MAX_CONCURRENCY', '50'))  # Одновременных отправок на процесс
+    RELAY_NETWORK_CONCURRENCY = int(os.getenv('RELAY_NETWORK_CONCURRENCY', '10'))  # Одновременных отправок в одной сети
+    # Очереди пересылки: сообщения одного канала обрабатываются одним обработчиком по порядку
+    RELAY_WORKERS = int(os.getenv('RELAY_WORKERS', '8'))
+    RELAY_QUEUE_SIZE = int(os.getenv('RELAY_QUEUE_SIZE', '1000'))  # Сообщений в очереди одного обработчика
+    
+    # Планировщик исходящих сообщений
+    OUTBOUND_MAX_CONCURRENCY = int(os.getenv('OUTBOUND_MAX_CONCURRENCY', '50'))  # Одновременных запросов к Discord
+    OUTBOUND_MAX_QUEUE = int(os.getenv('OUTBOUND_MAX_QUEUE', '1000'))  # Максимум ожидающих запросов на класс приоритета
+    
+    # Журнал доставок: повтор пересылок после сбоев и перезапуска
+    JOURNAL_ENABLED = os.getenv('JOURNAL_ENABLED', 'true').lower() == 'true'
+    JOURNAL_FILE = os.getenv('JOURNAL_FILE', 'relay_journal.db')
+    JOURNAL_LEASE_SECONDS = int(os.getenv('JOURNAL_LEASE_SECONDS', '120'))  # Время, на которое доставка закрепляется за попыткой
+    JOURNAL_RETRY_INTERVAL = int(os.getenv('JOURNAL_RETRY_INTERVAL', '15'))  # Период проверки доставок для повтора (секунды)
+    JOURNAL_RETRY_BATCH = int(os.getenv('JOURNAL_RETRY_BATCH', '100'))  # Доставок за одну проверку
+    JOURNAL_RETRY_BASE_DELAY = int(os.getenv('JOURNAL_RETRY_BASE_DELAY', '5'))  # Начальная задержка повтора (секунды)
+    JOURNAL_RETRY_MAX_DELAY = int(os.getenv('JOURNAL_RETRY_MAX_DELAY', '600'))  # Максимальная задержка повтора (секунды)
+    JOURNAL_MAX_ATTEMPTS = int(os.getenv('JOURNAL_MAX_ATTEMPTS', '8'))
+    
+    # Счётчики пересылки по сетям и серверам
+    THROUGHPUT_FILE = os.getenv('THROUGHPUT_FILE', 'throughput.json')
+    THROUGHPUT_SAVE_INTERVAL = int(os.getenv('THROUGHPUT_SAVE_INTERVAL', '300'))  # Период сохранения счётчиков (секунды)
+    
+    # Публикация статистики для API (секунды); это же значение отдаётся в Cache-Control: max-age
+    STATS_PUBLISH_INTERVAL = int(os.getenv('STATS_PUBLISH_INTERVAL', '5'))
+    
+    # HTTP API статистики (работает в цикле событий бота)
+    API_HOST = os.getenv('API_HOST', '0.0.0.0')
+    API_PORT = int(os.getenv('API_PORT', '25758'))
+    API_KEEPALIVE_TIMEOUT = int(os.getenv('API_KEEPALIVE_TIMEOUT', '75'))  # Время удержания keep-alive соединения (секунды)
+    
     # Цвета для embed'ов
     EMBED_COLOR_DEFAULT = int(os.getenv('EMBED_COLOR_DEFAULT', '0x393a41'), 16)
     EMBED_COLOR_SUCCESS = int(os.getenv('EMBED_COLOR_SUCCESS', '0x393a41'), 16)
@@ -30,6 +71,10 @@ class Config:
     # Настройки логирования
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', '10485760'))  # Размер файла лога до ротации, 10MB по умолчанию
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))  # Сколько старых файлов хранить
+    LOG_COMPRESS = os.getenv('LOG_COMPRESS', 'true').lower() == 'true'  # Сжимать старые файлы gzip
+    LOG_MESSAGE_SAMPLE_RATE = float(os.getenv('LOG_MESSAGE_SAMPLE_RATE', '0.01'))  # Доля отладочных записей о сообщениях
     
     # Максимальная длина сообщения
     MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', '2000'))
@@ -52,6 +97,14 @@ class Config:
     ANTISPAM_MUTE_DURATION = int(os.getenv('ANTISPAM_MUTE_DURATION', '60'))  # Время мута в секундах
     ANTISPAM_LOG_CHANNEL_ID = 1388981755263844576  # ID канала для уведомлений о спаме
     
+    # Не чаще одного уведомления о недостающих правах в канале за период (секунды)
+    PERMISSION_NOTICE_COOLDOWN = int(os.getenv('PERMISSION_NOTICE_COOLDOWN', '3600'))
+    # Права отслеживаются по событиям; полная сверка - редкая страховка
+    PERMISSION_RECHECK_DELAY = int(os.getenv('PERMISSION_RECHECK_DELAY', '10'))  # Задержка перепроверки после событий (секунды)
+    PERMISSION_SWEEP_INTERVAL_HOURS = float(os.getenv('PERMISSION_SWEEP_INTERVAL_HOURS', '6'))
+    PERMISSION_SWEEP_BATCH_SIZE = int(os.getenv('PERMISSION_SWEEP_BATCH_SIZE', '50'))
+    PERMISSION_SWEEP_BATCH_DELAY = float(os.getenv('PERMISSION_SWEEP_BATCH_DELAY', '1'))  # Пауза между пачками (секунды)
+    
     # Настройки анти-рейд защиты
     RAID_PROTECTION_ENABLED = os.getenv('RAID_PROTECTION_ENABLED', 'true').lower() == 'true'
     RAID_PROTECTION_BLOCK_MASS_MENTIONS = os.getenv('RAID_PROTECTION_BLOCK_MASS_MENTIONS', 'true').lower() == 'true'  # Блокировать @everyone/@here
@@ -68,6 +121,7 @@ class Config:
     BLACKLIST_BAN_CHANNEL_ID = int(os.getenv('BLACKLIST_BAN_CHANNEL_ID', '1388985623268032645'))  # ID канала для блокировки
     BLACKLIST_UNBAN_CHANNEL_ID = int(os.getenv('BLACKLIST_UNBAN_CHANNEL_ID', '1388985666821423134'))  # ID канала для разблокировки
     BLACKLIST_FILE = os.getenv('BLACKLIST_FILE', 'blacklist.json')  # Файл для хранения чёрного списка
+    BLACKLIST_RELOAD_INTERVAL = int(os.getenv('BLACKLIST_RELOAD_INTERVAL', '30'))  # Проверка внешних изменений файла (секунды)
     
     # Система уровней
     LEVELS_ENABLED = os.getenv('LEVELS_ENABLED', 'true').lower() == 'true'
@@ -77,6 +131,15 @@ class Config:
     LEVELS_COOLDOWN_SECONDS = int(os.getenv('LEVELS_COOLDOWN_SECONDS', '60'))
     LEVELS_DAILY_BONUS = int(os.getenv('LEVELS_DAILY_BONUS', '20'))
     LEVELS_FIRST_MESSAGE_BONUS = int(os.getenv('LEVELS_FIRST_MESSAGE_BONUS', '10'))
+    LEVELS_FLUSH_INTERVAL = int(os.getenv('LEVELS_FLUSH_INTERVAL', '30'))  # Период записи уровней на диск (секунды)
+    LEVELS_FLUSH_THRESHOLD = int(os.getenv('LEVELS_FLUSH_THRESHOLD', '500'))  # Досрочная запись после N изменений
+    LEVELS_CURVE = os.getenv('LEVELS_CURVE', 'quadratic').lower()  # Кривая уровней: quadratic, linear, exponential
+    LEVELS_CURVE_BASE = int(os.getenv('LEVELS_CURVE_BASE', '100'))  # Множитель кривой (XP для первого уровня)
+    LEVELS_MAX_LEVEL = int(os.getenv('LEVELS_MAX_LEVEL', '1000'))  # Размер таблицы порогов; уровни выше считаются по формуле кривой
+    LEVELS_HOT_DAYS = int(os.getenv('LEVELS_HOT_DAYS', '30'))  # В памяти только писавшие за N дней (0 - все; только SQLite)
+    LEVELS_PAGE_OUT_INTERVAL = int(os.getenv('LEVELS_PAGE_OUT_INTERVAL', '3600'))  # Период выгрузки неактивных (секунды)
+    LEADERBOARD_PAGE_SIZE = int(os.getenv('LEADERBOARD_PAGE_SIZE', '10'))  # Записей на странице /топ
+    LEADERBOARD_API_MAX_LIMIT = int(os.getenv('LEADERBOARD_API_MAX_LIMIT', '100'))  # Максимум записей за запрос /api/leaderboard
     
     @classmethod
     def validate(cls):
@@ -89,9 +152,57 @@ class Config:
         if cls.MAX_FILE_SIZE <= 0:
             errors.append("MAX_FILE_SIZE должен быть положительным числом")
         
+        if cls.MAX_FILE_SIZE > cls.MAX_UPLOAD_SIZE:
+            errors.append("MAX_FILE_SIZE не может превышать MAX_UPLOAD_SIZE: такой файл Discord не примет")
+        
+        if not 1 <= cls.RELAY_MAX_FILES_PER_MESSAGE <= 10:
+            errors.append("RELAY_MAX_FILES_PER_MESSAGE должен быть от 1 до 10")
+        
         if cls.MAX_MESSAGE_LENGTH <= 0:
             errors.append("MAX_MESSAGE_LENGTH должен быть положительным числом")
         
+        if cls.RELAY_MAX_CONCURRENCY <= 0 or cls.RELAY_NETWORK_CONCURRENCY <= 0:
+            errors.append("RELAY_MAX_CONCURRENCY и RELAY_NETWORK_CONCURRENCY должны быть положительными числами")
+        
+        if cls.RELAY_WORKERS <= 0 or cls.RELAY_QUEUE_SIZE <= 0:
+            errors.append("RELAY_WORKERS и RELAY_QUEUE_SIZE должны быть положительными числами")
+        
+        if cls.JOURNAL_ENABLED and cls.JOURNAL_LEASE_SECONDS <= 0:
+            errors.append("JOURNAL_LEASE_SECONDS должен быть положительным числом")
+        
+        if cls.THROUGHPUT_SAVE_INTERVAL <= 0:
+            errors.append("THROUGHPUT_SAVE_INTERVAL должен быть положительным числом")
+        
+        if cls.STATS_PUBLISH_INTERVAL <= 0:
+            errors.append("STATS_PUBLISH_INTERVAL должен быть положительным числом")
+        
+        if cls.LOG_MAX_BYTES <= 0 or cls.LOG_BACKUP_COUNT < 0:
+            errors.append("LOG_MAX_BYTES должен быть положительным, LOG_BACKUP_COUNT - неотрицательным числом")
+        
+        if not 0 <= cls.LOG_MESSAGE_SAMPLE_RATE <= 1:
+            errors.append("LOG_MESSAGE_SAMPLE_RATE должен быть от 0 до 1")
+        
+        if cls.LEVELS_CURVE not in ('quadratic', 'linear', 'exponential'):
+            errors.append("LEVELS_CURVE должен быть 'quadratic', 'linear' или 'exponential'")
+        
+        if cls.LEVELS_CURVE_BASE <= 0 or cls.LEVELS_MAX_LEVEL <= 0:
+            errors.append("LEVELS_CURVE_BASE и LEVELS_MAX_LEVEL должны быть положительными числами")
+        
+        if cls.LEVELS_HOT_DAYS < 0 or cls.LEVELS_PAGE_OUT_INTERVAL <= 0:
+            errors.append("LEVELS_HOT_DAYS должен быть неотрицательным, LEVELS_PAGE_OUT_INTERVAL - положительным числом")
+        
+        if not 1 <= cls.LEADERBOARD_PAGE_SIZE <= 25:
+            errors.append("LEADERBOARD_PAGE_SIZE должен быть от 1 до 25")
+        
+        if cls.LEADERBOARD_API_MAX_LIMIT <= 0:
+            errors.append("LEADERBOARD_API_MAX_LIMIT должен быть положительным числом")
+        
+        if not 0 < cls.API_PORT < 65536:
+            errors.append("API_PORT должен быть от 1 до 65535")
+        
+        if cls.STORAGE_BACKEND not in ('json', 'sqlite'):
+            errors.append("STORAGE_BACKEND должен быть 'json' или 'sqlite'")
+        
         return errors
 
 # Проверяем конфигурацию при импорте
@@ -0,0 +1,116 @@
+import re
+
+# Названия правил (ключи вердиктов)
+RULE_MASS_MENTION = 'mass_mention'
+RULE_INVITE = 'invite'
+RULE_LINK = 'link'
+
+MASS_MENTION_KEYWORDS = ('@everyone', '@here')
+INVITE_KEYWORDS = ('discord.gg/', 'discordapp.com/invite/', 'discord.com/invite/')
+
+# Паттерн для поиска URL (http, https, ftp, www)
+URL_PATTERN = r'(?:(?:https?|ftp)://|www\.)(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+LINK_REPLACEMENT = '(ссылка удалена)'
+
+
+class KeywordMatcher:
+    """Поиск набора ключевых слов за один проход: слова объединяются в одно регулярное выражение
+
+    Проход по тексту выполняет движок re на C, а не цикл Python по символам.
+    """
+
+    def __init__(self, keywords):
+        # Длинные слова раньше коротких: из слов с общим началом найдётся самое длинное
+        self.keywords = sorted(set(keywords), key=len, reverse=True)
+        self.pattern = re.compile('|'.join(map(re.escape, self.keywords))) if self.keywords else None
+
+    def iter_matches(self, text):
+        """Возвращает пары (позиция конца, ключевое слово) для непересекающихся вхождений"""
+        # Обычно ключевых слов в тексте нет: проверка подстрок на C дешевле прохода выражения
+        if self.pattern is None or not any(keyword in text for keyword in self.keywords):
+            return
+        for match in self.pattern.finditer(text):
+            yield match.end() - 1, match.group()
+
+    def search(self, text):
+        """Возвращает первое найденное ключевое слово или None"""
+        match = self.pattern.search(text) if self.pattern is not None else None
+        return match.group() if match else None
+
+
+class FilterResult:
+    """Результат проверки сообщения: сработавшие правила и текст после замен"""
+
+    __slots__ = ('verdicts', 'content')
+
+    def __init__(self, verdicts, content):
+        self.verdicts = verdicts
+        self.content = content
+
+    def __contains__(self, rule):
+        return rule in self.verdicts
+
+    def matches(self, rule):
+        """Возвращает найденные фрагменты для правила (пустой список, если правило не сработало)"""
+        return self.verdicts.get(rule, [])
+
+
+class ContentFilter:
+    """Набор правил фильтрации, скомпилированный один раз
+
+    keyword_rules: {правило: (ключевые слова, ...)} - ищутся без учёта регистра одним выражением
+    pattern_rules: {правило: (регулярное выражение, замена или None)} - объединяются в одно выражение,
+    найденные фрагменты заменяются за тот же проход
+    """
+
+    def __init__(self, keyword_rules=None, pattern_rules=None):
+        self.keyword_rules = dict(keyword_rules or {})
+        self.pattern_rules = dict(pattern_rules or {})
+
+        self.keyword_index = {}
+        for rule, keywords in self.keyword_rules.items():
+            for keyword in keywords:
+                self.keyword_index.setdefault(keyword.lower(), []).append(rule)
+        self.matcher = KeywordMatcher(self.keyword_index)
+
+        # Каждое правило - именованная группа общего выражения
+        self.groups = [(f"rule{index}", rule, replacement) for index, (rule, (_, replacement)) in enumerate(self.pattern_rules.items())]
+        self.pattern = re.compile('|'.join(
+            f"(?P<{group}>{pattern})"
+            for (group, _, _), (pattern, _) in zip(self.groups, self.pattern_rules.values())
+        )) if self.groups else None
+
+    def scan(self, text):
+        """Проверяет текст всеми правилами и возвращает вердикты вместе с изменённым текстом"""
+        verdicts = {}
+        if not text:
+            return FilterResult(verdicts, text)
+
+        for _, keyword in self.matcher.iter_matches(text.lower()):
+            for rule in self.keyword_index[keyword]:
+                verdicts.setdefault(rule, []).append(keyword)
+
+        if self.pattern is None:
+            return FilterResult(verdicts, text)
+
+        def replace(match):
+            for group, rule, replacement in self.groups:
+                if match.group(group) is not None:
+                    verdicts.setdefault(rule, []).append(match.group(group))
+                    return match.group(0) if replacement is None else replacement
+            return match.group(0)
+
+        return FilterResult(verdicts, self.pattern.sub(replace, text))
+
+
+def create_content_filter():
+    """Создаёт фильтр со стандартными правилами: массовые упоминания, инвайты и ссылки"""
+    return ContentFilter(
+        keyword_rules={
+            RULE_MASS_MENTION: MASS_MENTION_KEYWORDS,
+            RULE_INVITE: INVITE_KEYWORDS
+        },
+        pattern_rules={
+            RULE_LINK: (URL_PATTERN, LINK_REPLACEMENT)
+        }
+    )
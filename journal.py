@@ -0,0 +1,140 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from config import Config
+from storage import BaseStorage
+
+
+class DeliveryJournal(BaseStorage):
+    """Журнал доставок в SQLite: пересылки, которые ещё не дошли до целевых каналов"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id TEXT PRIMARY KEY,
+            envelope TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deliveries (
+            message_id TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sent_batches INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            PRIMARY KEY (message_id, channel_id)
+        );
+        CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (next_attempt_at);
+    """
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or Config.JOURNAL_FILE
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def record(self, message_id, envelope, channel_ids):
+        """Записывает сообщение и его доставки; повторная запись той же пары (сообщение, канал) игнорируется"""
+        # Доставки в работе не выдаются обработчику повторов, пока не истечёт аренда
+        leased_until = time.time() + Config.JOURNAL_LEASE_SECONDS
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO messages (message_id, envelope, created_at) VALUES (?, ?, ?)",
+                (str(message_id), json.dumps(envelope, ensure_ascii=False), time.time())
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO deliveries (message_id, channel_id, next_attempt_at) VALUES (?, ?, ?)",
+                [(str(message_id), str(channel_id), leased_until) for channel_id in channel_ids]
+            )
+
+    def complete(self, message_id, channel_id):
+        """Отмечает доставку завершённой и удаляет сообщение, когда все его доставки завершены"""
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM deliveries WHERE message_id = ? AND channel_id = ?",
+                (str(message_id), str(channel_id))
+            )
+            self.connection.execute(
+                "DELETE FROM messages WHERE message_id = ? AND NOT EXISTS (SELECT 1 FROM deliveries WHERE message_id = ?)",
+                (str(message_id), str(message_id))
+            )
+
+    def mark_sent(self, message_id, channel_id, sent_batches):
+        """Сохраняет число доставленных частей и продлевает аренду; возвращает False, если доставки нет в журнале"""
+        with self._lock, self.connection:
+            return self.connection.execute(
+                "UPDATE deliveries SET sent_batches = ?, next_attempt_at = ? WHERE message_id = ? AND channel_id = ?",
+                (sent_batches, time.time() + Config.JOURNAL_LEASE_SECONDS, str(message_id), str(channel_id))
+            ).rowcount > 0
+
+    def renew_lease(self, message_id, channel_id):
+        """Продлевает аренду доставки, которая ещё выполняется"""
+        with self._lock, self.connection:
+            return self.connection.execute(
+                "UPDATE deliveries SET next_attempt_at = ? WHERE message_id = ? AND channel_id = ?",
+                (time.time() + Config.JOURNAL_LEASE_SECONDS, str(message_id), str(channel_id))
+            ).rowcount > 0
+
+    def schedule_retry(self, message_id, channel_id, sent_batches, error):
+        """Планирует повтор с экспоненциальной задержкой и джиттером
+
+        Возвращает False, если попытки исчерпаны или доставки нет в журнале (повтор не состоится).
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT attempts FROM deliveries WHERE message_id = ? AND channel_id = ?",
+                (str(message_id), str(channel_id))
+            ).fetchone()
+        if row is None:
+            return False
+        attempts = row[0] + 1
+        if attempts >= Config.JOURNAL_MAX_ATTEMPTS:
+            self.complete(message_id, channel_id)
+            return False
+
+        delay = min(Config.JOURNAL_RETRY_MAX_DELAY, Config.JOURNAL_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        next_attempt_at = time.time() + delay * random.uniform(0.5, 1.0)
+        with self._lock, self.connection:
+            return self.connection.execute(
+                """UPDATE deliveries SET attempts = ?, sent_batches = ?, next_attempt_at = ?, last_error = ?
+                   WHERE message_id = ? AND channel_id = ?""",
+                (attempts, sent_batches, next_attempt_at, str(error)[:500], str(message_id), str(channel_id))
+            ).rowcount > 0
+
+    def lease_due(self, limit):
+        """Выдаёт доставки, время повтора которых наступило, и продлевает их аренду"""
+        now = time.time()
+        with self._lock, self.connection:
+            rows = self.connection.execute(
+                """SELECT d.message_id, d.channel_id, d.sent_batches, m.envelope
+                   FROM deliveries d JOIN messages m ON m.message_id = d.message_id
+                   WHERE d.next_attempt_at <= ? ORDER BY d.next_attempt_at LIMIT ?""",
+                (now, limit)
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE deliveries SET next_attempt_at = ? WHERE message_id = ? AND channel_id = ?",
+                [(now + Config.JOURNAL_LEASE_SECONDS, message_id, channel_id) for message_id, channel_id, _, _ in rows]
+            )
+        return [
+            (message_id, channel_id, sent_batches, json.loads(envelope))
+            for message_id, channel_id, sent_batches, envelope in rows
+        ]
+
+    def release_all(self):
+        """Делает все незавершённые доставки доступными сразу (после перезапуска аренды недействительны)"""
+        with self._lock, self.connection:
+            return self.connection.execute("UPDATE deliveries SET next_attempt_at = ?", (time.time(),)).rowcount
+
+    def pending_count(self):
+        """Возвращает число незавершённых доставок"""
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self.connection.close()
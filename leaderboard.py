@@ -0,0 +1,322 @@
+import heapq
+import random
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+
+MAX_LEVELS = 32  # Достаточно для ~4 млрд записей при вероятности повышения уровня 1/2
+
+# Удалённые из ColdRanking записи помечаются и вычищаются из массивов разом, когда их
+# становится больше COLD_COMPACT_MIN и 1/COLD_COMPACT_RATIO всех записей
+COLD_COMPACT_MIN = 1024
+COLD_COMPACT_RATIO = 64
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        # width[i] - сколько записей перескакивает ссылка next[i]
+        self.width = [1] * levels
+
+
+class IndexedSkipList:
+    """Упорядоченный список с позиционным доступом: вставка, удаление, позиция ключа и выборка по номеру за O(log n)"""
+
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVELS)
+        self.levels = 1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _random_levels():
+        levels = 1
+        while levels < MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def _find(self, key):
+        """Возвращает предшественников ключа на каждом уровне и их позиции"""
+        chain = [None] * MAX_LEVELS
+        positions = [0] * MAX_LEVELS
+        node = self.head
+        position = 0
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._find(key)
+        levels = self._random_levels()
+        if levels > self.levels:
+            for level in range(self.levels, levels):
+                chain[level] = self.head
+                positions[level] = 0
+                self.head.width[level] = self.size + 1
+            self.levels = levels
+
+        node = _Node(key, levels)
+        position = positions[0] + 1  # Позиция нового узла (с единицы)
+        for level in range(levels):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            # Ссылка предшественника делится на две части вокруг нового узла
+            skipped = position - positions[level]
+            node.width[level] = previous.width[level] - skipped + 1
+            previous.width[level] = skipped
+        for level in range(levels, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(self.levels):
+            previous = chain[level]
+            if previous.next[level] is node:
+                previous.width[level] += node.width[level] - 1
+                previous.next[level] = node.next[level]
+            else:
+                previous.width[level] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        """Позиция ключа с нуля или None, если ключа нет"""
+        chain, positions = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            return None
+        return positions[0]
+
+    def count_less(self, key):
+        """Число ключей меньше заданного (ключ может отсутствовать)"""
+        return self._find(key)[1][0]
+
+    def slice(self, start, count):
+        """Возвращает до count ключей начиная с позиции start"""
+        if start < 0 or start >= self.size or count <= 0:
+            return []
+        node = self.head
+        remaining = start + 1
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        result = []
+        while node is not None and len(result) < count:
+            result.append(node.key)
+            node = node.next[0]
+        return result
+
+
+class ColdRanking:
+    """Рейтинг неактивных пользователей в отсортированных массивах: 32 байта на пользователя
+
+    Записи упорядочены дважды: по ключу рейтинга (-xp, user_id) для мест и страниц
+    и по ID для поиска пользователя. Изменения - только перенос пользователей в активные и обратно.
+    Удаление не сдвигает массивы: запись помечается, а места и страницы пропускают помеченные
+    позиции, пока пометок не накопится достаточно для одного прохода сжатия.
+    """
+
+    def __init__(self):
+        self.rank_keys = array('q')  # -xp в порядке рейтинга
+        self.rank_ids = array('Q')
+        self.ids = array('Q')        # ID по возрастанию
+        self.xp = array('q')         # XP в порядке ids
+        self.removed = set()         # ID удалённых, но ещё не вычищенных записей
+        self.removed_positions = []  # Их позиции в порядке рейтинга, по возрастанию
+
+    def __len__(self):
+        return len(self.ids) - len(self.removed)
+
+    def load(self, rank_ids, rank_xp):
+        """Загружает записи, уже упорядоченные по рейтингу (XP по убыванию, затем ID)"""
+        self.rank_ids = array('Q', rank_ids)
+        self.rank_keys = array('q', (-xp for xp in rank_xp))
+        order = sorted(range(len(self.rank_ids)), key=self.rank_ids.__getitem__)
+        self.ids = array('Q', (self.rank_ids[position] for position in order))
+        self.xp = array('q', (-self.rank_keys[position] for position in order))
+        self.removed = set()
+        self.removed_positions = []
+
+    def get(self, user_id):
+        """XP пользователя или None, если его нет среди неактивных"""
+        if user_id in self.removed:
+            return None
+        position = bisect_left(self.ids, user_id)
+        if position < len(self.ids) and self.ids[position] == user_id:
+            return self.xp[position]
+        return None
+
+    def _position(self, key):
+        """Позиция ключа в массивах рейтинга, включая помеченные записи"""
+        negative_xp, user_id = key
+        low = bisect_left(self.rank_keys, negative_xp)
+        high = bisect_right(self.rank_keys, negative_xp, low)
+        return bisect_left(self.rank_ids, user_id, low, high)
+
+    def count_less(self, key):
+        """Число записей с ключом рейтинга меньше заданного"""
+        position = self._position(key)
+        return position - bisect_left(self.removed_positions, position)
+
+    def key_at(self, position):
+        """Ключ записи на месте position среди оставшихся (бинарный поиск мимо помеченных позиций)"""
+        low, high = position, position + len(self.removed_positions)
+        # Наименьшая позиция в массиве, до которой включительно оставшихся записей position + 1
+        while low < high:
+            middle = (low + high) // 2
+            if middle + 1 - bisect_right(self.removed_positions, middle) > position:
+                high = middle
+            else:
+                low = middle + 1
+        return (self.rank_keys[low], self.rank_ids[low])
+
+    def remove(self, user_id):
+        """Удаляет пользователя и возвращает его XP (None, если его нет)"""
+        xp = self.get(user_id)
+        if xp is None:
+            return None
+        self.removed.add(user_id)
+        insort(self.removed_positions, self._position((-xp, user_id)))
+        if len(self.removed) > max(COLD_COMPACT_MIN, len(self.ids) // COLD_COMPACT_RATIO):
+            self.merge([])
+        return xp
+
+    def merge(self, entries):
+        """Добавляет пачку записей [(user_id, xp)] одним проходом слиянием, заодно вычищая удалённые"""
+        if not entries and not self.removed:
+            return
+        removed = self.removed
+        rank_keys, rank_ids = array('q'), array('Q')
+        for negative_xp, user_id in heapq.merge(
+            ((negative_xp, user_id) for negative_xp, user_id in zip(self.rank_keys, self.rank_ids) if user_id not in removed),
+            sorted((-xp, user_id) for user_id, xp in entries)
+        ):
+            rank_keys.append(negative_xp)
+            rank_ids.append(user_id)
+        ids, xp_values = array('Q'), array('q')
+        for user_id, xp in heapq.merge(
+            ((user_id, xp) for user_id, xp in zip(self.ids, self.xp) if user_id not in removed),
+            sorted(entries)
+        ):
+            ids.append(user_id)
+            xp_values.append(xp)
+        self.rank_keys, self.rank_ids, self.ids, self.xp = rank_keys, rank_ids, ids, xp_values
+        self.removed = set()
+        self.removed_positions = []
+
+
+class Leaderboard:
+    """Рейтинг пользователей по XP: место пользователя и страницы топа за O(log n)
+
+    Активные пользователи - в skip list, который обновляется при каждом начислении XP;
+    выгруженные из памяти - в компактном ColdRanking. Места считаются по обеим частям сразу.
+    """
+
+    def __init__(self):
+        self.scores = {}  # {user_id: xp} активных пользователей
+        self.index = IndexedSkipList()
+        self.cold = ColdRanking()
+
+    def __len__(self):
+        return len(self.scores) + len(self.cold)
+
+    @staticmethod
+    def _key(user_id, xp):
+        # Больше XP - выше место; при равенстве порядок по ID стабилен
+        return (-xp, user_id)
+
+    def update(self, user_id, xp):
+        """Добавляет пользователя или обновляет его XP (неактивный пользователь становится активным)"""
+        user_id = int(user_id)
+        current = self.scores.get(user_id)
+        if current == xp:
+            return
+        if current is not None:
+            self.index.remove(self._key(user_id, current))
+        elif self.cold:
+            self.cold.remove(user_id)
+        self.scores[user_id] = xp
+        self.index.insert(self._key(user_id, xp))
+
+    def remove(self, user_id):
+        user_id = int(user_id)
+        xp = self.scores.pop(user_id, None)
+        if xp is not None:
+            self.index.remove(self._key(user_id, xp))
+        else:
+            self.cold.remove(user_id)
+
+    def rebuild(self, scores):
+        """Строит рейтинг заново из {user_id: xp}"""
+        self.scores = {}
+        self.index = IndexedSkipList()
+        self.cold = ColdRanking()
+        for user_id, xp in scores.items():
+            self.update(user_id, xp)
+
+    def page_out(self, user_ids):
+        """Переносит пользователей в неактивную часть рейтинга (места не меняются)"""
+        entries = []
+        for user_id in user_ids:
+            user_id = int(user_id)
+            xp = self.scores.pop(user_id, None)
+            if xp is not None:
+                self.index.remove(self._key(user_id, xp))
+                entries.append((user_id, xp))
+        self.cold.merge(entries)
+
+    def is_cold(self, user_id):
+        return self.cold.get(int(user_id)) is not None
+
+    def xp(self, user_id):
+        """XP пользователя по рейтингу или None"""
+        user_id = int(user_id)
+        xp = self.scores.get(user_id)
+        return self.cold.get(user_id) if xp is None else xp
+
+    def rank(self, user_id):
+        """Место пользователя (с единицы) или None, если его нет в рейтинге"""
+        xp = self.xp(user_id)
+        if xp is None:
+            return None
+        key = self._key(int(user_id), xp)
+        return self.index.count_less(key) + self.cold.count_less(key) + 1
+
+    def _cold_before(self, offset):
+        """Сколько из первых offset мест занимают неактивные пользователи (бинарный поиск по разбиению)"""
+        low = max(0, offset - len(self.index))
+        high = min(offset, len(self.cold))
+        while low < high:
+            taken = (low + high) // 2
+            # Ключ неактивного меньше последнего взятого активного - неактивных нужно больше
+            if self.cold.key_at(taken) < self.index.slice(offset - taken - 1, 1)[0]:
+                low = taken + 1
+            else:
+                high = taken
+        return low
+
+    def page(self, offset, limit):
+        """Возвращает [(место, user_id, xp)] начиная с позиции offset (с нуля)"""
+        if offset < 0 or limit <= 0:
+            return []
+        cold_start = self._cold_before(offset)
+        hot = self.index.slice(offset - cold_start, limit)
+        cold = (self.cold.key_at(position) for position in range(cold_start, min(cold_start + limit, len(self.cold))))
+        return [
+            (offset + number + 1, user_id, -negative_xp)
+            for number, (negative_xp, user_id) in enumerate(islice(heapq.merge(hot, cold), limit))
+        ]
@@ -0,0 +1,312 @@
+import math
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_right
+from config import Config
+from storage import LEVEL_FIELDS, create_storage
+
+# Наибольший порог, который помещается в таблицу (знаковое 64-битное число)
+MAX_XP = 2 ** 63 - 1
+
+# Кривые уровней: XP, необходимый для достижения уровня level (base - LEVELS_CURVE_BASE)
+LEVEL_CURVES = {
+    'quadratic': lambda level, base: base * level * level,  # level = floor(sqrt(xp / base))
+    'linear': lambda level, base: base * level,
+    'exponential': lambda level, base: int(base * 10 * (1.1 ** level - 1))  # Каждый уровень на 10% дороже
+}
+
+
+class LevelCurve:
+    """Кривая уровней: пороги XP считаются один раз, уровень ищется бинарным поиском по таблице
+
+    Таблица покрывает уровни до max_level; уровни выше ищутся бинарным поиском по самой функции,
+    поэтому уровень не упирается в размер таблицы.
+    """
+
+    def __init__(self, xp_for_level, max_level):
+        self.function = xp_for_level
+        self.thresholds = array('q')
+        for level in range(max_level + 1):
+            xp = int(xp_for_level(level))
+            if xp > MAX_XP:
+                # Дальше пороги не помещаются - это и есть максимальный уровень
+                break
+            if self.thresholds and xp <= self.thresholds[-1]:
+                raise ValueError(f"Кривая уровней должна строго возрастать (уровень {level})")
+            self.thresholds.append(xp)
+        if not self.thresholds or self.thresholds[0] != 0:
+            raise ValueError("Уровень 0 должен требовать 0 XP")
+
+    @property
+    def max_level(self):
+        return len(self.thresholds) - 1
+
+    def level(self, xp):
+        """Уровень для заданного XP"""
+        level = bisect_right(self.thresholds, xp) - 1
+        if level < self.max_level:
+            return max(0, level)
+        return self._level_beyond_table(xp)
+
+    def _level_beyond_table(self, xp):
+        """Наибольший уровень, порог которого не превышает xp, для XP за пределами таблицы"""
+        low = self.max_level  # Порог low достигнут
+        high = max(1, low) * 2
+        while self.function(high) <= xp:
+            low, high = high, high * 2
+        # Порог high не достигнут - ищем границу между low и high
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.function(middle) <= xp:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def xp_for_level(self, level):
+        """XP, необходимый для достижения уровня"""
+        if level < len(self.thresholds):
+            return self.thresholds[level]
+        return min(int(self.function(level)), MAX_XP)
+
+
+def create_level_curve(name=None, base=None, max_level=None):
+    """Создаёт кривую уровней согласно Config.LEVELS_CURVE"""
+    function = LEVEL_CURVES[name or Config.LEVELS_CURVE]
+    base = Config.LEVELS_CURVE_BASE if base is None else base
+    return LevelCurve(lambda level: function(level, base), Config.LEVELS_MAX_LEVEL if max_level is None else max_level)
+
+
+class LevelStore:
+    """Компактное хранилище уровней в памяти
+
+    Запись пользователя - строка в параллельных типизированных массивах, индекс строки
+    ищется по целочисленному ID. Вместо словаря на пользователя - несколько десятков байт.
+    """
+
+    def __init__(self):
+        self.rows = {}  # {user_id (int): номер строки}
+        self.user_ids = array('Q')
+        self.xp = array('q')
+        self.level = array('i')
+        self.messages = array('q')
+        # Время последнего сообщения; NaN - сообщений не было
+        self.last_message = array('d')
+        # Ежедневный бонус получают немногие - храним отдельно: {номер строки: значение}
+        self.daily_bonus_claimed = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self.rows
+
+    def row(self, user_id, create=False):
+        """Номер строки пользователя; при create=True создаёт пустую запись, иначе None, если записи нет"""
+        user_id = int(user_id)
+        row = self.rows.get(user_id)
+        if row is None and create:
+            row = self.rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.xp.append(0)
+            self.level.append(0)
+            self.messages.append(0)
+            self.last_message.append(math.nan)
+        return row
+
+    def get(self, user_id):
+        """Запись пользователя в формате хранилища или None"""
+        row = self.rows.get(int(user_id))
+        return None if row is None else self._record(row)
+
+    def set(self, user_id, data):
+        """Записывает данные пользователя из формата хранилища"""
+        row = self.row(user_id, create=True)
+        self.xp[row] = int(data.get('xp') or 0)
+        self.level[row] = int(data.get('level') or 0)
+        self.messages[row] = int(data.get('messages') or 0)
+        last_message = data.get('last_message')
+        self.last_message[row] = math.nan if last_message is None else float(last_message)
+        if data.get('daily_bonus_claimed') is not None:
+            self.daily_bonus_claimed[row] = data['daily_bonus_claimed']
+        else:
+            self.daily_bonus_claimed.pop(row, None)
+
+    def remove(self, user_id):
+        """Удаляет запись; на её место переносится последняя строка"""
+        row = self.rows.pop(int(user_id), None)
+        if row is None:
+            return
+        last = len(self.user_ids) - 1
+        bonus = self.daily_bonus_claimed.pop(last, None)
+        self.daily_bonus_claimed.pop(row, None)
+        if row != last:
+            moved_id = self.user_ids[last]
+            self.user_ids[row] = moved_id
+            self.xp[row] = self.xp[last]
+            self.level[row] = self.level[last]
+            self.messages[row] = self.messages[last]
+            self.last_message[row] = self.last_message[last]
+            if bonus is not None:
+                self.daily_bonus_claimed[row] = bonus
+            self.rows[moved_id] = row
+        for column in (self.user_ids, self.xp, self.level, self.messages, self.last_message):
+            column.pop()
+
+    def inactive(self, before):
+        """ID пользователей без сообщений с момента before"""
+        # NaN (сообщений не было) не проходит сравнение и тоже считается неактивным
+        return [self.user_ids[row] for row in range(len(self.user_ids)) if not self.last_message[row] >= before]
+
+    def _record(self, row):
+        last_message = self.last_message[row]
+        return dict(zip(LEVEL_FIELDS, (
+            self.xp[row],
+            self.level[row],
+            self.messages[row],
+            None if math.isnan(last_message) else last_message,
+            self.daily_bonus_claimed.get(row)
+        )))
+
+    def items(self):
+        """Пары (ID строкой, запись) для сохранения"""
+        for user_id, row in self.rows.items():
+            yield str(user_id), self._record(row)
+
+    def xp_items(self):
+        """Пары (ID строкой, XP) без сборки полных записей"""
+        for user_id, row in self.rows.items():
+            yield str(user_id), self.xp[row]
+
+    @classmethod
+    def from_dict(cls, levels):
+        """Строит хранилище из {user_id: запись}"""
+        store = cls()
+        for user_id, data in levels.items():
+            store.set(user_id, data)
+        return store
+
+
+def recompute_levels(curve, storage, apply=False):
+    """Пересчитывает сохранённые уровни по кривой (векторно, NumPy) и возвращает отчёт об изменениях
+
+    При apply=True изменённые уровни записываются в хранилище. Бот при этом должен быть остановлен,
+    иначе он перезапишет данные своей копией из памяти.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("Для пересчёта уровней нужен NumPy: pip install numpy")
+
+    user_ids, xp_column, level_column = storage.load_level_columns()
+    # Массивы array('q') передаются в NumPy без копирования
+    xp = np.frombuffer(xp_column, dtype=np.int64) if len(xp_column) else np.zeros(0, dtype=np.int64)
+    old_levels = np.frombuffer(level_column, dtype=np.int64) if len(level_column) else np.zeros(0, dtype=np.int64)
+    thresholds = np.frombuffer(curve.thresholds, dtype=np.int64)
+
+    new_levels = np.maximum(np.searchsorted(thresholds, xp, side='right') - 1, 0)
+    # XP выше таблицы порогов (редкость) - уровень считается по самой кривой
+    beyond = np.flatnonzero(xp >= thresholds[-1])
+    if len(beyond):
+        new_levels[beyond] = [curve.level(int(value)) for value in xp[beyond].tolist()]
+    deltas = new_levels - old_levels
+    changed = np.flatnonzero(deltas)
+    values, counts = np.unique(deltas[changed], return_counts=True)
+
+    report = {
+        'users': len(user_ids),
+        'changed': len(changed),
+        'level_ups': int(np.count_nonzero(deltas > 0)),
+        'level_downs': int(np.count_nonzero(deltas < 0)),
+        'max_up': max(int(deltas.max()), 0) if len(changed) else 0,
+        'max_down': max(int(-deltas.min()), 0) if len(changed) else 0,
+        'deltas': {int(value): int(count) for value, count in zip(values, counts)}
+    }
+    if apply and len(changed):
+        storage.update_level_values([(user_ids[index], int(new_levels[index])) for index in changed.tolist()])
+    return report
+
+
+def generate_levels(count, seed=0):
+    """Синтетические записи для замера: ID-снежинки, XP и время последнего сообщения"""
+    rng = random.Random(seed)
+    now = time.time()
+    for index in range(count):
+        user_id = str(100000000000000000 + index * 7919)
+        xp = rng.randrange(0, 50000)
+        yield user_id, {
+            'xp': xp,
+            'level': int((xp / 100) ** 0.5),
+            'messages': rng.randrange(1, 5000),
+            'last_message': now - rng.uniform(0, 365 * 86400),
+            'daily_bonus_claimed': None
+        }
+
+
+def measure(build):
+    """Возвращает объём памяти, занятый результатом build() (по tracemalloc)"""
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def benchmark(count):
+    """Сравнивает память словаря словарей и LevelStore на count пользователях"""
+    def build_dicts():
+        return {user_id: data for user_id, data in generate_levels(count)}
+
+    def build_store():
+        store = LevelStore()
+        for user_id, data in generate_levels(count):
+            store.set(user_id, data)
+        return store
+
+    return {'dict': measure(build_dicts), 'store': measure(build_store)}
+
+
+def print_recompute_report(report, elapsed, applied):
+    print(f"Пользователей: {report['users']}, уровень изменился у {report['changed']} "
+          f"(повышений: {report['level_ups']}, понижений: {report['level_downs']}) за {elapsed:.2f} с")
+    if report['changed']:
+        print(f"Наибольшее повышение: {report['max_up']}, наибольшее понижение: {report['max_down']}")
+        print("Изменение уровня -> пользователей:")
+        for delta, count in sorted(report['deltas'].items()):
+            print(f"  {delta:+d}: {count}")
+    if report['changed'] and not applied:
+        print("Изменения не записаны; запустите с --apply при остановленном боте")
+
+
+if __name__ == "__main__":
+    # Замер памяти: python levels.py benchmark [число пользователей]
+    # Пересчёт уровней по текущей кривой: python levels.py recompute [--apply]
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'benchmark':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+        sizes = benchmark(count)
+        for name, title in (('dict', 'Словарь словарей'), ('store', 'LevelStore')):
+            print(f"{title}: {sizes[name] / 1024 / 1024:.1f} МБ, {sizes[name] / count:.0f} байт на пользователя")
+        print(f"Экономия: в {sizes['dict'] / sizes['store']:.1f} раза")
+    elif command == 'recompute' and sys.argv[2:] in ([], ['--apply']):
+        apply = sys.argv[2:] == ['--apply']
+        storage = create_storage()
+        try:
+            started = time.perf_counter()
+            report = recompute_levels(create_level_curve(), storage, apply=apply)
+            print_recompute_report(report, time.perf_counter() - started, apply)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        finally:
+            storage.close()
+    else:
+        print("Использование: python levels.py benchmark [число пользователей]")
+        print("               python levels.py recompute [--apply]")
+        sys.exit(1)
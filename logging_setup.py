@@ -0,0 +1,83 @@
+import atexit
+import gzip
+import logging
+import os
+import queue
+import random
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import Config
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Логгер построчных записей о каждом сообщении: пишется только выборка (LOG_MESSAGE_SAMPLE_RATE)
+MESSAGE_LOGGER_NAME = 'DiscordBot.messages'
+
+
+class LocalQueueHandler(QueueHandler):
+    """Передаёт записи в очередь без форматирования: время, формат и запись - в потоке обработчика"""
+
+    def prepare(self, record):
+        # Аргументы подставляются сразу, пока объекты не изменились; остальное делает поток обработчика
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает случайную долю записей rate (от 0 до 1)"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def gzip_namer(name):
+    return f"{name}.gz"
+
+
+def gzip_rotator(source, dest):
+    """Сжимает файл лога при ротации (выполняется в потоке обработчика)"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def setup_logging():
+    """Настраивает логирование через очередь: запись в файл и консоль выполняет отдельный поток"""
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = RotatingFileHandler(
+        Config.LOG_FILE,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding='utf-8',
+        delay=True
+    )
+    if Config.LOG_COMPRESS:
+        file_handler.namer = gzip_namer
+        file_handler.rotator = gzip_rotator
+
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    # Очередь без ограничения: вызывающий поток никогда не ждёт диска или консоли
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, Config.LOG_LEVEL))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LocalQueueHandler(log_queue))
+
+    logging.getLogger(MESSAGE_LOGGER_NAME).addFilter(SamplingFilter(Config.LOG_MESSAGE_SAMPLE_RATE))
+
+    listener.start()
+    # Остаток очереди дописывается при завершении процесса
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,307 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+import aiohttp
+import discord
+from config import Config
+from metrics import registry
+
+logger = logging.getLogger('DiscordBot.outbound')
+
+# Классы приоритета: меньшее значение обслуживается раньше
+PRIORITY_MODERATION = 0
+PRIORITY_RELAY = 1
+PRIORITY_NOTIFICATION = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_MODERATION: 'moderation',
+    PRIORITY_RELAY: 'relay',
+    PRIORITY_NOTIFICATION: 'notification'
+}
+
+# Лимиты по умолчанию: (запросов, за секунд) для одного webhook'а / канала
+# Действуют до первого ответа Discord, дальше корзину настраивают заголовки X-RateLimit-*
+WEBHOOK_RATE_LIMIT = (5, 2)
+CHANNEL_RATE_LIMIT = (5, 5)
+
+# Пути запросов, лимиты которых отслеживает планировщик: /webhooks/<id>/<token> и /channels/<id>/messages
+RATE_LIMIT_PATH = re.compile(r'/(?:webhooks/(?P<webhook>\d+)/[^/]+|channels/(?P<channel>\d+)/messages)(?:[/?]|$)')
+
+# Метрики Prometheus
+REQUEST_LATENCY = registry.histogram(
+    'outbound_request_seconds', 'Время запроса к Discord по типу получателя и результату', ('kind', 'outcome')
+)
+RATE_LIMITED = registry.counter('outbound_rate_limited_total', 'Ответы 429 от Discord', ('kind',))
+RETRIES = registry.counter('outbound_retries_total', 'Повторы запросов после ответа 429', ('kind',))
+DROPPED = registry.counter('outbound_dropped_total', 'Запросы, отброшенные из-за переполнения очереди', ('priority',))
+
+
+class OutboundQueueFull(Exception):
+    """Очередь исходящих запросов переполнена, запрос отброшен"""
+
+
+def get_rate_limit_key(url):
+    """Ключ корзины ('webhook:<id>' или 'channel:<id>') для адреса запроса к Discord или None"""
+    match = RATE_LIMIT_PATH.search(str(url))
+    if match is None:
+        return None
+    if match.group('webhook'):
+        return f"webhook:{match.group('webhook')}"
+    return f"channel:{match.group('channel')}"
+
+
+class TokenBucket:
+    """Корзина токенов для одного webhook'а или канала"""
+
+    def __init__(self, requests, per_seconds):
+        self.capacity = requests
+        self.rate = requests / per_seconds
+        self.tokens = float(requests)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.outgoing = 0  # Запросы, токен для которых выдан, а ответ ещё не получен
+
+    def reserve(self):
+        """Резервирует токен и возвращает, сколько секунд нужно подождать перед запросом"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        self.outgoing += 1
+
+        delay = max(0.0, self.blocked_until - now)
+        if self.tokens < 0:
+            delay = max(delay, -self.tokens / self.rate)
+        return delay
+
+    def release(self):
+        """Отмечает, что ответ на запрос с выданным токеном получен"""
+        self.outgoing = max(0, self.outgoing - 1)
+
+    def update(self, limit, remaining, reset_after):
+        """Настраивает корзину по заголовкам ответа Discord
+
+        Окно Discord восстанавливает limit запросов через reset_after секунд; корзина получает
+        ту же ёмкость и темп, при котором она наполнится ровно к сбросу окна. Остаток берётся
+        у Discord за вычетом других запросов, которые уже отправлены, но ещё без ответа.
+        """
+        now = time.monotonic()
+        self.capacity = max(1, limit)
+        # Ответ на этот запрос уже получен, остальные отправленные ещё учтутся Discord
+        self.tokens = float(min(remaining, self.capacity) - max(0, self.outgoing - 1))
+        self.updated = now
+        if reset_after > 0:
+            self.rate = max(self.capacity - remaining, 1) / reset_after
+            if remaining <= 0:
+                self.blocked_until = max(self.blocked_until, now + reset_after)
+        else:
+            self.tokens = float(self.capacity - max(0, self.outgoing - 1))
+
+    def penalize(self, retry_after):
+        """Блокирует корзину после ответа 429 на указанное Discord время"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        # После окончания блокировки пропускаем один запрос, дальше - обычный темп корзины
+        self.tokens = min(self.tokens, 1.0)
+
+    def is_idle(self, now):
+        return not self.outgoing and now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class PrioritySemaphore:
+    """Семафор, выдающий освободившиеся слоты ожидающим в порядке приоритета"""
+
+    def __init__(self, value):
+        self.value = value
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority):
+        if self.value > 0 and not self._waiters:
+            self.value -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот мог быть выдан одновременно с отменой - возвращаем его
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.value += 1
+
+
+class OutboundScheduler:
+    """Планировщик исходящих запросов: лимиты по webhook'ам и каналам, приоритеты и ограниченные очереди"""
+
+    def __init__(self, max_concurrency=None, max_queue_size=None, max_retries=3):
+        self.max_queue_size = max_queue_size or Config.OUTBOUND_MAX_QUEUE
+        self.max_retries = max_retries
+        self.slots = PrioritySemaphore(max_concurrency or Config.OUTBOUND_MAX_CONCURRENCY)
+        self.buckets = {}
+        self.pending = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.stats = {
+            name: {'submitted': 0, 'completed': 0, 'failed': 0, 'dropped': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self.rate_limited = 0
+        self.retries = 0
+        self._last_prune = time.monotonic()
+
+    def _get_bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            limit = WEBHOOK_RATE_LIMIT if key.startswith('webhook:') else CHANNEL_RATE_LIMIT
+            bucket = TokenBucket(*limit)
+            self.buckets[key] = bucket
+        return bucket
+
+    def _prune_buckets(self):
+        # Раз в 10 минут удаляем корзины, которые давно не использовались и полностью восстановились
+        now = time.monotonic()
+        if now - self._last_prune < 600:
+            return
+        self._last_prune = now
+        for key in [key for key, bucket in self.buckets.items() if bucket.is_idle(now)]:
+            del self.buckets[key]
+
+    def observe_response(self, key, headers):
+        """Обновляет корзину ключа по заголовкам X-RateLimit-* ответа Discord"""
+        bucket = self.buckets.get(key)
+        if bucket is None or headers.get('X-RateLimit-Global'):
+            # Глобальный лимит не относится к корзине; неизвестные ключи не отслеживаются
+            return
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset_after = float(headers['X-RateLimit-Reset-After'])
+        except (KeyError, TypeError, ValueError):
+            return
+        bucket.update(limit, remaining, reset_after)
+
+    def create_trace_config(self):
+        """Трассировка aiohttp для клиента discord.py: заголовки лимитов каждого ответа попадают в корзины"""
+        async def on_request_end(session, context, params):
+            key = get_rate_limit_key(params.url)
+            if key is not None:
+                self.observe_response(key, params.response.headers)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    @staticmethod
+    def _get_retry_after(error):
+        """Извлекает время ожидания из ответа 429 (None, если это не ограничение скорости)"""
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after
+        if isinstance(error, discord.HTTPException) and error.status == 429:
+            headers = getattr(error.response, 'headers', None) or {}
+            for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+                try:
+                    return float(headers[header])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            return 1.0
+        return None
+
+    async def submit(self, key, request, priority=PRIORITY_RELAY):
+        """Выполняет запрос request() с учётом лимитов ключа key ('webhook:<id>' или 'channel:<id>')"""
+        stats = self.stats[PRIORITY_NAMES[priority]]
+        if self.pending[priority] >= self.max_queue_size:
+            stats['dropped'] += 1
+            DROPPED.inc(PRIORITY_NAMES[priority])
+            raise OutboundQueueFull(f"Очередь '{PRIORITY_NAMES[priority]}' переполнена ({self.max_queue_size})")
+
+        stats['submitted'] += 1
+        self.pending[priority] += 1
+        queued_at = time.monotonic()
+        bucket = self._get_bucket(key)
+        kind = key.split(':', 1)[0]
+        try:
+            for attempt in range(self.max_retries + 1):
+                delay = bucket.reserve()
+                try:
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    await self.slots.acquire(priority)
+                except BaseException:
+                    bucket.release()
+                    raise
+                try:
+                    if attempt == 0:
+                        wait = time.monotonic() - queued_at
+                        stats['wait_total'] += wait
+                        stats['wait_max'] = max(stats['wait_max'], wait)
+                    started = time.perf_counter()
+                    try:
+                        result = await request()
+                    except Exception as e:
+                        outcome = 'rate_limited' if self._get_retry_after(e) is not None else 'error'
+                        REQUEST_LATENCY.observe(time.perf_counter() - started, kind, outcome)
+                        raise
+                    REQUEST_LATENCY.observe(time.perf_counter() - started, kind, 'ok')
+                    stats['completed'] += 1
+                    return result
+                # RateLimited не наследует HTTPException, его нужно перехватывать отдельно
+                except (discord.HTTPException, discord.RateLimited) as e:
+                    retry_after = self._get_retry_after(e)
+                    if retry_after is not None:
+                        self.rate_limited += 1
+                        RATE_LIMITED.inc(kind)
+                    if retry_after is None or attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    RETRIES.inc(kind)
+                    bucket.penalize(retry_after)
+                    logger.warning("Ограничение скорости для %s: повтор через %.2f сек", key, retry_after)
+                finally:
+                    bucket.release()
+                    self.slots.release()
+        except Exception:
+            stats['failed'] += 1
+            raise
+        finally:
+            self.pending[priority] -= 1
+            self._prune_buckets()
+
+    async def send_webhook(self, webhook, priority=PRIORITY_RELAY, **kwargs):
+        """Отправляет сообщение через webhook"""
+        return await self.submit(f"webhook:{webhook.id}", lambda: webhook.send(**kwargs), priority)
+
+    async def send_channel(self, channel, *args, priority=PRIORITY_NOTIFICATION, **kwargs):
+        """Отправляет сообщение в канал или личные сообщения"""
+        return await self.submit(f"channel:{channel.id}", lambda: channel.send(*args, **kwargs), priority)
+
+    def get_stats(self):
+        """Возвращает метрики очередей: глубину, время ожидания и счётчики по классам приоритета"""
+        result = {
+            'pending': sum(self.pending.values()),
+            'rate_limited': self.rate_limited,
+            'retries': self.retries,
+            'buckets': len(self.buckets),
+            'classes': {}
+        }
+        for priority, name in PRIORITY_NAMES.items():
+            stats = self.stats[name]
+            result['classes'][name] = {
+                'queue_depth': self.pending[priority],
+                'submitted': stats['submitted'],
+                'completed': stats['completed'],
+                'failed': stats['failed'],
+                'dropped': stats['dropped'],
+                'wait_avg': stats['wait_total'] / stats['submitted'] if stats['submitted'] else 0.0,
+                'wait_max': stats['wait_max']
+            }
+        return result
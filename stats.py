@@ -0,0 +1,68 @@
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+
+# Опубликованный снимок: готовое тело ответа, его ETag и время последнего изменения данных
+PublishedStats = namedtuple('PublishedStats', ('body', 'etag', 'updated_at'))
+
+
+class StatsAggregate:
+    """Сводная статистика бота
+
+    Счётчики обновляются событиями Discord в цикле бота (без обхода всех серверов),
+    а API читает только последний опубликованный снимок - одна атомарная ссылка на неизменяемый объект.
+    """
+
+    def __init__(self):
+        self.guild_members = {}  # {guild_id: member_count}
+        self.members = 0
+        self.networks = 0
+        self.linked_channels = 0
+        self.published = None
+
+    # Серверы и участники
+    def reset_guilds(self, guilds):
+        """Полная синхронизация со списком серверов (при подключении к Discord)"""
+        self.guild_members = {guild.id: guild.member_count or 0 for guild in guilds}
+        self.members = sum(self.guild_members.values())
+
+    def set_guild(self, guild):
+        """Добавляет сервер или обновляет число его участников"""
+        self.members += (guild.member_count or 0) - self.guild_members.get(guild.id, 0)
+        self.guild_members[guild.id] = guild.member_count or 0
+
+    def remove_guild(self, guild_id):
+        self.members -= self.guild_members.pop(guild_id, 0)
+
+    def add_members(self, guild_id, delta):
+        if guild_id in self.guild_members:
+            self.guild_members[guild_id] += delta
+            self.members += delta
+
+    # Связанные каналы
+    def set_links(self, networks, linked_channels):
+        self.networks = networks
+        self.linked_channels = linked_channels
+
+    def get_counts(self):
+        return {
+            'servers': len(self.guild_members),
+            'users': self.members,
+            'networks': self.networks,
+            'linked_channels': self.linked_channels
+        }
+
+    def publish(self, extra):
+        """Собирает и публикует снимок; если данные не изменились, остаётся прежний снимок с прежним ETag"""
+        payload = {**self.get_counts(), **extra}
+        etag = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        if self.published is not None and self.published.etag == etag:
+            return self.published
+
+        payload['uptime'] = 'Online'
+        payload['last_updated'] = datetime.utcnow().isoformat()
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        # Снимок заменяется целиком: обработчик API отдаёт либо старый, либо новый
+        self.published = PublishedStats(body, etag, payload['last_updated'])
+        return self.published
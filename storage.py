@@ -0,0 +1,386 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import logging
+import asyncio
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import Config
+
+logger = logging.getLogger('DiscordBot.storage')
+
+LEVEL_FIELDS = ('xp', 'level', 'messages', 'last_message', 'daily_bonus_claimed')
+
+
+def atomic_write_json(path, data, **dump_kwargs):
+    """Атомарно записывает данные в JSON файл"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BaseStorage:
+    """Общая часть хранилищ: выделенный поток для операций ввода-вывода"""
+
+    # True, если хранилище умеет сохранять только изменённые записи
+    partial_writes = False
+
+    def __init__(self):
+        # Один рабочий поток: записи выполняются строго в порядке отправки
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+
+    def submit(self, fn, *args):
+        """Выполняет операцию в потоке хранилища, не дожидаясь результата"""
+        def call():
+            try:
+                return fn(*args)
+            except Exception as e:
+                logger.error("Ошибка хранилища в %s: %s", fn.__name__, e)
+                raise
+        return self.executor.submit(call)
+
+    async def run(self, fn, *args):
+        """Выполняет операцию в потоке хранилища и возвращает результат"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def close(self):
+        """Дожидается завершения отложенных операций и освобождает ресурсы"""
+        self.executor.shutdown(wait=True)
+
+
+class JsonStorage(BaseStorage):
+    """Хранилище в JSON файлах: каждый документ перезаписывается целиком"""
+
+    def __init__(self, channels_file=None, blacklist_file=None, levels_file=None):
+        super().__init__()
+        self.channels_file = channels_file or Config.CHANNELS_CONFIG_FILE
+        self.blacklist_file = blacklist_file or Config.BLACKLIST_FILE
+        self.levels_file = levels_file or Config.LEVELS_FILE
+        self._blacklist_version = None
+
+    # Каналы
+    def load_channels(self):
+        """Загружает конфигурацию связанных каналов"""
+        if not os.path.exists(self.channels_file):
+            return {}
+
+        with open(self.channels_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        # Проверяем формат данных и конвертируем старый формат в новый
+        if data and isinstance(list(data.values())[0], str):
+            # Старый формат: {channel_id: network_name}
+            logger.info("Конвертируем старый формат конфигурации в новый")
+            data = {
+                channel_id: {
+                    'network': network_name,
+                    'guild_id': None,
+                    'guild_name': 'Неизвестно',
+                    'channel_name': 'Неизвестно',
+                    'linked_at': datetime.utcnow().isoformat(),
+                    'linked_by': 'Неизвестно'
+                }
+                for channel_id, network_name in data.items()
+            }
+            self.save_channels(data)
+
+        return data
+
+    def save_channels(self, config, changed_ids=()):
+        """Сохраняет конфигурацию связанных каналов (файл перезаписывается целиком)"""
+        atomic_write_json(self.channels_file, config, indent=2)
+
+    # Чёрный список
+    def _get_blacklist_mtime(self):
+        try:
+            return os.stat(self.blacklist_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load_blacklist(self):
+        """Загружает чёрный список"""
+        self._blacklist_version = self._get_blacklist_mtime()
+        if not os.path.exists(self.blacklist_file):
+            return set()
+        try:
+            with open(self.blacklist_file, 'r', encoding='utf-8') as f:
+                return set(json.load(f))
+        except (json.JSONDecodeError, FileNotFoundError):
+            logger.warning("Не удалось загрузить чёрный список из %s", self.blacklist_file)
+            return set()
+
+    def blacklist_changed(self):
+        """Проверяет, был ли чёрный список изменён извне после последней загрузки или записи"""
+        return self._get_blacklist_mtime() != self._blacklist_version
+
+    def save_blacklist(self, user_ids, changed_ids=()):
+        """Сохраняет чёрный список (файл перезаписывается целиком)"""
+        atomic_write_json(self.blacklist_file, sorted(user_ids), indent=2)
+        self._blacklist_version = self._get_blacklist_mtime()
+
+    # Уровни
+    def load_levels(self):
+        """Загружает данные уровней"""
+        if not os.path.exists(self.levels_file):
+            return {}
+        with open(self.levels_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_levels(self, levels):
+        """Сохраняет данные уровней (ожидает полный набор записей)"""
+        atomic_write_json(self.levels_file, levels, separators=(',', ':'))
+
+    def load_level_columns(self):
+        """ID, XP и уровни всех пользователей по столбцам (для пакетной обработки)"""
+        levels = self.load_levels()
+        return (
+            list(levels),
+            array('q', (int(data.get('xp') or 0) for data in levels.values())),
+            array('q', (int(data.get('level') or 0) for data in levels.values()))
+        )
+
+    def update_level_values(self, levels):
+        """Записывает новые уровни [(user_id, level)] (файл перезаписывается целиком)"""
+        data = self.load_levels()
+        for user_id, level in levels:
+            if user_id in data:
+                data[user_id]['level'] = level
+        self.save_levels(data)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище в SQLite (WAL) с построчными upsert'ами"""
+
+    partial_writes = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id TEXT PRIMARY KEY,
+            network TEXT NOT NULL,
+            guild_id INTEGER,
+            guild_name TEXT,
+            channel_name TEXT,
+            linked_at TEXT,
+            linked_by TEXT
+        );
+        CREATE INDEX IF NOT EXISTS channels_network ON channels (network);
+        CREATE TABLE IF NOT EXISTS blacklist (
+            user_id TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS levels (
+            user_id TEXT PRIMARY KEY,
+            xp INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL DEFAULT 0,
+            messages INTEGER NOT NULL DEFAULT 0,
+            last_message REAL,
+            daily_bonus_claimed TEXT
+        );
+        CREATE INDEX IF NOT EXISTS levels_last_message ON levels (last_message);
+    """
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or Config.STORAGE_SQLITE_FILE
+        # Соединение используется и из потока хранилища, и при запуске, поэтому защищено блокировкой
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self._blacklist_version = None
+
+    # Каналы
+    def load_channels(self):
+        """Загружает конфигурацию связанных каналов"""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT channel_id, network, guild_id, guild_name, channel_name, linked_at, linked_by FROM channels"
+            ).fetchall()
+        return {
+            channel_id: {
+                'network': network,
+                'guild_id': guild_id,
+                'guild_name': guild_name,
+                'channel_name': channel_name,
+                'linked_at': linked_at,
+                'linked_by': linked_by
+            }
+            for channel_id, network, guild_id, guild_name, channel_name, linked_at, linked_by in rows
+        }
+
+    def save_channels(self, config, changed_ids=()):
+        """Сохраняет изменённые каналы (или синхронизирует всю таблицу, если изменения не указаны)
+
+        При указанных changed_ids config может содержать только изменённые каналы:
+        каналы из changed_ids, которых в нём нет, удаляются.
+        """
+        if changed_ids:
+            removed = [channel_id for channel_id in changed_ids if channel_id not in config]
+            config = {channel_id: config[channel_id] for channel_id in changed_ids if channel_id in config}
+        rows = [
+            (channel_id, info['network'], info.get('guild_id'), info.get('guild_name'),
+             info.get('channel_name'), info.get('linked_at'), info.get('linked_by'))
+            for channel_id, info in config.items()
+        ]
+        with self._lock, self.connection:
+            if not changed_ids:
+                existing = {row[0] for row in self.connection.execute("SELECT channel_id FROM channels")}
+                removed = existing - config.keys()
+            self.connection.executemany("DELETE FROM channels WHERE channel_id = ?", [(channel_id,) for channel_id in removed])
+            self.connection.executemany(
+                """INSERT INTO channels (channel_id, network, guild_id, guild_name, channel_name, linked_at, linked_by)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (channel_id) DO UPDATE SET
+                       network = excluded.network, guild_id = excluded.guild_id,
+                       guild_name = excluded.guild_name, channel_name = excluded.channel_name,
+                       linked_at = excluded.linked_at, linked_by = excluded.linked_by""",
+                rows
+            )
+
+    # Чёрный список
+    def _get_data_version(self):
+        # data_version меняется только при коммитах из других соединений
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def load_blacklist(self):
+        """Загружает чёрный список"""
+        with self._lock:
+            self._blacklist_version = self._get_data_version()
+            return {row[0] for row in self.connection.execute("SELECT user_id FROM blacklist")}
+
+    def blacklist_changed(self):
+        """Проверяет, была ли база изменена другим процессом после последней загрузки"""
+        with self._lock:
+            return self._get_data_version() != self._blacklist_version
+
+    def save_blacklist(self, user_ids, changed_ids=()):
+        """Сохраняет изменённые записи чёрного списка (или весь список, если изменения не указаны)"""
+        with self._lock, self.connection:
+            if not changed_ids:
+                self.connection.execute("DELETE FROM blacklist")
+                changed_ids = user_ids
+            for user_id in changed_ids:
+                if user_id in user_ids:
+                    self.connection.execute("INSERT OR IGNORE INTO blacklist (user_id) VALUES (?)", (user_id,))
+                else:
+                    self.connection.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,))
+
+    # Уровни
+    def load_levels(self, active_since=None):
+        """Загружает данные уровней (только писавших с active_since, если он задан)"""
+        query = "SELECT user_id, xp, level, messages, last_message, daily_bonus_claimed FROM levels"
+        params = ()
+        if active_since is not None:
+            query += " WHERE last_message >= ?"
+            params = (active_since,)
+        with self._lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return {row[0]: dict(zip(LEVEL_FIELDS, row[1:])) for row in rows}
+
+    def load_level(self, user_id):
+        """Загружает запись одного пользователя или None"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT xp, level, messages, last_message, daily_bonus_claimed FROM levels WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        return None if row is None else dict(zip(LEVEL_FIELDS, row))
+
+    def load_level_columns(self):
+        """ID, XP и уровни всех пользователей по столбцам (для пакетной обработки)"""
+        user_ids, xp, levels = [], array('q'), array('q')
+        with self._lock:
+            for user_id, xp_value, level in self.connection.execute("SELECT user_id, xp, level FROM levels"):
+                user_ids.append(user_id)
+                xp.append(xp_value)
+                levels.append(level)
+        return user_ids, xp, levels
+
+    def update_level_values(self, levels):
+        """Записывает новые уровни [(user_id, level)] одной транзакцией"""
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "UPDATE levels SET level = ? WHERE user_id = ?",
+                [(level, user_id) for user_id, level in levels]
+            )
+
+    def load_level_ranking(self, inactive_before):
+        """ID и XP неактивных пользователей в порядке рейтинга - компактные массивы без записей целиком"""
+        user_ids, xp = array('Q'), array('q')
+        with self._lock:
+            for user_id, value in self.connection.execute(
+                """SELECT user_id, xp FROM levels
+                   WHERE last_message IS NULL OR last_message < ?
+                   ORDER BY xp DESC, CAST(user_id AS INTEGER)""",
+                (inactive_before,)
+            ):
+                user_ids.append(int(user_id))
+                xp.append(value)
+        return user_ids, xp
+
+    def save_levels(self, levels):
+        """Сохраняет переданные записи уровней (upsert только изменённых пользователей)"""
+        rows = [
+            (user_id, data['xp'], data['level'], data['messages'], data.get('last_message'), data.get('daily_bonus_claimed'))
+            for user_id, data in levels.items()
+        ]
+        with self._lock, self.connection:
+            self.connection.executemany(
+                """INSERT INTO levels (user_id, xp, level, messages, last_message, daily_bonus_claimed)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (user_id) DO UPDATE SET
+                       xp = excluded.xp, level = excluded.level, messages = excluded.messages,
+                       last_message = excluded.last_message, daily_bonus_claimed = excluded.daily_bonus_claimed""",
+                rows
+            )
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self.connection.close()
+
+
+def create_storage():
+    """Создаёт хранилище согласно Config.STORAGE_BACKEND"""
+    if Config.STORAGE_BACKEND == 'sqlite':
+        return SQLiteStorage()
+    return JsonStorage()
+
+
+def migrate_json_to_sqlite(source=None, target=None):
+    """Переносит каналы, чёрный список и уровни из JSON файлов в SQLite"""
+    source = source or JsonStorage()
+    target = target or SQLiteStorage()
+    try:
+        channels = source.load_channels()
+        target.save_channels(channels)
+
+        blacklist = source.load_blacklist()
+        target.save_blacklist(blacklist)
+
+        levels = source.load_levels()
+        target.save_levels(levels)
+
+        return {'channels': len(channels), 'blacklist': len(blacklist), 'levels': len(levels)}
+    finally:
+        source.close()
+        target.close()
+
+
+if __name__ == "__main__":
+    # Разовый перенос данных: python storage.py migrate
+    if sys.argv[1:] != ['migrate']:
+        print("Использование: python storage.py migrate")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    counts = migrate_json_to_sqlite()
+    print(f"✅ Перенесено в {Config.STORAGE_SQLITE_FILE}: {counts['channels']} каналов, "
+          f"{counts['blacklist']} записей чёрного списка, {counts['levels']} пользователей с уровнями")
+    print("Установите STORAGE_BACKEND=sqlite, чтобы бот использовал новое хранилище")
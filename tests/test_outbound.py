@@ -0,0 +1,101 @@
+import os
+import time
+import unittest
+
+os.environ.setdefault('DISCORD_TOKEN', 'test-token')
+
+import discord
+from outbound import OutboundScheduler, PRIORITY_RELAY, get_rate_limit_key
+
+
+class SubmitRetryTest(unittest.IsolatedAsyncioTestCase):
+    """Повторы запросов планировщика после ограничения скорости"""
+
+    async def test_retries_after_rate_limited(self):
+        scheduler = OutboundScheduler(max_concurrency=1, max_queue_size=10, max_retries=3)
+        calls = []
+
+        async def request():
+            calls.append(1)
+            if len(calls) == 1:
+                # discord.py бросает RateLimited вместо ожидания, если пауза слишком длинная
+                raise discord.RateLimited(0.01)
+            return 'ok'
+
+        result = await scheduler.submit('webhook:1', request, PRIORITY_RELAY)
+
+        self.assertEqual(result, 'ok')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(scheduler.rate_limited, 1)
+        self.assertEqual(scheduler.retries, 1)
+
+    async def test_rate_limited_raised_after_last_attempt(self):
+        scheduler = OutboundScheduler(max_concurrency=1, max_queue_size=10, max_retries=1)
+
+        async def request():
+            raise discord.RateLimited(0.01)
+
+        with self.assertRaises(discord.RateLimited):
+            await scheduler.submit('webhook:1', request, PRIORITY_RELAY)
+        self.assertEqual(scheduler.rate_limited, 2)
+        self.assertEqual(scheduler.retries, 1)
+        self.assertEqual(scheduler.stats['relay']['failed'], 1)
+
+
+class RateLimitHeadersTest(unittest.IsolatedAsyncioTestCase):
+    """Настройка корзин по заголовкам X-RateLimit-* ответов Discord"""
+
+    @staticmethod
+    def headers(limit, remaining, reset_after):
+        return {
+            'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset-After': str(reset_after)
+        }
+
+    async def test_bucket_follows_headers(self):
+        scheduler = OutboundScheduler(max_concurrency=1, max_queue_size=10)
+
+        async def request():
+            # Так заголовки передаёт трассировка aiohttp, пока запрос ещё выполняется
+            scheduler.observe_response('webhook:1', self.headers(30, 29, 60))
+            return 'ok'
+
+        await scheduler.submit('webhook:1', request, PRIORITY_RELAY)
+        bucket = scheduler.buckets['webhook:1']
+        self.assertEqual(bucket.capacity, 30)
+        self.assertEqual(bucket.tokens, 29)
+        self.assertAlmostEqual(bucket.rate, 1 / 60)
+        self.assertEqual(bucket.outgoing, 0)
+        # Токены есть - следующий запрос уходит без ожидания
+        self.assertEqual(bucket.reserve(), 0)
+
+    async def test_exhausted_bucket_waits_for_reset(self):
+        scheduler = OutboundScheduler(max_concurrency=1, max_queue_size=10)
+
+        async def request():
+            scheduler.observe_response('channel:1', self.headers(5, 0, 0.2))
+            return 'ok'
+
+        await scheduler.submit('channel:1', request, PRIORITY_RELAY)
+        started = time.monotonic()
+        await scheduler.submit('channel:1', request, PRIORITY_RELAY)
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_unknown_keys_and_global_limits_are_ignored(self):
+        scheduler = OutboundScheduler(max_concurrency=1, max_queue_size=10)
+        scheduler.observe_response('webhook:2', self.headers(1, 0, 10))
+        self.assertNotIn('webhook:2', scheduler.buckets)
+
+        bucket = scheduler._get_bucket('webhook:3')
+        scheduler.observe_response('webhook:3', {**self.headers(1, 0, 10), 'X-RateLimit-Global': 'true'})
+        self.assertEqual(bucket.blocked_until, 0.0)
+
+    def test_rate_limit_key(self):
+        self.assertEqual(get_rate_limit_key('https://discord.com/api/v10/webhooks/123/token?wait=1'), 'webhook:123')
+        self.assertEqual(get_rate_limit_key('https://discord.com/api/v10/channels/456/messages'), 'channel:456')
+        self.assertIsNone(get_rate_limit_key('https://discord.com/api/v10/guilds/789/members'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import json
+import os
+import time
+from array import array
+from storage import atomic_write_json
+
+# Счётчики одного интервала
+FIELDS = ('messages', 'attachments', 'bytes', 'deliveries')
+
+# Окна: (название, длина интервала в секундах, число интервалов в кольце)
+WINDOWS = (
+    ('minute', 60, 60),      # Последний час поминутно
+    ('hour', 3600, 24),      # Последние сутки по часам
+    ('day', 86400, 30)       # Последние 30 дней по суткам
+)
+WINDOW_NAMES = tuple(name for name, _, _ in WINDOWS)
+
+
+class RingSeries:
+    """Кольцевой буфер счётчиков по интервалам фиксированной длины"""
+
+    __slots__ = ('interval', 'size', 'epochs', 'values')
+
+    def __init__(self, interval, size):
+        self.interval = interval
+        self.size = size
+        # Номер интервала, которому принадлежит ячейка (-1 - пусто), и счётчики FIELDS подряд
+        self.epochs = array('q', [-1]) * size
+        self.values = array('Q', [0]) * (size * len(FIELDS))
+
+    def add(self, now, amounts):
+        epoch = int(now // self.interval)
+        slot = epoch % self.size
+        offset = slot * len(FIELDS)
+        if self.epochs[slot] != epoch:
+            # Ячейка осталась от прошлого оборота - обнуляем
+            self.epochs[slot] = epoch
+            for index in range(len(FIELDS)):
+                self.values[offset + index] = 0
+        for index, amount in enumerate(amounts):
+            self.values[offset + index] += amount
+
+    def totals(self, now):
+        """Суммы за последние size интервалов (включая текущий)"""
+        oldest = int(now // self.interval) - self.size + 1
+        result = [0] * len(FIELDS)
+        for slot, epoch in enumerate(self.epochs):
+            if epoch >= oldest:
+                offset = slot * len(FIELDS)
+                for index in range(len(FIELDS)):
+                    result[index] += self.values[offset + index]
+        return result
+
+    def series(self, now):
+        """Значения по интервалам от старого к новому: [(начало интервала, [счётчики])]"""
+        current = int(now // self.interval)
+        result = []
+        for epoch in range(current - self.size + 1, current + 1):
+            slot = epoch % self.size
+            offset = slot * len(FIELDS)
+            if self.epochs[slot] == epoch:
+                result.append((epoch * self.interval, list(self.values[offset:offset + len(FIELDS)])))
+        return result
+
+    def to_dict(self):
+        return {'epochs': self.epochs.tolist(), 'values': self.values.tolist()}
+
+    def load(self, data):
+        if len(data['epochs']) == self.size and len(data['values']) == self.size * len(FIELDS):
+            self.epochs = array('q', data['epochs'])
+            self.values = array('Q', data['values'])
+
+
+class RollingCounter:
+    """Счётчики одной сети или сервера: поминутно за час, по часам за сутки и по дням за месяц"""
+
+    __slots__ = ('series',)
+
+    def __init__(self):
+        self.series = {name: RingSeries(interval, size) for name, interval, size in WINDOWS}
+
+    def add(self, now, amounts):
+        # Каждое событие сразу учитывается во всех окнах - агрегаты не нужно пересчитывать
+        for ring in self.series.values():
+            ring.add(now, amounts)
+
+    def totals(self, window, now):
+        return dict(zip(FIELDS, self.series[window].totals(now)))
+
+
+class ThroughputStats:
+    """Счётчики сообщений, вложений, байт и доставок по сетям и серверам"""
+
+    SCOPES = ('networks', 'guilds')
+
+    def __init__(self):
+        self.counters = {scope: {} for scope in self.SCOPES}
+
+    def _get(self, scope, key):
+        counter = self.counters[scope].get(key)
+        if counter is None:
+            counter = self.counters[scope][key] = RollingCounter()
+        return counter
+
+    def record(self, network, guild_id, attachments=0, size=0, deliveries=0, now=None):
+        """Учитывает одно пересланное сообщение"""
+        now = time.time() if now is None else now
+        amounts = (1, attachments, size, deliveries)
+        self._get('networks', network).add(now, amounts)
+        self._get('guilds', str(guild_id)).add(now, amounts)
+
+    def forget(self, scope, key):
+        """Удаляет счётчики сети или сервера"""
+        self.counters[scope].pop(key, None)
+
+    def totals(self, scope, key, window='hour', now=None):
+        counter = self.counters[scope].get(key)
+        if counter is None:
+            return dict.fromkeys(FIELDS, 0)
+        return counter.totals(window, time.time() if now is None else now)
+
+    def top(self, scope, window='hour', limit=10, field='messages', now=None):
+        """Возвращает самые активные сети или серверы за окно: [(ключ, {счётчики})]"""
+        now = time.time() if now is None else now
+        ranked = [(key, counter.totals(window, now)) for key, counter in list(self.counters[scope].items())]
+        ranked = [item for item in ranked if item[1]['messages']]
+        ranked.sort(key=lambda item: item[1][field], reverse=True)
+        return ranked[:limit]
+
+    def summary(self, limit=10, now=None):
+        """Сводка для API: топ сетей и серверов по каждому окну"""
+        now = time.time() if now is None else now
+        return {
+            scope: {
+                window: [dict(name=key, **totals) for key, totals in self.top(scope, window, limit, now=now)]
+                for window in WINDOW_NAMES
+            }
+            for scope in self.SCOPES
+        }
+
+    def to_dict(self):
+        """Снимок для сохранения (компактные списки чисел)"""
+        return {
+            scope: {
+                key: {window: ring.to_dict() for window, ring in counter.series.items()}
+                for key, counter in counters.items()
+            }
+            for scope, counters in self.counters.items()
+        }
+
+    def load(self, data):
+        """Восстанавливает счётчики из снимка; окна с другим размером пропускаются"""
+        for scope in self.SCOPES:
+            for key, windows in data.get(scope, {}).items():
+                counter = self._get(scope, key)
+                for window, ring_data in windows.items():
+                    if window in counter.series:
+                        counter.series[window].load(ring_data)
+
+
+def save_snapshot(path, snapshot):
+    """Записывает снимок счётчиков (вызывается в потоке хранилища)"""
+    atomic_write_json(path, snapshot, separators=(',', ':'))
+
+
+def load_snapshot(path):
+    """Читает снимок счётчиков; пустой снимок, если файла нет или он повреждён"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return {}
@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+
+
+class TimerWheel:
+    """Хешированное колесо таймеров: планирование и снятие за O(1), продвижение - только по наступившим слотам"""
+
+    def __init__(self, tick=1.0, slots=64):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        # {key: (срок, поколение)}; записи слотов - (key, поколение), записи чужого поколения устарели
+        self.deadlines = {}
+        self.generation = 0
+        self.current_tick = int(time.time() // tick)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def _insert(self, key, generation, deadline):
+        # Срок в прошлом попадает в ближайший ещё не пройденный слот
+        deadline_tick = max(int(deadline // self.tick), self.current_tick + 1)
+        self.slots[deadline_tick % len(self.slots)].append((key, generation))
+
+    def schedule(self, key, deadline):
+        """Назначает (или переносит) срок для ключа; перенос на более поздний срок не создаёт новых записей"""
+        current = self.deadlines.get(key)
+        if current is not None and deadline >= current[0]:
+            self.deadlines[key] = (deadline, current[1])
+            return
+        # Новая запись получает новое поколение: прежняя запись ключа в слоте станет устаревшей
+        self.generation += 1
+        self.deadlines[key] = (deadline, self.generation)
+        self._insert(key, self.generation, deadline)
+
+    def cancel(self, key):
+        """Снимает таймер ключа (запись в слоте устаревает и удаляется, когда слот наступит)"""
+        self.deadlines.pop(key, None)
+
+    def advance(self, now=None):
+        """Продвигает колесо до момента now и возвращает ключи с истёкшим сроком"""
+        now = time.time() if now is None else now
+        target_tick = int(now // self.tick)
+        if target_tick <= self.current_tick:
+            return []
+
+        # Если прошло больше полного оборота, достаточно один раз обойти все слоты
+        first_tick = max(self.current_tick + 1, target_tick - len(self.slots) + 1)
+        self.current_tick = target_tick
+
+        expired = []
+        for tick in range(first_tick, target_tick + 1):
+            index = tick % len(self.slots)
+            entries = self.slots[index]
+            if not entries:
+                continue
+            self.slots[index] = []
+            for key, generation in entries:
+                current = self.deadlines.get(key)
+                if current is None or current[1] != generation:
+                    continue  # Таймер снят, уже сработал или назначен заново другой записью
+                deadline = current[0]
+                if deadline <= now:
+                    del self.deadlines[key]
+                    expired.append(key)
+                else:
+                    # Срок перенесён или ещё не наступил (дальше одного оборота) - переставляем запись
+                    self._insert(key, generation, deadline)
+        return expired
+
+
+class TTLMap:
+    """Словарь с ограниченным сроком жизни записей (одинаковым для всех ключей)
+
+    Записи хранятся в порядке последнего обновления, поэтому самые старые всегда в начале:
+    устаревшие удаляются лениво при чтении и небольшими порциями при каждой записи.
+    """
+
+    def __init__(self, ttl, sweep_batch=16):
+        self.ttl = ttl
+        self.sweep_batch = sweep_batch
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, now=None):
+        """Возвращает значение ключа или None, если записи нет или срок её жизни истёк"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        now = time.time() if now is None else now
+        updated, value = item
+        if now - updated >= self.ttl:
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key, value, now=None):
+        """Записывает значение и продлевает срок жизни ключа"""
+        now = time.time() if now is None else now
+        self._data[key] = (now, value)
+        self._data.move_to_end(key)
+        self.sweep(now, self.sweep_batch)
+
+    def sweep(self, now=None, limit=None):
+        """Удаляет устаревшие записи с начала (не больше limit) и возвращает их число"""
+        now = time.time() if now is None else now
+        removed = 0
+        while self._data and (limit is None or removed < limit):
+            key, (updated, _) = next(iter(self._data.items()))
+            if now - updated < self.ttl:
+                break
+            del self._data[key]
+            removed += 1
+        return removed